@@ -36,6 +36,26 @@ class ReviewRatingAdmin(admin.ModelAdmin):
 class TokenBlacklistLogoutAdmin(admin.ModelAdmin):
     list_display = ('user','is_expired','expire_datetime','token')
 
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('place_key', 'latitude', 'longitude', 'expires_at')
+    search_fields = ['place_key']
+
+class RouteDistanceCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('route_key', 'distance_km', 'expires_at')
+    search_fields = ['route_key']
+
+class LocationTokenAdmin(admin.ModelAdmin):
+    list_display = ('carpool', 'point', 'kind', 'token')
+    search_fields = ['token']
+
+class PlaceEdgeAdmin(admin.ModelAdmin):
+    list_display = ('from_place', 'to_place', 'carpool_count')
+    search_fields = ['from_place', 'to_place']
+
+class DriverRatingStatsAdmin(admin.ModelAdmin):
+    list_display = ('driver', 'review_count', 'rating_sum', 'average_rating')
+    search_fields = ['driver__username']
+
 admin.site.register(User, UserAdmin)
 admin.site.register(UserDashboardInfo,UserDashboardInfoAdmin)
 admin.site.register(CreateCarpool,CreateCarpoolAdmin)
@@ -43,4 +63,9 @@ admin.site.register(Booking,BookingAdmin)
 admin.site.register(Activity,ActivityAdmin) 
 admin.site.register(Contact,ContactAdmin)
 admin.site.register(ReviewRating,ReviewRatingAdmin)
-admin.site.register(TokenBlacklistLogout,TokenBlacklistLogoutAdmin)
\ No newline at end of file
+admin.site.register(TokenBlacklistLogout,TokenBlacklistLogoutAdmin)
+admin.site.register(GeocodeCacheEntry,GeocodeCacheEntryAdmin)
+admin.site.register(RouteDistanceCacheEntry,RouteDistanceCacheEntryAdmin)
+admin.site.register(LocationToken,LocationTokenAdmin)
+admin.site.register(PlaceEdge,PlaceEdgeAdmin)
+admin.site.register(DriverRatingStats,DriverRatingStatsAdmin)
\ No newline at end of file
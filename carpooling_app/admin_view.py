@@ -7,11 +7,11 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from datetime import datetime, timedelta
-from carpooling_app.utils import ride_status_function
 from .user_auth import activity
 from .custom_jwt_auth import *
 from .models import *
 from .serializers import *
+from .query_budget import query_budget
 import io, json
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -75,6 +75,7 @@ def admin_active_deactive_user(request):
         return Response({"status": "fail", "message": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
 ## View all Carpool
+@query_budget(8)
 @api_view(['GET'])
 @permission_classes([IsAdminCustom])
 def admin_view_carpools(request):
@@ -86,14 +87,14 @@ def admin_view_carpools(request):
     If there are no carpools found, it will return a 404 status code with a message "No carpools found".
     """
     try:
-        ride_status_function(request)
-        carpools = CreateCarpool.objects.all().order_by("-created_at")
+        carpools = CreateCarpool.objects.with_effective_status().order_by("-created_at")
         serializer = CreateCarpoolSerializer(carpools, many=True)
         return Response({"status": "success", "Carpools": serializer.data}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 ## View all Bookings
+@query_budget(8)
 @api_view(['GET'])
 @permission_classes([IsAdminCustom])
 def admin_view_bookings(request):
@@ -103,8 +104,7 @@ def admin_view_bookings(request):
     Only accessible to admin users.
     """
     try:
-        ride_status_function(request)
-        bookings = Booking.objects.all().order_by("-booked_at")
+        bookings = Booking.objects.with_effective_status().order_by("-booked_at")
         serializer = BookingDetailSerializer(bookings, many=True)
         return Response({"status": "success", "Bookings": serializer.data}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -199,8 +199,8 @@ def user_dashboard_report_export(request):
         if start_date:
             try:
                 start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-                carpools = carpools.filter(departure_time__date__gte=start_date_obj)
-                bookings = bookings.filter(booked_at__date__gte=start_date_obj)
+                carpools = carpools.filter(departure_time__gte=start_date_obj)
+                bookings = bookings.filter(booked_at__gte=start_date_obj)
             except ValueError:
                 return Response({"status": "error", "message": "Invalid start_date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
 
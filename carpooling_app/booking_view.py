@@ -10,7 +10,8 @@ from .user_auth import activity
 from .utils import *
 from django.core.mail import EmailMultiAlternatives
 from django.utils.html import strip_tags
-from django.db.models import Avg
+from .rating_stats import RATING_VALUES, average_rating_of
+from .query_budget import query_budget
 
 # Book a seat in carpool (Only Logged-in(Registered) user can book only available upcomming carpools)
 @api_view(['POST'])
@@ -51,54 +52,14 @@ def book_carpool(request):
     drop_lat = request.data.get("drop_latitude")
     drop_lon = request.data.get("drop_longitude")
 
+    # A distance given by the client is used as is, otherwise the enrichment worker fills distance,
+    # coordinates and contribution_amount after the booking is saved (see enrichment.py)
     distance_travelled = request.data.get("distance_travelled")
     try:
-        if distance_travelled is not None and float(distance_travelled) != 0:
-            distance_travelled = float(distance_travelled)
-        else:
-            # If precise coordinates for pickup/drop given, use them
-            if pickup_lat and pickup_lon and drop_lat and drop_lon:
-                try:
-                    distance_travelled = get_road_distance_osrm(float(pickup_lat), float(pickup_lon),float(drop_lat), float(drop_lon))
-                    if distance_travelled is None:
-                        # fallback to old method if OSRM fails
-                        distance_travelled = auto_calculate_distance( pickup_location or "", drop_location or "",
-                                                                start_lat = float(pickup_lat), start_lon=float(pickup_lon), end_lat = float(drop_lat), end_lon=float(drop_lon))
-
-                except Exception:
-                    distance_travelled = 0.0
-
-            # Else if pickup/drop text provided, estimate between those two points
-            elif pickup_location and drop_location:
-                try:
-                    # Try OSRM using geocoded coordinates
-                    start_lat, start_lon = get_lat_lng_cached(pickup_location)
-                    end_lat, end_lon = get_lat_lng_cached(drop_location)
-                    distance_travelled = get_road_distance_osrm(start_lat, start_lon, end_lat, end_lon)
-                    if distance_travelled is None:
-                        distance_travelled = auto_calculate_distance(pickup_location, drop_location)
-                except Exception:
-                    distance_travelled = 0.0
-            else:
-                try:
-                    carpool_obj = CreateCarpool.objects.get(pk=get_carpool_id)
-                    distance_travelled = get_road_distance_osrm(carpool_obj.latitude_start, carpool_obj.longitude_start, carpool_obj.latitude_end, carpool_obj.longitude_end)
-
-                    if distance_travelled is None:
-                        distance_travelled = auto_calculate_distance(
-                            carpool_obj.start_location,
-                            carpool_obj.end_location,
-                            start_lat = carpool_obj.latitude_start,
-                            start_lon = carpool_obj.longitude_start,
-                            end_lat = carpool_obj.latitude_end,
-                            end_lon = carpool_obj.longitude_end
-                        )
-                except CreateCarpool.DoesNotExist:
-                    distance_travelled = 0.0
-                except Exception:
-                    distance_travelled = 0.0
-    except Exception:
+        distance_travelled = float(distance_travelled) if distance_travelled is not None else 0.0
+    except (TypeError, ValueError):
         distance_travelled = 0.0
+    enrichment_status = "done" if distance_travelled != 0 else "pending"
 
     try:
         with transaction.atomic():
@@ -130,7 +91,13 @@ def book_carpool(request):
                 pickup_location = pickup_location,
                 drop_location = drop_location,
                 contact_info = contact_info,
-                booking_status = status_booking
+                booking_status = status_booking,
+                pickup_latitude = float(pickup_lat) if pickup_lat and pickup_lon else None,
+                pickup_longitude = float(pickup_lon) if pickup_lat and pickup_lon else None,
+                drop_latitude = float(drop_lat) if drop_lat and drop_lon else None,
+                drop_longitude = float(drop_lon) if drop_lat and drop_lon else None,
+                enrichment_status = enrichment_status,
+                enrichment_retry_at = timezone.now() if enrichment_status == "pending" else None
             )
 
             if user.role != "passenger":
@@ -139,7 +106,11 @@ def book_carpool(request):
 
             activity(user, f"{user.username} {status_booking} booking {booking.booking_id} for carpool {carpool.createcarpool_id}")
             send_booking_email(booking, status_booking)
-            trip_details = calculate_passenger_trip_details(carpool,float(pickup_lat),float(pickup_lon),float(drop_lat),float(drop_lon))
+            # Trip details need the road distances, they are filled once enrichment is done
+            if enrichment_status == "done" and pickup_lat and pickup_lon and drop_lat and drop_lon:
+                trip_details = calculate_passenger_trip_details(carpool,float(pickup_lat),float(pickup_lon),float(drop_lat),float(drop_lon))
+            else:
+                trip_details = empty_trip_details()
 
             serializer = BookingDetailSerializer(booking)
             response_data = km_inr_format(serializer.data)
@@ -160,33 +131,40 @@ def my_bookings_info(request):
     user = request.user
     try:
         current_time = timezone.now()
-        ride_status_function(request)  # update ride status
 
-        upcoming_bookings = Booking.objects.filter(
+        upcoming_bookings = Booking.objects.with_effective_status(current_time).filter(
             passenger_name=user,
             carpool_driver_name__departure_time__gte=current_time
         ).order_by("carpool_driver_name__departure_time")
 
-        past_bookings = Booking.objects.filter(
+        past_bookings = Booking.objects.with_effective_status(current_time).filter(
             passenger_name=user,
             carpool_driver_name__departure_time__lt=current_time
         ).order_by("-carpool_driver_name__departure_time")
 
+        # Use coordinates if available
+        def trip_points(booking):
+            carpool = booking.carpool_driver_name
+            pickup = (booking.pickup_latitude or carpool.latitude_start, booking.pickup_longitude or carpool.longitude_start)
+            drop = (booking.drop_latitude or carpool.latitude_end, booking.drop_longitude or carpool.longitude_end)
+            return pickup, drop
+
         def enrich_bookings(bookings):
+            # Road distances the enrichment worker stored in the route cache, one lookup and no OSRM calls (straight line where missing)
+            trips = [(booking.carpool_driver_name, *trip_points(booking)) for booking in bookings]
             enriched = []
-            for booking in bookings:
+            for booking, trip, road_km in zip(bookings, trips, cached_trip_road_distances(trips)):
                 serializer_data = BookingDetailSerializer(booking).data
-                carpool = booking.carpool_driver_name
-
-                # Use coordinates if available
-                pickup_lat, pickup_lon = booking.pickup_latitude or carpool.latitude_start, booking.pickup_longitude or carpool.longitude_start
-                drop_lat, drop_lon = booking.drop_latitude or carpool.latitude_end, booking.drop_longitude or carpool.longitude_end
+                carpool, (pickup_lat, pickup_lon), (drop_lat, drop_lon) = trip
 
-                trip_info = calculate_passenger_trip_details(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon)
+                trip_info = calculate_passenger_trip_details(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon, road_km=road_km)
                 serializer_data.update(trip_info)
                 enriched.append(serializer_data)
             return enriched
 
+        upcoming_bookings = list(BookingDetailSerializer.setup_eager_loading(upcoming_bookings))
+        past_bookings = list(BookingDetailSerializer.setup_eager_loading(past_bookings))
+
         data = {
             "upcoming_bookings": enrich_bookings(upcoming_bookings),
             "past_bookings": enrich_bookings(past_bookings)
@@ -316,6 +294,7 @@ def cancel_booking(request):
                     carpool.save()
 
             booking.booking_status = "cancelled"
+            booking.ride_status = "cancelled"
             booking.save()
 
             activity(user, f"{user.username} cancelled booking {get_booking_id}")
@@ -328,6 +307,7 @@ def cancel_booking(request):
         return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 ## sort/filter for user of his booking , like sort according to time, date, etc...
+@query_budget(8)
 @api_view(['POST'])
 @permission_classes([IsDriverOrPassengerCustom])
 def filter_bookings(request):
@@ -345,10 +325,9 @@ def filter_bookings(request):
     user = request.user
     filter_by = request.data.get("filter_by")
     sort_by = request.data.get("sort_by")
-    ride_status_function(request)
 
     try:
-        bookings = Booking.objects.filter(passenger_name=user)
+        bookings = Booking.objects.with_effective_status().filter(passenger_name=user)
 
         if filter_by == "upcoming":
             bookings = bookings.filter(carpool_driver_name__departure_time__gte=timezone.now())
@@ -372,6 +351,7 @@ def filter_bookings(request):
 #-------- DRIVER ONLY --------#
 
 ## booking request from passenger view for driver role.
+@query_budget(8)
 @api_view(['GET'])
 @permission_classes([IsDriverCustom])
 def driver_view_booking_requests(request):
@@ -464,6 +444,7 @@ def driver_approve_reject_booking(request):
         return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 ## view each confirmed booking passenger for each carpool
+@query_budget(8)
 @api_view(['GET'])
 @permission_classes([IsDriverCustom])
 def view_booked_passenger(request):
@@ -480,13 +461,10 @@ def view_booked_passenger(request):
         if not carpools.exists():
             return Response({"status":"fail","message":"You have no carpools"}, status=status.HTTP_404_NOT_FOUND)
 
-        all_confirmed_bookings = []
-        for carpool in carpools:
-            confirmed_bookings = carpool.bookings.filter(booking_status="confirmed").order_by("booked_at")
-
-            if confirmed_bookings.exists():
-                serializer = BookingDetailSerializer(confirmed_bookings, many=True)
-                all_confirmed_bookings.extend(serializer.data)
+        # confirmed bookings of all carpools in one query, grouped by carpool in the order above
+        confirmed_bookings = Booking.objects.filter(carpool_driver_name__carpool_creator_driver=user, booking_status="confirmed").order_by(
+            "-carpool_driver_name__created_at", "-carpool_driver_name__createcarpool_id", "booked_at")
+        all_confirmed_bookings = BookingDetailSerializer(confirmed_bookings, many=True).data
 
         if not all_confirmed_bookings:
             return Response({"status":"fail","message":"No confirmed bookings found for your carpools"}, status=status.HTTP_404_NOT_FOUND)
@@ -527,7 +505,8 @@ def ride_reminder_notifications(request):
         print("##### Current Time >>>", current_time)
 
         future_bookings = Booking.objects.filter(carpool_driver_name__carpool_creator_driver=user,booking_status__iexact="confirmed",
-                                        carpool_driver_name__departure_time__gt=current_time).select_related("carpool_driver_name").order_by("carpool_driver_name__departure_time")
+                                        carpool_driver_name__departure_time__gt=current_time).order_by("carpool_driver_name__departure_time")
+        future_bookings = BookingSerializer.setup_eager_loading(future_bookings)
 
         print("##### future_bookings >>>", future_bookings)
 
@@ -652,7 +631,7 @@ def give_review_rating(request):
                 return Response({"status":"fail","message": "rating must be between 1 and 5"}, status=status.HTTP_400_BAD_REQUEST)
         except ValueError:
             return Response({"status":"fail","message": "rating must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
-        # Create review
+        # Create review (ReviewRating.save() also counts it in the driver's rating stats)
         review = ReviewRating.objects.create(
             review_given_by=user,
             review_for=review_for,
@@ -678,6 +657,7 @@ def give_review_rating(request):
         return Response({"status": "error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 ## view driver info
+@query_budget(10)
 @api_view(["POST"])
 @permission_classes([IsAuthenticatedCustom])
 def view_driver_info(request):
@@ -688,10 +668,11 @@ def view_driver_info(request):
     - total_carpools
     - total_reviews
     - average_rating
+    - rating_histogram (number of reviews per rating 1-5)
     """
     get_driver_user_id = request.data.get("driver_user_id")
     try:
-        get_driver = User.objects.get(user_id=get_driver_user_id)
+        get_driver = User.objects.select_related("rating_stats").get(user_id=get_driver_user_id)
 
         driver_data = {
             "first_name": get_driver.first_name,
@@ -702,10 +683,13 @@ def view_driver_info(request):
 
         total_carpools = CreateCarpool.objects.filter(carpool_creator_driver=get_driver).count()
 
-        reviews_queryset = ReviewRating.objects.filter(review_for=get_driver).order_by("-created_at")
-        total_reviews = reviews_queryset.count()
-        avg_rating = reviews_queryset.aggregate(Avg("rating"))["rating__avg"] or 0
-        avg_rating = round(float(avg_rating), 2) if total_reviews else 0
+        # totals from the driver's rating stats row (kept up to date on every review, see rating_stats.py)
+        rating_stats = getattr(get_driver, "rating_stats", None)
+        total_reviews = rating_stats.review_count if rating_stats else 0
+        avg_rating = average_rating_of(get_driver)
+        rating_histogram = rating_stats.histogram if rating_stats else {value: 0 for value in RATING_VALUES}
+
+        reviews_queryset = ReviewRating.objects.filter(review_for=get_driver).select_related("review_given_by").order_by("-created_at")
 
         reviews_data = []
         for review in reviews_queryset[:5]:
@@ -722,6 +706,7 @@ def view_driver_info(request):
             "total_carpools": total_carpools,
             "total_reviews": total_reviews,
             "average_rating": avg_rating,
+            "rating_histogram": rating_histogram,
             "recent_reviews": reviews_data
         }
 
@@ -3,25 +3,38 @@ from .user_auth import activity
 from .utils import *
 from .models import CreateCarpool
 from .serializers import CreateCarpoolSerializer
+from .geo_index import bounding_box_q, covering_cells, prefilter_candidates
+from .distance_kernel import carpool_distance_checks, check_at, distances_km
+from .spatial_index import carpool_index
+from .location_tokens import matching_carpool_ids
+from .ranking import score_carpools
+from .feed_cache import cached_feed
+from .pagination import decode_cursor, encode_cursor, keyset_page, parse_limit, ranked_page
+from .query_budget import query_budget
 from .custom_jwt_auth import IsAdminOrDriverCustom, IsAuthenticatedCustom, IsDriverCustom, IsDriverOrPassengerCustom
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from django.db import transaction
 from django.utils import timezone
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from rest_framework.permissions import AllowAny
 
+# Radius (KM) used by find_nearby_carpools
+NEARBY_RADIUS_KM = 10
+
 #-------- PUBLIC (Anyone can see this details) --------#
 
 # Carpool list (public)
+@query_budget(5)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def carpool_detail(request):
     """
     This API will fetch the details of all the public carpools created by drivers.
     It will only show the upcoming carpools with available seats more than 0.
-    The carpools will be sorted in descending order of departure time.
+    The carpools will be sorted in descending order of departure time, `limit` per page.
+    - Query params: limit (optional), cursor (optional, "next_cursor" of the previous page).
     - Returns a JSON response with the status, message and data of the public carpools.
     - The data will contain the details of the carpools in the following format: 
         {
@@ -34,18 +47,33 @@ def carpool_detail(request):
                     "departure_time": ...,
                     "available_seats": ...,
                 }
-            ]
+            ],
+            "next_cursor": ... (null on the last page)
         }
     - If there are no public carpools available, it will return a 404 status code with a message "No carpools found".
     """
     try:
-        ride_status_function(request)
-        current_time = timezone.now()
-        public_carpools = CreateCarpool.objects.filter(departure_time__gte=current_time, available_seats__gt=0).order_by('-created_at')
+        cursor = request.query_params.get("cursor")
+        try:
+            limit = parse_limit(request.query_params.get("limit"))
+        except (TypeError, ValueError):
+            return Response({"status": "fail", "message": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        def build_page():
+            current_time = timezone.now()
+            public_carpools = CreateCarpool.objects.with_effective_status(current_time).filter(departure_time__gte=current_time, available_seats__gt=0)
+            public_carpools = CreateCarpoolSerializer.setup_eager_loading(public_carpools)
+            public_carpools, next_cursor = keyset_page(public_carpools, cursor, limit, descending=True)
+            return {"Carpools details": list(km_inr_format(CreateCarpoolSerializer(public_carpools, many=True).data)), "next_cursor": next_cursor}
+
+        # cached per page, dropped on any carpool write (feed_cache.py)
+        try:
+            page, _ = cached_feed({"cursor": cursor, "limit": limit}, build_page)
+        except ValueError:
+            return Response({"status": "fail", "message": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if len(public_carpools) != 0:
-            serializer = CreateCarpoolSerializer(public_carpools, many=True)
-            return Response({ "status": "success", "message": "carpool details fetched", "data":{"Carpools details": km_inr_format(serializer.data)}}, status=status.HTTP_200_OK)
+        if len(page["Carpools details"]) != 0:
+            return Response({ "status": "success", "message": "carpool details fetched", "data": page}, status=status.HTTP_200_OK)
         else:
             return Response({"status":"fail", "message": "No carpool published yet."}, status= status.HTTP_404_NOT_FOUND)
 
@@ -53,11 +81,15 @@ def carpool_detail(request):
         return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
  
 # Search carpools (public) - show only upcoming rides with seats more than 0 , expired time ride hidden
+@query_budget(30)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def search_carpools(request):
     """
     Smart search with location name + coordinates support.
+    Matches are ranked by relevance (ranking.py) and returned `limit` per page.
+    `available_seats` (optional) is the number of seats wanted, used for ranking.
+    `cursor` (optional) is the "next_cursor" of the previous page.
     """
     start = request.data.get("start_location", "").strip()
     end = request.data.get("end_location", "").strip()
@@ -67,15 +99,30 @@ def search_carpools(request):
     end_latitude = request.data.get("end_latitude")
     end_longitude = request.data.get("end_longitude")
 
+    try:
+        limit = parse_limit(request.data.get("limit"))
+        seats_needed = max(int(request.data.get("available_seats") or 1), 1)
+        # cursor: [ranking time, -score, id] of the last result of the previous page
+        after = decode_cursor(request.data.get("cursor"), 3)
+    except (TypeError, ValueError):
+        return Response({"status": "fail", "message": "limit and available_seats must be positive integers, cursor must come from a previous page"}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
         # Base query: upcoming rides with available seats
-        qs = CreateCarpool.objects.filter(available_seats__gt=0, departure_time__gte=timezone.now())
+        qs = CreateCarpoolSerializer.setup_eager_loading(CreateCarpool.objects.filter(available_seats__gt=0, departure_time__gte=timezone.now()))
 
-        # Date filter (optional)
+        # Date filter (optional), as a departure_time range so the index can be used
         if date:
-            qs = qs.filter(departure_time__icontains=date)
+            try:
+                day_start, day_end = day_range(date)
+            except ValueError:
+                return Response({"status": "fail", "message": "Invalid date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+            qs = qs.filter(departure_time__gte=day_start, departure_time__lt=day_end)
 
         final_results = []
+        # later pages are scored against the time of the first one, so the order stays the same across pages
+        ranked_at = after[0] if after else timezone.now()
+        wanted_time = max(day_start, ranked_at) if date else ranked_at
 
         # Get user's start/end coordinates either from request OR geocoding
         if start_latitude and start_longitude:
@@ -91,46 +138,54 @@ def search_carpools(request):
         print(">>>> User start coordinates:", user_start_lat, user_start_lon)
         print(">>>> User end coordinates:", user_end_lat, user_end_lon)
 
-        # Iterate over base query
-        for carpool in qs:
-            # Calculate distance if not set
-            if not carpool.distance_km or float(carpool.distance_km) == 0:
-                carpool.distance_km = auto_calculate_distance(
-                    carpool.start_location,
-                    carpool.end_location,
-                    start_lat=carpool.latitude_start,
-                    start_lon=carpool.longitude_start,
-                    end_lat=carpool.latitude_end,
-                    end_lon=carpool.longitude_end
-                )
-                carpool.save(update_fields=['distance_km'])
+        # Carpools starting near the user from the in-memory index (None if stale, the bounding box is used then)
+        nearby_ids = carpool_index.nearby_ids(user_start_lat, user_start_lon, LOCATION_MATCH_RADIUS_KM) if user_start_lat and user_start_lon else None
+
+        # Load only rows the start match can accept (text match or near the user)
+        candidates, _ = prefilter_candidates(qs, location_match_q(start, "start", user_start_lat, user_start_lon, nearby_ids))
 
+        # Distances / on-route checks for all candidates in one vectorized pass
+        checks = carpool_distance_checks(candidates, user_start_lat, user_start_lon, user_end_lat, user_end_lon, LOCATION_MATCH_RADIUS_KM)
+
+        # Iterate over prefiltered candidates (read only: a missing distance_km is filled by the enrichment worker / backfill,
+        # such rows are returned as they are and flagged by their enrichment_status)
+        for i, carpool in enumerate(candidates):
             print(">>>> Carpool start coordinates:", carpool.latitude_start, carpool.longitude_start)
             print(">>>> Carpool end coordinates:", carpool.latitude_end, carpool.longitude_end)
 
             # Start location match (name OR coordinate)
-            start_match = matches_location(start,carpool.start_location,user_start_lat,user_start_lon,carpool.latitude_start,carpool.longitude_start)
+            start_match = matches_location(start,carpool.start_location,user_start_lat,user_start_lon,carpool.latitude_start,carpool.longitude_start,
+                                           distance_km=check_at(checks["start_distance"], i))
 
             # End location match (name OR coordinate)
-            end_match = matches_route( end,carpool,user_end_lat,user_end_lon)
+            end_match = matches_route(end,carpool,user_end_lat,user_end_lon,
+                                      end_distance_km=check_at(checks["end_distance"], i), on_route=check_at(checks["end_on_route"], i))
 
             print(">>>> Start match:", start_match)
             print(">>>> End match:", end_match)
 
             if start_match and end_match:
-                final_results.append(carpool)
+                final_results.append(i)
 
         if not final_results:
             return Response({"status": "fail", "message": "No carpools found"}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = CreateCarpoolSerializer(final_results, many=True)
+        # Rank the matches and keep the best `limit` after the cursor, so only those are serialized
+        matches = [candidates[i] for i in final_results]
+        match_checks = {name: None if values is None else values[final_results] for name, values in checks.items()}
+        scores = score_carpools(matches, match_checks, user_end_lat, user_end_lon, LOCATION_MATCH_RADIUS_KM, wanted_time, seats_needed)
+        page, last_key = ranked_page([(-score, carpool.createcarpool_id) for score, carpool in zip(scores, matches)], after[1:] if after else None, limit)
+        next_cursor = encode_cursor([ranked_at, *last_key]) if last_key else None
+
+        serializer = CreateCarpoolSerializer([matches[i] for i in page], many=True)
         formatted_data = km_inr_format(serializer.data)
-        return Response({"status": "success","message": "Carpools fetched","data": {"Carpools": formatted_data}}, status=status.HTTP_200_OK)
+        return Response({"status": "success","message": "Carpools fetched","data": {"total_matches": len(matches), "Carpools": formatted_data, "next_cursor": next_cursor}}, status=status.HTTP_200_OK)
 
     except Exception as e:
         return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 ## sort carpools by date, location, available seats, departure time, arrivval time, luggage.
+@query_budget(10)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def sort_carpools_by(request):
@@ -144,16 +199,18 @@ def sort_carpools_by(request):
     available_seats (integer): The minimum number of available seats in the carpools.
     gender_preference (string): The preferred gender of the driver.
     luggage (boolean): Whether luggage is allowed or not.
+    limit (integer): Carpools per page.
+    cursor (string): "next_cursor" of the previous page.
 
     Returns:
-    Response: A JSON response with the status, message and data of the sorted carpools.
+    Response: A JSON response with the status, message and data of the sorted carpools, latest departure first.
     If there are no carpools found, it will return a 404 status code with a message "No matching Carpools found".
     """
     user = request.user
     currunt_time = timezone.now()
     try:
 
-        queryset = CreateCarpool.objects.filter(available_seats__gt = 0,departure_time__gte = currunt_time).order_by('-departure_time')
+        queryset = CreateCarpoolSerializer.setup_eager_loading(CreateCarpool.objects.with_effective_status(currunt_time).filter(available_seats__gt = 0,departure_time__gte = currunt_time))
 
         start_location = request.data.get('start_location')
         end_location = request.data.get('end_location')
@@ -163,14 +220,18 @@ def sort_carpools_by(request):
         luggage = request.data.get("luggage_allowed")
         prefer_ev_vehicle = request.data.get("prefer_ev_vehicle")
         
-        if start_location:
-            queryset = queryset.filter(start_location__icontains = start_location)
-
-        if end_location:
-            queryset = queryset.filter(end_location__icontains = end_location)
+        # location filters resolve through the token index (location_tokens.py) instead of LIKE '%x%' scans
+        for point, location in (("start", start_location), ("end", end_location)):
+            matching_ids = matching_carpool_ids(location, point) if location else None
+            if matching_ids is not None:
+                queryset = queryset.filter(createcarpool_id__in = matching_ids)
 
         if date:
-            queryset = queryset.filter(departure_time__icontains = date)
+            try:
+                day_start, day_end = day_range(date)
+            except ValueError:
+                return Response({"status": "fail", "message": "Invalid date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(departure_time__gte = day_start, departure_time__lt = day_end)
 
         if luggage is not None:
             luggage_bool = str(luggage).lower() == "true"
@@ -190,27 +251,35 @@ def sort_carpools_by(request):
             except:
                 return Response({"status": "fail", "message": "available_seats must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not queryset.exists():
+        try:
+            carpools, next_cursor = keyset_page(queryset, request.data.get("cursor"), parse_limit(request.data.get("limit")), descending = True)
+        except (TypeError, ValueError):
+            return Response({"status": "fail", "message": "Invalid limit or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not carpools:
             return Response({"status": "fail", "message": "No matching Carpools found"}, status=status.HTTP_404_NOT_FOUND)
 
         activity(user, f"{request.user.first_name} sorted Carpools")
-        serializer = CreateCarpoolSerializer(queryset, many=True)
+        serializer = CreateCarpoolSerializer(carpools, many=True)
 
-        return Response({"status": "success", "message": "Carpools fetched", "data":{"Carpools": km_inr_format(serializer.data)}}, status=status.HTTP_200_OK)
+        return Response({"status": "success", "message": "Carpools fetched", "data":{"Carpools": km_inr_format(serializer.data), "next_cursor": next_cursor}}, status=status.HTTP_200_OK)
 
     except Exception as e:
         return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-## find nearby carpools - show only upcoming rides with seats more than 0 , expired time ride hidden, enter location and find all carpool around 20km
+## find nearby carpools - show only upcoming rides with seats more than 0 , expired time ride hidden, enter location and find all carpool around 10km (NEARBY_RADIUS_KM)
+@query_budget(15)
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def find_nearby_carpools(request):
     """
-    Find nearby carpools within a 20 KM radius.
+    Find nearby carpools within a 10 KM radius (NEARBY_RADIUS_KM).
     Input:
         - location (string) OR latitude & longitude
+        - limit (integer, optional): number of carpools per page
+        - cursor (string, optional): "next_cursor" of the previous page
     Output:
-        - List of nearby carpools sorted by distance (only upcoming & with available seats)
+        - One page of nearby carpools sorted by distance (only upcoming & with available seats)
     """
     location_name = request.data.get("location")
     location_latitude = request.data.get("location_latitude")
@@ -219,6 +288,13 @@ def find_nearby_carpools(request):
     if not location_name and (location_latitude is None or location_longitude is None):
         return Response({"status": "fail","message": "Location name OR latitude & longitude required"}, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        limit = parse_limit(request.data.get("limit"))
+        # cursor: [distance, id] of the last carpool of the previous page
+        after = decode_cursor(request.data.get("cursor"), 2)
+    except (TypeError, ValueError):
+        return Response({"status": "fail", "message": "limit must be a positive integer, cursor must come from a previous page"}, status=status.HTTP_400_BAD_REQUEST)
+
     if location_latitude is not None and location_longitude is not None:
         try:
             user_lat, user_lon = float(location_latitude), float(location_longitude)
@@ -230,43 +306,31 @@ def find_nearby_carpools(request):
             return Response({"status": "fail", "message": "Invalid location or coordinates not found"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        upcoming_carpools = CreateCarpool.objects.filter( departure_time__gte=timezone.now(), available_seats__gt=0 )
-
-        nearby_carpools = []
-
-        for carpool in upcoming_carpools:
-            # Use DB coordinates if available, else geocode
-            start_lat = carpool.latitude_start
-            start_lon = carpool.longitude_start
+        upcoming_carpools = CreateCarpoolSerializer.setup_eager_loading(CreateCarpool.objects.filter(departure_time__gte=timezone.now(), available_seats__gt=0))
 
-            if start_lat is None or start_lon is None:
-                start_lat, start_lon = get_lat_lng_cached(carpool.start_location)
-            
-            # Skip if coordinates are missing
-            if start_lat is None or start_lon is None:
-                continue
-
-            distance_km = geodesic((user_lat, user_lon), (start_lat, start_lon)).km
+        # Candidates from the in-memory index; if it is stale, read the grid cells around the user instead
+        nearby_ids = carpool_index.nearby_ids(user_lat, user_lon, NEARBY_RADIUS_KM)
+        if nearby_ids is not None:
+            candidates, _ = prefilter_candidates(upcoming_carpools, Q(createcarpool_id__in=nearby_ids))
+        else:
+            upcoming_carpools = upcoming_carpools.filter(start_grid_cell__in=covering_cells(user_lat, user_lon, NEARBY_RADIUS_KM))
+            candidates, _ = prefilter_candidates(upcoming_carpools, bounding_box_q("start", user_lat, user_lon, NEARBY_RADIUS_KM))
 
-            # Filter within 10 KM radius
-            if distance_km <= 10:
-                carpool_data = CreateCarpoolSerializer(carpool).data
-                carpool_data["distance_from_you"] = f"{distance_km:.2f} KM"
-                carpool_data["distance_value"] = distance_km
-                nearby_carpools.append(carpool_data)
+        distances = distances_km(user_lat, user_lon, [c.latitude_start for c in candidates], [c.longitude_start for c in candidates], refine_near=NEARBY_RADIUS_KM)
 
-        # Sort by distance
-        for i in range(len(nearby_carpools)):
-            for j in range(i + 1, len(nearby_carpools)):
-                if nearby_carpools[i]["distance_value"] > nearby_carpools[j]["distance_value"]:
-                    temp = nearby_carpools[i]
-                    nearby_carpools[i] = nearby_carpools[j]
-                    nearby_carpools[j] = temp
+        # Filter within the radius, then keep the `limit` nearest after the cursor (bounded heap) and serialize only those
+        within = [i for i, distance_km in enumerate(distances) if distance_km <= NEARBY_RADIUS_KM]
+        nearest, last_key = ranked_page([(float(distances[i]), candidates[i].createcarpool_id) for i in within], after, limit)
 
-        for carpool in nearby_carpools:
-            del carpool["distance_value"]
+        nearby_carpools = []
+        for position in nearest:
+            i = within[position]
+            carpool_data = CreateCarpoolSerializer(candidates[i]).data
+            carpool_data["distance_from_you"] = f"{float(distances[i]):.2f} KM"
+            nearby_carpools.append(carpool_data)
 
-        return Response({"status": "success","total_results": len(nearby_carpools), "data": nearby_carpools}, status=status.HTTP_200_OK)
+        return Response({"status": "success","total_results": len(nearby_carpools), "total_matches": len(within), "data": nearby_carpools,
+                         "next_cursor": encode_cursor(last_key) if last_key else None}, status=status.HTTP_200_OK)
 
     except Exception as e:
         return Response({ "status": "error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -289,7 +353,7 @@ def create_carpool(request):
     available_seats (int): required
     total_passenger_allowed (int): required
     contribution_per_km (float): required
-    distance_km (float): optional (auto-calculated if not provided)
+    distance_km (float): optional (filled in by the enrichment worker if not provided)
     latitude_start, longitude_start, latitude_end, longitude_end: optional (for precise calculation)
     """
 
@@ -346,41 +410,8 @@ def create_carpool(request):
     except:
         distance_val = 0.0
 
-    try:
-        if distance_val <= 0:
-            # Use given coordinates if available
-            if get_latitude_start and get_longitude_start and get_latitude_end and get_longitude_end:
-                try:
-                    distance_val = get_road_distance_osrm(
-                        float(get_latitude_start), float(get_longitude_start),
-                        float(get_latitude_end), float(get_longitude_end)
-                    )
-                    if distance_val is None:
-                        distance_val = auto_calculate_distance(
-                            get_start_location, get_end_location,
-                            start_lat=float(get_latitude_start), start_lon=float(get_longitude_start),
-                            end_lat=float(get_latitude_end), end_lon=float(get_longitude_end)
-                        )
-                except Exception:
-                    distance_val = 0.0
-
-            #If no coordinates, use geocoding
-            else:
-                start_lat, start_lon = get_lat_lng_cached(get_start_location)
-                end_lat, end_lon = get_lat_lng_cached(get_end_location)
-                distance_val = get_road_distance_osrm(start_lat, start_lon, end_lat, end_lon)
-
-                if distance_val is None:
-                    distance_val = auto_calculate_distance(
-                        get_start_location, get_end_location,
-                        start_lat=start_lat, start_lon=start_lon,
-                        end_lat=end_lat, end_lon=end_lon
-                    )
-
-    except Exception:
-        distance_val = 0.0
-
-    # If still no distance found
+    # The carpool is saved right away, the enrichment worker fetches its road route later and
+    # fills missing coordinates and distance_km (see enrichment.py)
     if distance_val <= 0:
         distance_val = 0.0
 
@@ -390,10 +421,10 @@ def create_carpool(request):
                 carpool_creator_driver = user,
                 start_location = get_start_location,
                 end_location = get_end_location,
-                latitude_start = float(get_latitude_start) if get_latitude_start else start_lat,
-                longitude_start = float(get_longitude_start) if get_longitude_start else start_lon,
-                latitude_end = float(get_latitude_end) if get_latitude_end else end_lat,
-                longitude_end = float(get_longitude_end) if get_longitude_end else end_lon,
+                latitude_start = float(get_latitude_start) if get_latitude_start else None,
+                longitude_start = float(get_longitude_start) if get_longitude_start else None,
+                latitude_end = float(get_latitude_end) if get_latitude_end else None,
+                longitude_end = float(get_longitude_end) if get_longitude_end else None,
                 departure_time = get_departure_time,
                 arrival_time = get_arrival_time,
                 available_seats = available_seats,
@@ -406,7 +437,9 @@ def create_carpool(request):
                 contact_info = get_contact_info,
                 car_model = get_car_model,
                 car_number = get_car_number,
-                is_ev_vehicle = get_is_ev_vehicle
+                is_ev_vehicle = get_is_ev_vehicle,
+                enrichment_status = "pending",
+                enrichment_retry_at = current_time
             )
 
             # Auto-assign driver role if not already
@@ -485,10 +518,20 @@ def update_carpool(request):
                 return Response({"status":"fail", "message":"available_seats must be integer"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Update other fields if provided
-        if get_start_location is not None:
+        # a changed location is geocoded again and its route and distance refetched by the enrichment worker
+        location_changed = False
+        if get_start_location is not None and get_start_location != carpool.start_location:
             carpool.start_location = get_start_location
-        if get_end_location is not None:
+            carpool.latitude_start = carpool.longitude_start = None
+            location_changed = True
+        if get_end_location is not None and get_end_location != carpool.end_location:
             carpool.end_location = get_end_location
+            carpool.latitude_end = carpool.longitude_end = None
+            location_changed = True
+        if location_changed:
+            carpool.route_polyline = carpool.route_min_lat = carpool.route_max_lat = carpool.route_min_lon = carpool.route_max_lon = None
+            carpool.distance_km = 0
+            carpool.enrichment_status, carpool.enrichment_attempts, carpool.enrichment_retry_at = "pending", 0, timezone.now()
         if get_departure_time is not None:
             carpool.departure_time = get_departure_time
         if get_arrival_time is not None:
@@ -567,6 +610,7 @@ def delete_carpool(request):
         return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
 ## Driver: view my carpools
+@query_budget(8)
 @api_view(['GET'])
 @permission_classes([IsDriverOrPassengerCustom])
 def view_my_carpools(request):
@@ -577,11 +621,10 @@ def view_my_carpools(request):
     - Returns a JSON response with the status, message and data of the carpools.
     """
     user = request.user
-    ride_status_function(request)
     try:
         currunt_time = timezone.now()
-        upcoming_carpool = CreateCarpool.objects.filter(carpool_creator_driver=user, departure_time__gte=currunt_time).order_by("departure_time")
-        past_carpool = CreateCarpool.objects.filter(carpool_creator_driver=user, departure_time__lt=currunt_time).order_by("-departure_time")
+        upcoming_carpool = CreateCarpool.objects.with_effective_status(currunt_time).filter(carpool_creator_driver=user, departure_time__gte=currunt_time).order_by("departure_time")
+        past_carpool = CreateCarpool.objects.with_effective_status(currunt_time).filter(carpool_creator_driver=user, departure_time__lt=currunt_time).order_by("-departure_time")
         data = {
             "upcoming_carpool": CreateCarpoolSerializer(upcoming_carpool, many=True).data,
             "past_carpool": CreateCarpoolSerializer(past_carpool, many=True).data
@@ -0,0 +1,96 @@
+import numpy as np
+from geopy.distance import geodesic
+
+# Mean earth radius in KM
+EARTH_RADIUS_KM = 6371.0088
+
+# Largest relative difference between haversine (sphere) and geodesic (ellipsoid) distances
+HAVERSINE_MAX_ERROR = 0.006
+
+## Convert a list of coordinates (None allowed) to a float array, missing values become NaN
+def to_array(values):
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=float)
+
+## Vectorized haversine distance in KM (inputs are scalars or arrays of the same length)
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    One vectorized pass over all pairs. NaN coordinates give NaN distances.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+## Distances from one point to many points, refined with geodesic around a threshold
+def distances_km(lat, lon, lats, lons, refine_near=None):
+    """
+    Returns an array of KM distances from (lat, lon) to every (lats[i], lons[i]).
+    If refine_near is given, distances close enough to it that haversine could put them
+    on the wrong side are recomputed with geodesic, so "<= refine_near" checks match geodesic.
+    """
+    lats, lons = to_array(lats), to_array(lons)
+    distances = haversine_km(lat, lon, lats, lons)
+
+    if refine_near is not None:
+        borderline = np.abs(distances - refine_near) <= distances * HAVERSINE_MAX_ERROR + 1e-6
+        for i in np.flatnonzero(borderline):
+            distances[i] = geodesic((lat, lon), (lats[i], lons[i])).km
+    return distances
+
+## Vectorized "is P on the way from A to B" check for many routes A->B and one point P
+def points_on_route(lats_a, lons_a, lats_b, lons_b, lat_p, lon_p, max_deviation_ratio=0.3):
+    """
+    Same rule as utils.is_point_on_route_dynamic: |AP + PB - AB| <= AB * max_deviation_ratio,
+    evaluated for every route at once. Borderline routes are re-checked with geodesic.
+    Returns a boolean array (False where coordinates are missing).
+    """
+    lats_a, lons_a, lats_b, lons_b = to_array(lats_a), to_array(lons_a), to_array(lats_b), to_array(lons_b)
+    dist_ap = haversine_km(lats_a, lons_a, lat_p, lon_p)
+    dist_pb = haversine_km(lat_p, lon_p, lats_b, lons_b)
+    dist_ab = haversine_km(lats_a, lons_a, lats_b, lons_b)
+
+    deviation = np.abs(dist_ap + dist_pb - dist_ab)
+    allowed = dist_ab * max_deviation_ratio
+    on_route = deviation <= allowed
+
+    borderline = np.abs(deviation - allowed) <= (dist_ap + dist_pb + dist_ab) * HAVERSINE_MAX_ERROR + 1e-6
+    for i in np.flatnonzero(borderline):
+        a, b, p = (lats_a[i], lons_a[i]), (lats_b[i], lons_b[i]), (lat_p, lon_p)
+        ab = geodesic(a, b).km
+        on_route[i] = abs((geodesic(a, p).km + geodesic(p, b).km) - ab) <= ab * max_deviation_ratio
+    return on_route
+
+## Batch distance checks for a list of carpools against a searched start/end point
+def carpool_distance_checks(carpools, start_lat, start_lon, end_lat, end_lon, radius_km):
+    """
+    Returns a dict of per-carpool arrays (same order as carpools), None for checks without a searched point:
+    - start_distance: KM from the searched start to each carpool start
+    - end_distance: KM from the searched end to each carpool end
+    - end_on_route: whether the searched end lies on each carpool's route (within the corridor of its stored route, if any)
+    Distances are refined around radius_km.
+    """
+    checks = {"start_distance": None, "end_distance": None, "end_on_route": None}
+    if not carpools:
+        return checks
+
+    lats_start = [c.latitude_start for c in carpools]
+    lons_start = [c.longitude_start for c in carpools]
+    lats_end = [c.latitude_end for c in carpools]
+    lons_end = [c.longitude_end for c in carpools]
+
+    if start_lat and start_lon:
+        checks["start_distance"] = distances_km(start_lat, start_lon, lats_start, lons_start, refine_near=radius_km)
+    if end_lat and end_lon:
+        checks["end_distance"] = distances_km(end_lat, end_lon, lats_end, lons_end, refine_near=radius_km)
+        checks["end_on_route"] = points_on_route(lats_start, lons_start, lats_end, lons_end, end_lat, end_lon)
+
+        # carpools with a stored route use the corridor check instead (route_geometry imports this module)
+        from .route_geometry import on_route_corridor
+        for i, carpool in enumerate(carpools):
+            in_corridor = on_route_corridor(carpool, end_lat, end_lon)
+            if in_corridor is not None:
+                checks["end_on_route"][i] = in_corridor
+    return checks
+
+## Value of a per-carpool check array at index i (None if the check wasn't computed)
+def check_at(values, i):
+    return None if values is None else values[i]
@@ -0,0 +1,299 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .feed_cache import invalidate_carpool_feed
+from .geo_index import grid_cell
+from .geocode_cache import geocode_cache
+from .http_client import external_call_budget
+from .models import Booking, CreateCarpool
+from .route_cache import route_key
+from .route_geometry import route_geometry_fields
+from .utils import (auto_calculate_distance, calculate_realistic_distance, estimate_distance_by_text_similarity, get_lat_lng, get_lat_lng_cached,
+                    get_road_distance_osrm, get_road_route_osrm, prime_road_distances, road_distance_matrix, trip_road_pairs)
+
+logger = logging.getLogger(__name__)
+
+# Attempts before the worker gives up and stores an estimated distance
+ENRICHMENT_MAX_ATTEMPTS = 5
+
+# Delay before the first retry, doubled after every failed attempt
+ENRICHMENT_RETRY_DELAY = timedelta(minutes=1)
+
+# Seconds all external calls for one carpool/booking may take together
+ENRICHMENT_CALL_BUDGET_SECONDS = 20
+
+# Fields an enrichment is computed from; if any of them changes meanwhile, its result is not written
+CARPOOL_ENRICHMENT_INPUTS = ("start_location", "end_location", "latitude_start", "longitude_start", "latitude_end", "longitude_end", "distance_km")
+BOOKING_ENRICHMENT_INPUTS = ("pickup_location", "drop_location", "pickup_latitude", "pickup_longitude", "drop_latitude", "drop_longitude")
+
+# Threads geocoding uncached place names in parallel during a backfill (the external client still limits calls per host)
+BACKFILL_GEOCODE_WORKERS = 4
+
+## Given coordinates, else geocoded location name, else None
+def resolve_point(lat, lon, location_name):
+    if lat is not None and lon is not None:
+        return float(lat), float(lon)
+    if location_name:
+        point = get_lat_lng_cached(location_name)
+        if isinstance(point, tuple) and None not in point:
+            return point
+    return None
+
+## Road distance in KM between two resolved points, None if it could not be fetched
+def road_distance(origin, destination):
+    if origin is None or destination is None:
+        return None
+    distance = get_road_distance_osrm(*origin, *destination)
+    return distance if isinstance(distance, (int, float)) else None
+
+## Mark a failed attempt: schedule the next retry, or return False if attempts are used up
+def schedule_retry(instance, current_time):
+    instance.enrichment_attempts += 1
+    if instance.enrichment_attempts >= ENRICHMENT_MAX_ATTEMPTS:
+        return False
+    instance.enrichment_retry_at = current_time + ENRICHMENT_RETRY_DELAY * (2 ** (instance.enrichment_attempts - 1))
+    return True
+
+## Row of instance locked for the update, if it is still pending with the inputs it was enriched from, else None
+def locked_if_unchanged(instance, inputs):
+    """
+    Call inside transaction.atomic(). Edits made during the external calls win: the row stays pending
+    (an edited location is due again) and the next pass enriches what is stored now.
+    """
+    return type(instance).objects.select_for_update().filter(pk=instance.pk, enrichment_status="pending", **inputs).first()
+
+## Fill coordinates, road route and distance_km of a pending carpool
+def enrich_carpool(carpool, current_time):
+    """
+    The route geometry comes with the OSRM distance; a distance_km given by the driver is kept.
+    Returns "done", "retry" or "failed" (attempts used up, no route stored, distance_km is an estimate if it was missing).
+    Only the fields enrichment owns are written, and not at all if the carpool was edited meanwhile ("retry").
+    """
+    inputs = {field: getattr(carpool, field) for field in CARPOOL_ENRICHMENT_INPUTS}
+    start = resolve_point(carpool.latitude_start, carpool.longitude_start, carpool.start_location)
+    end = resolve_point(carpool.latitude_end, carpool.longitude_end, carpool.end_location)
+    if start:
+        carpool.latitude_start, carpool.longitude_start = start
+    if end:
+        carpool.latitude_end, carpool.longitude_end = end
+
+    result = "done"
+    route = get_road_route_osrm(*start, *end) if start and end else None
+    if route:
+        for field, value in route_geometry_fields(route[1]).items():
+            setattr(carpool, field, value)
+    elif schedule_retry(carpool, current_time):
+        result = "retry"
+    else:
+        result = "failed"
+
+    if result != "retry":
+        distance = float(carpool.distance_km or 0)
+        if distance <= 0:
+            distance = route[0] if route else auto_calculate_distance(carpool.start_location, carpool.end_location, *(start or (None, None)), *(end or (None, None)))
+        carpool.distance_km = round(distance, 2) if isinstance(distance, (int, float)) and distance > 0 else 0
+        carpool.enrichment_status = result
+        carpool.enrichment_retry_at = None
+
+    fields = ["latitude_start", "longitude_start", "latitude_end", "longitude_end", "distance_km", "route_polyline",
+              "route_min_lat", "route_max_lat", "route_min_lon", "route_max_lon", "enrichment_status", "enrichment_attempts", "enrichment_retry_at"]
+    with transaction.atomic():
+        current = locked_if_unchanged(carpool, inputs)
+        if current is None:
+            return "retry"
+        for field in fields:
+            setattr(current, field, getattr(carpool, field))
+        current.save(update_fields=fields)
+    return result
+
+## Fill pickup/drop coordinates, distance_travelled and contribution_amount of a pending booking
+def enrich_booking(booking, current_time):
+    """
+    Without pickup/drop locations the whole carpool route is used, as book_carpool did before.
+    Returns "done", "retry" or "failed" (attempts used up, distance_travelled is an estimate).
+    Only the fields enrichment owns are written, and not at all if pickup/drop were edited meanwhile ("retry").
+    """
+    inputs = {field: getattr(booking, field) for field in BOOKING_ENRICHMENT_INPUTS}
+    carpool = booking.carpool_driver_name
+    if booking.pickup_location or booking.drop_location or booking.pickup_latitude is not None:
+        pickup = resolve_point(booking.pickup_latitude, booking.pickup_longitude, booking.pickup_location)
+        drop = resolve_point(booking.drop_latitude, booking.drop_longitude, booking.drop_location)
+        if pickup:
+            booking.pickup_latitude, booking.pickup_longitude = pickup
+        if drop:
+            booking.drop_latitude, booking.drop_longitude = drop
+        pickup_name, drop_name = booking.pickup_location or "", booking.drop_location or ""
+    else:
+        pickup = resolve_point(carpool.latitude_start, carpool.longitude_start, carpool.start_location)
+        drop = resolve_point(carpool.latitude_end, carpool.longitude_end, carpool.end_location)
+        pickup_name, drop_name = carpool.start_location, carpool.end_location
+
+    result = "done"
+    distance = road_distance(pickup, drop)
+    if distance is None:
+        if schedule_retry(booking, current_time):
+            result = "retry"
+        else:
+            result = "failed"
+            distance = auto_calculate_distance(pickup_name, drop_name, *(pickup or (None, None)), *(drop or (None, None)))
+
+    if result != "retry":
+        booking.distance_travelled = Decimal(str(round(distance, 2))) if isinstance(distance, (int, float)) and distance > 0 else 0
+        booking.enrichment_status = result
+        booking.enrichment_retry_at = None
+
+    if result == "done":
+        # my_bookings_info only reads the route cache, fetch the rest of the trip's road distances now
+        prime_road_distances(trip_road_pairs(carpool, pickup, drop).values())
+
+    fields = ["pickup_latitude", "pickup_longitude", "drop_latitude", "drop_longitude", "distance_travelled", "enrichment_status", "enrichment_attempts", "enrichment_retry_at"]
+    with transaction.atomic():
+        current = locked_if_unchanged(booking, inputs)
+        if current is None:
+            return "retry"
+        for field in fields:
+            setattr(current, field, getattr(booking, field))
+        # same rule as confirming a booking, with the status as stored now (it may have been confirmed during the external calls)
+        if result != "retry" and current.booking_status == "confirmed" and current.distance_travelled:
+            current.contribution_amount = carpool.contribution_per_km * current.distance_travelled
+            fields.append("contribution_amount")
+        current.save(update_fields=fields)
+    return result
+
+## One pass of the enrichment worker over due pending carpools, then bookings
+def run_enrichment(batch_size=100, current_time=None):
+    """
+    Carpools go first, so bookings can fall back to freshly resolved carpool coordinates.
+    Meant for a single worker process (see the run_enrichment_worker command).
+
+    Returns:
+    dict: {"carpools": {"done": n, "retry": n, "failed": n}, "bookings": {...}}
+    """
+    current_time = current_time or timezone.now()
+    due = Q(enrichment_status="pending") & (Q(enrichment_retry_at__isnull=True) | Q(enrichment_retry_at__lte=current_time))
+    counts = {"carpools": {"done": 0, "retry": 0, "failed": 0}, "bookings": {"done": 0, "retry": 0, "failed": 0}}
+
+    jobs = [("carpools", CreateCarpool.objects.filter(due), enrich_carpool),
+            ("bookings", Booking.objects.filter(due).select_related("carpool_driver_name"), enrich_booking)]
+    for name, queryset, enrich in jobs:
+        for instance in queryset.order_by("enrichment_retry_at")[:batch_size]:
+            try:
+                with external_call_budget(ENRICHMENT_CALL_BUDGET_SECONDS):
+                    counts[name][enrich(instance, current_time)] += 1
+            except Exception as e:
+                logger.warning("Enrichment of %s %s failed: %s", name, instance.pk, e)
+                if schedule_retry(instance, current_time):
+                    type(instance).objects.filter(pk=instance.pk).update(enrichment_attempts=instance.enrichment_attempts, enrichment_retry_at=instance.enrichment_retry_at)
+                    counts[name]["retry"] += 1
+                else:
+                    type(instance).objects.filter(pk=instance.pk).update(enrichment_attempts=instance.enrichment_attempts, enrichment_status="failed",
+                                                                         enrichment_retry_at=None, updated_at=current_time)
+                    if name == "carpools":
+                        invalidate_carpool_feed()
+                    counts[name]["failed"] += 1
+    return counts
+
+## (lat, lon) for many place names: cache hits first, the misses geocoded in parallel
+def resolve_places(names):
+    """
+    Returns {name: (lat, lon) or None}. Database access stays in the calling thread,
+    the threads only run the geocoder backends.
+    """
+    resolved, missing = {}, []
+    for name in set(names):
+        found, point = geocode_cache.get(name)
+        if found:
+            resolved[name] = None if None in point else point
+        else:
+            missing.append(name)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=BACKFILL_GEOCODE_WORKERS) as pool:
+            points = list(pool.map(get_lat_lng, missing))
+        for name, point in zip(missing, points):
+            # geocoder errors are not cached, the name is tried again on the next backfill
+            resolved[name] = point if isinstance(point, tuple) and None not in point else None
+            if isinstance(point, tuple):
+                try:
+                    geocode_cache.set(name, point)
+                except Exception as e:
+                    logger.warning("Geocode cache write failed: %s", e)
+    return resolved
+
+## Fill missing coordinates / distance_km of saved carpools in bulk
+def backfill_carpools(batch_size=500, current_time=None):
+    """
+    Picks up carpools (not pending enrichment) with distance_km 0 or missing coordinates, e.g. rows saved before the enrichment worker existed.
+    Places are resolved through the geocode cache, road distances with batched OSRM table requests through the route cache,
+    and everything is written back with one bulk_update (grid cells and updated_at included, save() is not called).
+    Unresolved rows are retried with the enrichment backoff, after ENRICHMENT_MAX_ATTEMPTS they get an estimated distance and "failed".
+
+    Returns:
+    dict: {"done": n, "retry": n, "failed": n}
+    """
+    current_time = current_time or timezone.now()
+    missing = Q(distance_km=0) | Q(latitude_start__isnull=True) | Q(longitude_start__isnull=True) | Q(latitude_end__isnull=True) | Q(longitude_end__isnull=True)
+    due = Q(enrichment_retry_at__isnull=True) | Q(enrichment_retry_at__lte=current_time)
+    carpools = list(CreateCarpool.objects.filter(missing, due, enrichment_status="done").order_by("updated_at")[:batch_size])
+    counts = {"done": 0, "retry": 0, "failed": 0}
+    if not carpools:
+        return counts
+
+    places = resolve_places([location for carpool in carpools for location, lat, lon in (
+        (carpool.start_location, carpool.latitude_start, carpool.longitude_start), (carpool.end_location, carpool.latitude_end, carpool.longitude_end))
+        if location and (lat is None or lon is None)])
+
+    pairs = {}
+    for carpool in carpools:
+        start = resolve_point(carpool.latitude_start, carpool.longitude_start, None) or places.get(carpool.start_location)
+        end = resolve_point(carpool.latitude_end, carpool.longitude_end, None) or places.get(carpool.end_location)
+        if start:
+            carpool.latitude_start, carpool.longitude_start = start
+        if end:
+            carpool.latitude_end, carpool.longitude_end = end
+        if start and end and not float(carpool.distance_km):
+            pairs[carpool.pk] = (start, end)
+
+    # one batch of OSRM table requests for all missing distances, pairs already cached are not requested again
+    road_km = {}
+    if pairs:
+        with external_call_budget(ENRICHMENT_CALL_BUDGET_SECONDS):
+            sources = list(dict.fromkeys(start for start, _ in pairs.values()))
+            destinations = list(dict.fromkeys(end for _, end in pairs.values()))
+            matrix = road_distance_matrix(sources, destinations)
+        distances = {route_key(*start, *end): matrix[i][j] for i, start in enumerate(sources) for j, end in enumerate(destinations)}
+        road_km = {pk: distances[route_key(*start, *end)] for pk, (start, end) in pairs.items()}
+
+    for carpool in carpools:
+        if road_km.get(carpool.pk):
+            carpool.distance_km = round(road_km[carpool.pk], 2)
+        coordinates = (carpool.latitude_start, carpool.longitude_start, carpool.latitude_end, carpool.longitude_end)
+        if float(carpool.distance_km) > 0 and None not in coordinates:
+            carpool.enrichment_attempts, carpool.enrichment_retry_at = 0, None
+            counts["done"] += 1
+        elif schedule_retry(carpool, current_time):
+            counts["retry"] += 1
+        else:
+            # same fallbacks as auto_calculate_distance, without calling OSRM again
+            if not float(carpool.distance_km):
+                distance = (estimate_distance_by_text_similarity(carpool.start_location, carpool.end_location) if None in coordinates
+                            else calculate_realistic_distance(*coordinates))
+                carpool.distance_km = round(distance, 2)
+            carpool.enrichment_status, carpool.enrichment_retry_at = "failed", None
+            counts["failed"] += 1
+
+        # bulk_update skips save(): keep what it would derive
+        carpool.start_grid_cell = grid_cell(carpool.latitude_start, carpool.longitude_start)
+        carpool.end_grid_cell = grid_cell(carpool.latitude_end, carpool.longitude_end)
+        carpool.updated_at = current_time
+
+    CreateCarpool.objects.bulk_update(carpools, ["latitude_start", "longitude_start", "latitude_end", "longitude_end", "start_grid_cell", "end_grid_cell",
+                                                 "distance_km", "enrichment_status", "enrichment_attempts", "enrichment_retry_at", "updated_at"])
+    # bulk_update sends no post_save, the feed shows distance_km / enrichment_status
+    if carpools:
+        invalidate_carpool_feed()
+    return counts
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Seconds a cached feed page is served (bounds staleness from time alone, e.g. rides departing)
+CARPOOL_FEED_CACHE_TTL = getattr(settings, "CARPOOL_FEED_CACHE_TTL", 60)
+
+# Cache key of the feed version; every write to a carpool moves it on, so older pages are never read again
+FEED_VERSION_KEY = "carpool_feed:version"
+
+class FeedCacheStats:
+    """
+    Hit rate and rebuild latency of the feed cache in this worker.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.rebuild_total_ms = 0.0
+        self.rebuild_max_ms = 0.0
+
+    def record_hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def record_rebuild(self, elapsed_ms):
+        with self.lock:
+            self.misses += 1
+            self.rebuild_total_ms += elapsed_ms
+            self.rebuild_max_ms = max(self.rebuild_max_ms, elapsed_ms)
+
+    def as_dict(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                    "avg_rebuild_ms": round(self.rebuild_total_ms / self.misses, 2) if self.misses else None,
+                    "max_rebuild_ms": round(self.rebuild_max_ms, 2)}
+
+feed_cache_stats = FeedCacheStats()
+
+## Current feed version (a missing version restarts from the clock, so it never goes back to an old value)
+def feed_version():
+    version = cache.get(FEED_VERSION_KEY)
+    if version is None:
+        cache.add(FEED_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(FEED_VERSION_KEY)
+    return version
+
+def _bump_feed_version():
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        cache.add(FEED_VERSION_KEY, time.time_ns(), None)
+
+## Drop every cached feed page (after a carpool is created, updated, deleted or its seats change)
+def invalidate_carpool_feed():
+    """
+    Bumps now and again when the transaction commits, so a page rebuilt from
+    not yet committed data in between is not served either.
+    """
+    with feed_cache_stats.lock:
+        feed_cache_stats.invalidations += 1
+    _bump_feed_version()
+    transaction.on_commit(_bump_feed_version)
+
+## Signal receiver for models shown in the feed
+def invalidate_carpool_feed_receiver(sender, **kwargs):
+    invalidate_carpool_feed()
+
+## Feed page for the given parameters, from the cache or built by build()
+def cached_feed(params, build):
+    """
+    params: dict of everything the page depends on (page cursor, limit, filters)
+    build: function returning the page data (must be picklable)
+    Returns (data, hit).
+    """
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    key = f"carpool_feed:{feed_version()}:{digest}"
+
+    data = cache.get(key)
+    if data is not None:
+        feed_cache_stats.record_hit()
+        return data, True
+
+    started = time.monotonic()
+    data = build()
+    feed_cache_stats.record_rebuild((time.monotonic() - started) * 1000)
+    cache.set(key, data, CARPOOL_FEED_CACHE_TTL)
+    return data, False
@@ -0,0 +1,67 @@
+from math import cos, floor, radians
+from django.conf import settings
+from django.db.models import Q
+
+# Size of one grid cell in degrees (~11 KM of latitude)
+GRID_CELL_DEGREES = 0.1
+
+# Shortest length of one degree of latitude in KM, so boxes never cut off points inside the radius
+KM_PER_DEGREE = 110.5
+
+## Grid cell key for a coordinate, e.g. "211:728"
+def grid_cell(lat, lon):
+    """
+    Returns the fixed-grid cell key for a latitude/longitude, else None if either is missing.
+    """
+    if lat is None or lon is None:
+        return None
+    return f"{floor(float(lat) / GRID_CELL_DEGREES)}:{floor(float(lon) / GRID_CELL_DEGREES)}"
+
+## All grid cells touched by a circle of radius_km around (lat, lon)
+def covering_cells(lat, lon, radius_km):
+    """
+    Returns the list of cell keys covering the bounding box of the circle.
+    A radius query only has to read carpools in these cells before the exact distance check.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+
+    min_lat_index = floor(min_lat / GRID_CELL_DEGREES)
+    max_lat_index = floor(max_lat / GRID_CELL_DEGREES)
+    min_lon_index = floor(min_lon / GRID_CELL_DEGREES)
+    max_lon_index = floor(max_lon / GRID_CELL_DEGREES)
+
+    return [f"{lat_index}:{lon_index}"
+            for lat_index in range(min_lat_index, max_lat_index + 1)
+            for lon_index in range(min_lon_index, max_lon_index + 1)]
+
+## Latitude/longitude bounding box of a circle of radius_km around (lat, lon)
+def bounding_box(lat, lon, radius_km):
+    """
+    Returns (min_lat, max_lat, min_lon, max_lon). Every point within radius_km lies inside the box.
+    """
+    lat, lon = float(lat), float(lon)
+    lat_delta = radius_km / KM_PER_DEGREE
+    # longitude degrees shrink towards the poles, use the box edge nearest to the pole
+    lon_delta = radius_km / (KM_PER_DEGREE * max(cos(radians(min(abs(lat) + lat_delta, 90))), 0.01))
+    return lat - lat_delta, lat + lat_delta, lon - lon_delta, lon + lon_delta
+
+## ORM range filter keeping carpools whose start/end point lies in the bounding box
+def bounding_box_q(point, lat, lon, radius_km):
+    """
+    point: "start" or "end" (uses latitude_<point> / longitude_<point>).
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    return Q(**{f"latitude_{point}__range": (min_lat, max_lat), f"longitude_{point}__range": (min_lon, max_lon)})
+
+## Apply a prefilter to a queryset and report how well it pruned
+def prefilter_candidates(queryset, prefilter):
+    """
+    Returns (candidates, stats): the evaluated rows surviving the prefilter and
+    {"candidates_after": ...} for monitoring. "candidates_before" costs an extra
+    COUNT query, so it is only added with DEBUG on.
+    """
+    candidates = list(queryset.filter(prefilter))
+    stats = {"candidates_after": len(candidates)}
+    if settings.DEBUG:
+        stats["candidates_before"] = queryset.count()
+    return candidates, stats
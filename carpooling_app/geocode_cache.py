@@ -0,0 +1,113 @@
+import logging
+import re
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .memory_cache import BoundedLRU
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# How long a found place stays cached
+GEOCODE_CACHE_TTL = getattr(settings, "GEOCODE_CACHE_TTL", timedelta(days=30))
+
+# How long an unknown place stays cached before it is geocoded again
+GEOCODE_NEGATIVE_TTL = getattr(settings, "GEOCODE_NEGATIVE_TTL", timedelta(days=1))
+
+# Entries kept in the in-process LRU of each worker
+GEOCODE_LRU_SIZE = getattr(settings, "GEOCODE_LRU_SIZE", 1024)
+
+## Normalized cache key for a place name, e.g. "  Surat,  Gujarat " -> "surat gujarat"
+def normalize_place_key(place_name):
+    key = re.sub(r"[^\w\s]", " ", str(place_name).casefold())
+    return " ".join(key.split())[:255]
+
+class GeocodeCache:
+    """
+    Two-level geocode cache: an in-process LRU in front of the GeocodeCacheEntry table.
+    Values are (lat, lon) tuples; (None, None) is cached as a negative result with a shorter TTL.
+    """
+    def __init__(self, max_size=GEOCODE_LRU_SIZE):
+        self.lock = threading.Lock()
+        self.memory = BoundedLRU(max_size)  # place key -> (lat, lon)
+        self.stats = {"memory_hits": 0, "db_hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0}
+
+    def _remember(self, key, value, expires_at):
+        evicted = self.memory.set(key, value, expires_at)
+        with self.lock:
+            self.stats["evictions"] += evicted
+
+    def _count(self, name, value):
+        with self.lock:
+            self.stats[name] += 1
+            if value == (None, None):
+                self.stats["negative_hits"] += 1
+
+    def get(self, place_name):
+        """
+        Returns (found, (lat, lon)). found is False if the place has to be geocoded.
+        """
+        key = normalize_place_key(place_name)
+        now = timezone.now()
+
+        found, value = self.memory.get(key, now)
+        if found:
+            self._count("memory_hits", value)
+            return True, value
+
+        entry = GeocodeCacheEntry.objects.filter(place_key=key, expires_at__gt=now).first()
+        if entry:
+            value = (float(entry.latitude), float(entry.longitude)) if entry.latitude is not None else (None, None)
+            self._remember(key, value, entry.expires_at)
+            self._count("db_hits", value)
+            return True, value
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return False, None
+
+    def set(self, place_name, value):
+        key = normalize_place_key(place_name)
+        lat, lon = value
+        found = lat is not None and lon is not None
+        expires_at = timezone.now() + (GEOCODE_CACHE_TTL if found else GEOCODE_NEGATIVE_TTL)
+
+        GeocodeCacheEntry.objects.update_or_create(place_key=key, defaults={
+            "latitude": round(lat, 6) if found else None,
+            "longitude": round(lon, 6) if found else None,
+            "expires_at": expires_at,
+        })
+        self._remember(key, (lat, lon) if found else (None, None), expires_at)
+
+    def get_or_geocode(self, place_name, geocode):
+        """
+        Cached (lat, lon) for place_name, calling geocode(place_name) only on a miss.
+        Geocoder errors (anything other than a (lat, lon) tuple) are returned as they are and not cached.
+        """
+        found, value = self.get(place_name)
+        if found:
+            return value
+
+        value = geocode(place_name)
+        if isinstance(value, tuple):
+            try:
+                self.set(place_name, value)
+            except Exception as e:
+                logger.warning("Geocode cache write failed: %s", e)
+        return value
+
+    def clear_memory(self):
+        self.memory.clear()
+
+## Delete expired rows from the geocode cache table
+def purge_expired_geocodes():
+    """
+    Returns:
+    int: number of rows deleted.
+    """
+    deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+# One LRU per worker process, the table is shared
+geocode_cache = GeocodeCache()
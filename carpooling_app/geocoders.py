@@ -0,0 +1,117 @@
+import csv
+import os
+import threading
+from django.conf import settings
+from geopy.geocoders import Nominatim
+from rest_framework import status
+from rest_framework.response import Response
+from .geocode_cache import normalize_place_key
+from .http_client import external_client
+
+# Geocoder backends tried in order until one finds the place
+GEOCODERS = getattr(settings, "GEOCODERS", ["gazetteer", "nominatim"])
+
+# Bundled city/locality file used by the offline gazetteer
+GAZETTEER_FILE = getattr(settings, "GAZETTEER_FILE", os.path.join(os.path.dirname(__file__), "data", "india_places.csv"))
+
+# Seconds a Nominatim call may take (cut to the request's remaining time budget)
+NOMINATIM_TIMEOUT = 5
+
+class Geocoder:
+    """
+    Geocoder backend interface.
+    geocode() returns (lat, lon), or (None, None) if the place is unknown.
+    """
+    name = None
+
+    def geocode(self, place_name):
+        raise NotImplementedError
+
+class GazetteerGeocoder(Geocoder):
+    """
+    Offline geocoder over the bundled city file.
+    Names, aliases and "name state" forms are one dict, only exact matches are answered.
+    Anything else (partial names, localities not in the file) is left to the next backend,
+    so a guess like "sola" -> Solapur never ends up in the geocode cache.
+    """
+    name = "gazetteer"
+
+    def __init__(self, path=GAZETTEER_FILE):
+        self.places = []  # (lat, lon, population)
+        keys = {}
+        with open(path, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                place_index = len(self.places)
+                self.places.append((float(row["latitude"]), float(row["longitude"]), int(row["population"] or 0)))
+                state = normalize_place_key(row["state"])
+                for name in [row["name"]] + [alias for alias in (row["aliases"] or "").split("|") if alias]:
+                    name = normalize_place_key(name)
+                    for key in (name, f"{name} {state}"):
+                        # on duplicate names keep the more populous place
+                        if key not in keys or self.places[keys[key]][2] < self.places[place_index][2]:
+                            keys[key] = place_index
+
+        self.index = keys
+
+    def geocode(self, place_name):
+        key = normalize_place_key(place_name)
+        if key.endswith(" india"):
+            key = key[:-len(" india")]
+
+        place_index = self.index.get(key)
+        if place_index is None:
+            return None, None
+
+        lat, lon, _ = self.places[place_index]
+        return lat, lon
+
+class NominatimGeocoder(Geocoder):
+    """
+    Online geocoding through OpenStreetMap Nominatim (rate-limited, needs network).
+    Calls go through the shared external client (circuit breaker, concurrency limit, request time budget).
+    """
+    name = "nominatim"
+
+    def __init__(self):
+        # one geolocator per worker, geopy keeps its HTTP session (and connections) alive
+        self.geolocator = Nominatim(user_agent="carpool_app")
+
+    def geocode(self, place_name):
+        try:
+            loc = external_client.call(self.geolocator.domain, lambda timeout: self.geolocator.geocode(place_name, timeout=timeout), NOMINATIM_TIMEOUT)
+            if loc:
+                return loc.latitude, loc.longitude
+        except Exception as e:
+            return Response({"status":"error", "message": f"Geocoding failed for {place_name}: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return None, None
+
+class ChainGeocoder(Geocoder):
+    """
+    Tries each backend in order and returns the first found place.
+    """
+    def __init__(self, backends):
+        self.backends = backends
+
+    def geocode(self, place_name):
+        result = (None, None)
+        for backend in self.backends:
+            result = backend.geocode(place_name)
+            if result != (None, None):
+                return result
+        return result
+
+GEOCODER_BACKENDS = {
+    GazetteerGeocoder.name: GazetteerGeocoder,
+    NominatimGeocoder.name: NominatimGeocoder,
+}
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+## Configured geocoder (built once per worker, the gazetteer file is loaded on first use)
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = ChainGeocoder([GEOCODER_BACKENDS[name]() for name in GEOCODERS])
+    return _geocoder
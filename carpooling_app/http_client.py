@@ -0,0 +1,175 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Concurrent calls allowed per external host (per worker)
+HOST_CONCURRENCY = getattr(settings, "EXTERNAL_HOST_CONCURRENCY", 8)
+
+# Consecutive failures that open a host's circuit breaker
+BREAKER_FAILURE_THRESHOLD = getattr(settings, "EXTERNAL_BREAKER_FAILURE_THRESHOLD", 5)
+
+# Seconds an open breaker short-circuits calls before one trial call is let through
+BREAKER_RESET_SECONDS = getattr(settings, "EXTERNAL_BREAKER_RESET_SECONDS", 30)
+
+# Seconds all external calls of one API request may take together
+EXTERNAL_CALL_BUDGET_SECONDS = getattr(settings, "EXTERNAL_CALL_BUDGET_SECONDS", 8)
+
+# Upper bounds (ms) of the latency histogram buckets, the last bucket is everything slower
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 6000]
+
+# monotonic deadline for external calls of the current API request (None outside requests)
+_deadline = contextvars.ContextVar("external_call_deadline", default=None)
+
+class ExternalCallSkipped(Exception):
+    """
+    Raised instead of calling a host whose breaker is open, when all its slots are busy,
+    or when the request's time budget is used up. Callers fall back to local estimates.
+    """
+
+## Seconds left of the current API request's external call budget (None if no budget is set)
+def remaining_budget():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+## Limit all external calls inside the block to seconds in total
+@contextmanager
+def external_call_budget(seconds=EXTERNAL_CALL_BUDGET_SECONDS):
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+class CircuitBreaker:
+    """
+    closed -> open after BREAKER_FAILURE_THRESHOLD consecutive failures,
+    open -> half_open after BREAKER_RESET_SECONDS (one trial call), half_open -> closed on success / open on failure.
+    """
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class HostStats:
+    """
+    Call counters and latency histogram for one host.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, failed):
+        with self.lock:
+            self.calls += 1
+            self.failures += int(failed)
+            self.total_ms += elapsed_ms
+            self.histogram[next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= bound), len(LATENCY_BUCKETS_MS))] += 1
+
+    def as_dict(self):
+        with self.lock:
+            labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+            return {"calls": self.calls, "failures": self.failures, "skipped": self.skipped,
+                    "avg_ms": round(self.total_ms / self.calls, 2) if self.calls else None,
+                    "latency_histogram": dict(zip(labels, self.histogram))}
+
+class ExternalClient:
+    """
+    Shared client for routing/geocoding hosts: one pooled keep-alive session, and per host
+    a concurrency limit, a circuit breaker and latency stats. Timeouts are cut to the request's budget.
+    """
+    def __init__(self, host_concurrency=HOST_CONCURRENCY):
+        self.host_concurrency = host_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=host_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> (semaphore, breaker, stats)
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (threading.BoundedSemaphore(self.host_concurrency), CircuitBreaker(), HostStats())
+            return self.hosts[host]
+
+    def call(self, host, func, timeout):
+        """
+        Runs func(timeout) for host under its breaker and concurrency limit.
+        Exceptions and 5xx responses count as failures. Raises ExternalCallSkipped instead of calling when not allowed.
+        """
+        semaphore, breaker, stats = self._host(host)
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = min(timeout, budget)
+
+        def skip(reason):
+            with stats.lock:
+                stats.skipped += 1
+            raise ExternalCallSkipped(f"{host}: {reason}")
+
+        if timeout <= 0:
+            skip("time budget used up")
+        if not semaphore.acquire(timeout=timeout):
+            skip("too many concurrent calls")
+        # the breaker is asked only once the call has a slot, a half open breaker's trial call always runs and reports back
+        if not breaker.allow():
+            semaphore.release()
+            skip("circuit open")
+
+        started = time.monotonic()
+        failed = True
+        try:
+            result = func(timeout)
+            failed = getattr(result, "status_code", 200) >= 500
+            return result
+        finally:
+            semaphore.release()
+            stats.record((time.monotonic() - started) * 1000, failed)
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    def get(self, url, timeout=6, **kwargs):
+        return self.call(urlsplit(url).netloc, lambda call_timeout: self.session.get(url, timeout=call_timeout, **kwargs), timeout)
+
+    def stats(self):
+        with self.lock:
+            hosts = dict(self.hosts)
+        return {host: dict(stats.as_dict(), breaker=breaker.state) for host, (_, breaker, stats) in hosts.items()}
+
+# One client (connection pool, breakers, stats) per worker process
+external_client = ExternalClient()
@@ -0,0 +1,63 @@
+import re
+from django.db.models import Count, Q
+from .geocode_cache import normalize_place_key
+from .models import CreateCarpool, LocationToken
+
+# Longest stored term (longer words are cut, matching still verifies the full text)
+MAX_TOKEN_LENGTH = 50
+
+## Trigrams of a normalized text, e.g. "surat" -> {"sur", "ura", "rat"}
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+## Does a normalized location contain the normalized searched text? (the rule the token index answers)
+def location_text_matches(text, location_text):
+    """
+    Texts of 3+ characters match anywhere, shorter ones only at the start of a word.
+    """
+    if len(text) < 3:
+        return any(term.startswith(text) for term in location_text.split())
+    return text in location_text
+
+## (kind, token) pairs of a location name: its words ("term") and the trigrams of the normalized name
+def location_tokens(location):
+    text = normalize_place_key(location or "")
+    return {("term", term[:MAX_TOKEN_LENGTH]) for term in text.split()} | {("trigram", gram) for gram in trigrams(text)}
+
+## Rewrite the token rows of a carpool's start and end location
+def sync_location_tokens(carpool):
+    LocationToken.objects.filter(carpool=carpool).delete()
+    LocationToken.objects.bulk_create([LocationToken(carpool=carpool, point=point, kind=kind, token=token)
+                                       for point, location in (("start", carpool.start_location), ("end", carpool.end_location))
+                                       for kind, token in location_tokens(location)])
+
+## SQL condition for location_text_matches() on the stored (not normalized) location, for texts of 3+ characters
+def location_text_q(text, point):
+    # normalize_place_key turns any run of non-word characters into one space
+    return Q(**{f"{point}_location__iregex": r"[^\w]+".join(re.escape(word) for word in text.split())})
+
+## Q keeping carpools whose start or end location contains a normalized text, through the token index
+def text_match_q(text, point):
+    """
+    Texts of 3+ characters need all their trigrams in the index, the candidates are then checked with
+    location_text_q(); shorter texts are looked up as term prefixes. The token lookups stay subqueries.
+    """
+    tokens = LocationToken.objects.filter(point=point)
+    if len(text) < 3:
+        return Q(createcarpool_id__in=tokens.filter(kind="term", token__startswith=text).values("carpool_id"))
+
+    grams = trigrams(text)
+    candidate_ids = (tokens.filter(kind="trigram", token__in=grams).values("carpool_id")
+                     .annotate(found=Count("token", distinct=True)).filter(found=len(grams)).values("carpool_id"))
+    return Q(createcarpool_id__in=candidate_ids) & location_text_q(text, point)
+
+## Ids of carpools whose start or end location contains the searched text, through the token index
+def matching_carpool_ids(search, point):
+    """
+    point: "start" or "end". Matching is on normalized text (case, punctuation and extra spaces ignored), see text_match_q().
+    Returns a subquery of ids for createcarpool_id__in (nothing is loaded here), or None if there is nothing to search for (no filter).
+    """
+    text = normalize_place_key(search or "")
+    if not text:
+        return None
+    return CreateCarpool.objects.filter(text_match_q(text, point)).values("createcarpool_id")
@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from carpooling_app.models import Booking, CreateCarpool
+from carpooling_app.utils import day_range
+
+class Command(BaseCommand):
+    help = "Print the query plan and average run time of the carpool / booking listing queries (run before and after index changes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="YYYY-MM-DD day for the date filtered search (default: tomorrow).")
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per query for the timing.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        day_start, day_end = day_range(options["date"] or (now + timedelta(days=1)).strftime("%Y-%m-%d"))
+        upcoming = CreateCarpool.objects.filter(available_seats__gt=0, departure_time__gte=now)
+        driver_id = CreateCarpool.objects.values_list("carpool_creator_driver_id", flat=True).first()
+        carpool_id = CreateCarpool.objects.values_list("createcarpool_id", flat=True).first()
+
+        queries = {
+            "upcoming carpools": upcoming.order_by("-departure_time"),
+            "search by date": upcoming.filter(departure_time__gte=day_start, departure_time__lt=day_end),
+            "driver's carpools": CreateCarpool.objects.filter(carpool_creator_driver_id=driver_id).order_by("-departure_time"),
+            "confirmed bookings of a carpool": Booking.objects.filter(carpool_driver_name_id=carpool_id, booking_status="confirmed"),
+        }
+
+        self.stdout.write(f"Database: {connection.vendor}, {CreateCarpool.objects.count()} carpools, {Booking.objects.count()} bookings")
+        for name, queryset in queries.items():
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                list(queryset.values_list("pk", flat=True))
+            elapsed_ms = (time.perf_counter() - started) * 1000 / options["repeat"]
+
+            self.stdout.write(f"\n== {name} ({elapsed_ms:.2f} ms avg)")
+            self.stdout.write(queryset.explain())
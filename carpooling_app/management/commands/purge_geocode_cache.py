@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.geocode_cache import purge_expired_geocodes
+
+class Command(BaseCommand):
+    help = "Delete expired rows from the geocode cache table."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_geocodes()
+        self.stdout.write(f"Expired geocode cache entries deleted: {deleted}")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.route_cache import ROUTE_CACHE_MAX_ROWS, purge_route_cache
+
+class Command(BaseCommand):
+    help = "Delete expired rows from the road distance cache table and keep it within its size limit."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-rows", type=int, default=ROUTE_CACHE_MAX_ROWS)
+
+    def handle(self, *args, **options):
+        deleted = purge_route_cache(options["max_rows"])
+        self.stdout.write(f"Road distance cache entries deleted: {deleted}")
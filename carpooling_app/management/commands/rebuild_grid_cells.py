@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.geo_index import grid_cell
+from carpooling_app.models import CreateCarpool
+
+class Command(BaseCommand):
+    help = "Fill start_grid_cell / end_grid_cell for carpools saved before the grid index existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        carpools = CreateCarpool.objects.filter(start_grid_cell__isnull=True, latitude_start__isnull=False, longitude_start__isnull=False)
+        changed = []
+        for carpool in carpools.iterator(chunk_size=options["batch_size"]):
+            carpool.start_grid_cell = grid_cell(carpool.latitude_start, carpool.longitude_start)
+            carpool.end_grid_cell = grid_cell(carpool.latitude_end, carpool.longitude_end)
+            changed.append(carpool)
+
+        CreateCarpool.objects.bulk_update(changed, ["start_grid_cell", "end_grid_cell"], batch_size=options["batch_size"])
+        self.stdout.write(f"Grid cells filled for {len(changed)} carpools")
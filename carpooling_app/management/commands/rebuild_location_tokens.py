@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.location_tokens import sync_location_tokens
+from carpooling_app.models import CreateCarpool
+
+class Command(BaseCommand):
+    help = "Rewrite the location token index of all carpools (e.g. for carpools saved before it existed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = 0
+        for carpool in CreateCarpool.objects.only("createcarpool_id", "start_location", "end_location").iterator(chunk_size=options["batch_size"]):
+            sync_location_tokens(carpool)
+            count += 1
+        self.stdout.write(f"Location tokens rebuilt for {count} carpools")
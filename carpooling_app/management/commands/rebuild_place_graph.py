@@ -0,0 +1,8 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.place_graph import rebuild_place_graph
+
+class Command(BaseCommand):
+    help = "Recount the place graph (carpool routes between normalized locations) from the carpool table."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Place graph rebuilt with {rebuild_place_graph()} routes")
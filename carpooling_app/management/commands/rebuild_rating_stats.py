@@ -0,0 +1,8 @@
+from django.core.management.base import BaseCommand
+from carpooling_app.rating_stats import rebuild_rating_stats
+
+class Command(BaseCommand):
+    help = "Recount the per-driver rating stats (count, sum, 1-5 histogram) from the review table."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Rating stats rebuilt for {rebuild_rating_stats()} drivers")
@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from carpooling_app.enrichment import backfill_carpools, run_enrichment
+
+class Command(BaseCommand):
+    help = ("Fill distance, coordinates and contribution amounts of carpools and bookings saved with enrichment pending, "
+            "then backfill other carpools still missing distance or coordinates.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single pass and exit (for cron).")
+        parser.add_argument("--interval", type=int, default=5, help="Seconds to sleep between passes in worker mode.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--backfill-batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                result = run_enrichment(options["batch_size"])
+                self.stdout.write(f"Enrichment pass: carpools {result['carpools']}, bookings {result['bookings']}")
+                self.stdout.write(f"Backfill pass: carpools {backfill_carpools(options['backfill_batch_size'])}")
+            except Exception as e:
+                self.stderr.write(f"Enrichment pass failed: {str(e)}")
+
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
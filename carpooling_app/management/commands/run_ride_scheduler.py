@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from carpooling_app.ride_lifecycle import recompute_next_transitions, sweep_ride_statuses
+
+class Command(BaseCommand):
+    help = "Move carpools and bookings through upcoming -> active -> completed/auto_completed at their due times."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single sweep and exit (for cron).")
+        parser.add_argument("--interval", type=int, default=60, help="Seconds to sleep between sweeps in worker mode.")
+        parser.add_argument("--recompute", action="store_true", help="Recompute next_transition_at for all open carpools before sweeping.")
+
+    def handle(self, *args, **options):
+        if options["recompute"]:
+            updated = recompute_next_transitions()
+            self.stdout.write(f"next_transition_at recomputed for {updated} carpools")
+
+        while True:
+            try:
+                result = sweep_ride_statuses()
+                self.stdout.write(f"Ride status sweep: carpools {result['carpools']}, bookings {result['bookings']}")
+            except Exception as e:
+                self.stderr.write(f"Ride status sweep failed: {str(e)}")
+
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
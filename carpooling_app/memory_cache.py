@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+
+class BoundedLRU:
+    """
+    Thread-safe in-process LRU with per-entry expiry, used in front of the database-backed caches.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+
+    def get(self, key, now):
+        """
+        Returns (found, value). Expired entries are dropped.
+        """
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                return False, None
+            if cached[1] <= now:
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, cached[0]
+
+    def set(self, key, value, expires_at):
+        """
+        Returns the number of entries evicted to stay within max_size.
+        """
+        evicted = 0
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
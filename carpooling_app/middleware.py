@@ -0,0 +1,50 @@
+import logging
+from django.conf import settings
+from .http_client import external_call_budget
+from .query_budget import N_PLUS_ONE_THRESHOLD, QueryBudgetExceeded, QueryRecorder, budgets_enforced, endpoint_query_stats
+
+logger = logging.getLogger(__name__)
+
+## Time budget for all external (routing/geocoding) calls made while handling one API request
+class ExternalCallBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with external_call_budget():
+            return self.get_response(request)
+
+## SQL count, repeated query shapes (N+1) and DB time per endpoint, checked against the view's @query_budget
+class QueryInstrumentationMiddleware:
+    """
+    Active when settings.QUERY_INSTRUMENTATION is on (defaults to DEBUG). Adds X-DB-Queries / X-DB-Time-ms
+    response headers, keeps per-endpoint totals in query_budget.endpoint_query_stats and logs over-budget
+    and N+1 requests. Over-budget requests raise QueryBudgetExceeded when budgets are enforced (tests).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "QUERY_INSTRUMENTATION", settings.DEBUG):
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        endpoint = f"{request.method} /{match.route}" if match else f"{request.method} {request.path}"
+        budget = getattr(match.func, "query_budget", None) if match else None
+        over_budget = budget is not None and recorder.count > budget
+        repeated = recorder.duplicates(threshold=N_PLUS_ONE_THRESHOLD)
+        endpoint_query_stats.record(endpoint, recorder, over_budget, bool(repeated))
+
+        response["X-DB-Queries"] = str(recorder.count)
+        response["X-DB-Time-ms"] = f"{recorder.total_ms:.2f}"
+        for shape, times in repeated.items():
+            logger.warning("N+1 on %s: %sx %s", endpoint, times, shape)
+        if over_budget:
+            message = f"{endpoint} ran {recorder.count} queries, budget is {budget}"
+            if budgets_enforced():
+                raise QueryBudgetExceeded(message)
+            logger.warning("Query budget exceeded: %s", message)
+        return response
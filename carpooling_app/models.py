@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from .geo_index import grid_cell
+from .feed_cache import invalidate_carpool_feed_receiver
 
 ## User Model
 class User(models.Model):
@@ -29,6 +33,22 @@ class UserDashboardInfo(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+## Carpool ride status -> field holding the time of its next lifecycle transition
+NEXT_TRANSITION_FIELD = {"upcoming": "departure_time", "not_started_yet": "departure_time", "active": "arrival_time"}
+
+## Distance/geocode enrichment state of carpools and bookings (see enrichment.py)
+ENRICHMENT_STATUS_CHOICES = [("pending", "Pending"), ("done", "Done"), ("failed", "Failed")]
+
+## Carpool queries with read-time ride status
+class CarpoolQuerySet(models.QuerySet):
+    def with_effective_status(self, current_time=None):
+        """
+        Annotate effective_ride_status: the ride status at current_time computed in SQL,
+        so GET endpoints don't have to write status before reading it.
+        """
+        from .ride_lifecycle import effective_carpool_status
+        return self.annotate(effective_ride_status=effective_carpool_status(current_time or timezone.now()))
+
 ## Carpool Model
 class CreateCarpool(models.Model):
     createcarpool_id = models.AutoField(primary_key=True)
@@ -51,17 +71,114 @@ class CreateCarpool(models.Model):
     car_number = models.CharField(max_length=20, null=True, blank=True) 
     is_ev_vehicle = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    ## indexed: the in-memory spatial index (spatial_index.py) refreshes from rows updated since its last refresh
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True, db_index=True)
     updated_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="updated_carpool")
     ## optional latitude & longitude fields
     latitude_start = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude_start = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude_end = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude_end = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    ## when the ride-lifecycle scheduler has to look at this carpool next (null = nothing left to do)
+    next_transition_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    ## fixed-grid cells of the start/end coordinates (see geo_index.py), for radius queries
+    start_grid_cell = models.CharField(max_length=20, null=True, blank=True, db_index=True)
+    end_grid_cell = models.CharField(max_length=20, null=True, blank=True, db_index=True)
+    ## simplified road route (encoded polyline) and its bounding box, for corridor matching (see route_geometry.py)
+    route_polyline = models.TextField(null=True, blank=True)
+    route_min_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    route_max_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    route_min_lon = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    route_max_lon = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    ## "pending" while the enrichment worker still has to fill distance_km / coordinates / route
+    enrichment_status = models.CharField(max_length=10, choices=ENRICHMENT_STATUS_CHOICES, default="done")
+    enrichment_attempts = models.PositiveSmallIntegerField(default=0)
+    enrichment_retry_at = models.DateTimeField(null=True, blank=True)
+
+    objects = CarpoolQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["latitude_start", "longitude_start"], name="carpool_start_coords_idx"),
+            models.Index(fields=["latitude_end", "longitude_end"], name="carpool_end_coords_idx"),
+            models.Index(fields=["enrichment_status", "enrichment_retry_at"], name="carpool_enrichment_idx"),
+            ## listings: upcoming rides with free seats (departure_time >= now, available_seats > 0), a driver's rides by time
+            models.Index(fields=["departure_time", "available_seats"], name="carpool_departure_seats_idx"),
+            models.Index(fields=["carpool_creator_driver", "departure_time"], name="carpool_driver_departure_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # keep next_transition_at in line with departure_time / arrival_time / carpool_ride_status
+        field = NEXT_TRANSITION_FIELD.get(self.carpool_ride_status)
+        self.next_transition_at = getattr(self, field) if field else None
+
+        # keep grid cells in line with the coordinates
+        self.start_grid_cell = grid_cell(self.latitude_start, self.longitude_start)
+        self.end_grid_cell = grid_cell(self.latitude_end, self.longitude_end)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            # auto_now only reaches the database if updated_at is saved too
+            update_fields = set(update_fields) | {"updated_at"}
+            if {"departure_time", "arrival_time", "carpool_ride_status"} & update_fields:
+                update_fields.add("next_transition_at")
+            if {"latitude_start", "longitude_start", "latitude_end", "longitude_end"} & update_fields:
+                update_fields |= {"start_grid_cell", "end_grid_cell"}
+            kwargs["update_fields"] = update_fields
+
+        # locations as stored before this save (read again if they were deferred when loading)
+        previous_locations = getattr(self, "_indexed_locations", None)
+        if not self._state.adding and (previous_locations is None or None in previous_locations):
+            previous_locations = CreateCarpool.objects.filter(pk=self.pk).values_list("start_location", "end_location").first()
+        super().save(*args, **kwargs)
+
+        # keep the location token index and the place graph in line with start_location / end_location
+        if previous_locations != (self.start_location, self.end_location):
+            from .location_tokens import sync_location_tokens
+            from .place_graph import move_route
+            sync_location_tokens(self)
+            move_route(previous_locations, (self.start_location, self.end_location))
+            self._indexed_locations = (self.start_location, self.end_location)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # locations as stored, so save() only rewrites tokens / graph edges when they change
+        instance._indexed_locations = (instance.__dict__.get("start_location"), instance.__dict__.get("end_location"))
+        return instance
 
     def __str__(self):
         return self.carpool_creator_driver.username
 
+## Deleted carpools (also through cascades) leave the place graph
+def remove_carpool_route(sender, instance, **kwargs):
+    from .place_graph import move_route
+    move_route((instance.start_location, instance.end_location), None)
+
+post_delete.connect(remove_carpool_route, sender=CreateCarpool)
+
+## Deleted carpools leave this worker's spatial index at once
+def remove_carpool_from_index(sender, instance, **kwargs):
+    from .spatial_index import carpool_index
+    carpool_index.discard(instance.pk)
+
+post_delete.connect(remove_carpool_from_index, sender=CreateCarpool)
+
+# Created / updated (incl. seats taken or freed by bookings) / deleted carpools drop the cached public feed
+post_save.connect(invalidate_carpool_feed_receiver, sender=CreateCarpool)
+post_delete.connect(invalidate_carpool_feed_receiver, sender=CreateCarpool)
+
+## Booking queries with read-time ride status
+class BookingQuerySet(models.QuerySet):
+    def with_effective_status(self, current_time=None):
+        """
+        Annotate effective_carpool_ride_status and effective_ride_status computed in SQL.
+        """
+        from .ride_lifecycle import effective_booking_status, effective_carpool_status
+        current_time = current_time or timezone.now()
+        return self.annotate(effective_carpool_ride_status=effective_carpool_status(current_time, prefix="carpool_driver_name__")).annotate(
+            effective_ride_status=effective_booking_status())
+
 ## Booking Model
 class Booking(models.Model):
     booking_id = models.AutoField(primary_key=True)
@@ -85,6 +202,19 @@ class Booking(models.Model):
     pickup_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     drop_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     drop_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    ## "pending" while the enrichment worker still has to fill distance_travelled / coordinates / contribution_amount
+    enrichment_status = models.CharField(max_length=10, choices=ENRICHMENT_STATUS_CHOICES, default="done")
+    enrichment_attempts = models.PositiveSmallIntegerField(default=0)
+    enrichment_retry_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["enrichment_status", "enrichment_retry_at"], name="booking_enrichment_idx"),
+            ## bookings of a carpool by status (confirmed seats, waitlist, pending requests)
+            models.Index(fields=["carpool_driver_name", "booking_status"], name="booking_carpool_status_idx"),
+        ]
 
     def __str__(self):
         return self.passenger_name.username
@@ -125,9 +255,57 @@ class ReviewRating(models.Model):
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     updated_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="updated_review")
 
+    def save(self, *args, **kwargs):
+        # rating as stored before this save, so the driver's rating stats only move when it changes
+        previous = getattr(self, "_counted_rating", None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if previous != (self.review_for_id, self.rating):
+                from .rating_stats import move_rating
+                move_rating(previous, (self.review_for_id, self.rating))
+                self._counted_rating = (self.review_for_id, self.rating)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted_rating = (instance.__dict__.get("review_for_id"), instance.__dict__.get("rating"))
+        return instance
+
     def __str__(self):
         return f"{self.review_given_by.username} > {self.review_for.username} ({self.rating})"
 
+## Per-driver rating stats (count, sum, 1-5 histogram), kept in line with ReviewRating (see rating_stats.py)
+class DriverRatingStats(models.Model):
+    driver = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="rating_stats")
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    @property
+    def average_rating(self):
+        return round(self.rating_sum / self.review_count, 2) if self.review_count else 0
+
+    @property
+    def histogram(self):
+        return {value: getattr(self, f"rating_{value}") for value in range(1, 6)}
+
+    def __str__(self):
+        return f"{self.driver_id}: {self.average_rating} ({self.review_count})"
+
+## Deleted reviews (also through cascades) leave the driver's rating stats
+def remove_review_rating(sender, instance, **kwargs):
+    from .rating_stats import move_rating
+    move_rating(getattr(instance, "_counted_rating", None), None)
+
+# The feed shows each driver's average rating
+post_save.connect(invalidate_carpool_feed_receiver, sender=ReviewRating)
+post_delete.connect(invalidate_carpool_feed_receiver, sender=ReviewRating)
+post_delete.connect(remove_review_rating, sender=ReviewRating)
+
 ## model for token blacklist(logout flow)
 class TokenBlacklistLogout(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -137,3 +315,55 @@ class TokenBlacklistLogout(models.Model):
 
     def __str__(self):
         return self.token
+
+## Geocode cache (shared by all workers, see geocode_cache.py)
+class GeocodeCacheEntry(models.Model):
+    place_key = models.CharField(max_length=255, unique=True)
+    ## both null = place not found (negative entry)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.place_key} ({self.latitude}, {self.longitude})"
+
+## Road distance cache (shared by all workers, see route_cache.py)
+class RouteDistanceCacheEntry(models.Model):
+    ## "<profile>:<lat1>,<lon1>;<lat2>,<lon2>" with coordinates snapped to ROUTE_CACHE_PRECISION
+    route_key = models.CharField(max_length=100, unique=True)
+    distance_km = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.route_key} ({self.distance_km} KM)"
+
+## Normalized terms / trigrams of carpool start and end locations (filled on save, see location_tokens.py)
+class LocationToken(models.Model):
+    carpool = models.ForeignKey(CreateCarpool, on_delete=models.CASCADE, related_name="location_tokens")
+    point = models.CharField(max_length=5, choices=[("start", "Start"), ("end", "End")])
+    kind = models.CharField(max_length=7, choices=[("term", "Term"), ("trigram", "Trigram")])
+    token = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["point", "kind", "token"], name="location_token_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.point} {self.kind} {self.token!r} ({self.carpool_id})"
+
+## Place graph: normalized start -> end locations of carpools, with how many carpools use the route (see place_graph.py)
+class PlaceEdge(models.Model):
+    from_place = models.CharField(max_length=255)
+    to_place = models.CharField(max_length=255, db_index=True)
+    carpool_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["from_place", "to_place"], name="place_edge_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.from_place} -> {self.to_place} ({self.carpool_count})"
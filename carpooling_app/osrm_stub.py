@@ -0,0 +1,93 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from .distance_kernel import haversine_km
+from .route_geometry import encode_polyline
+
+# Stub road distance = straight line x this factor
+STUB_ROAD_FACTOR = 1.25
+
+class OSRMStubHandler(BaseHTTPRequestHandler):
+    """
+    Answers OSRM /route/v1 and /table/v1 requests with straight-line distances x STUB_ROAD_FACTOR
+    (and a straight-line route geometry when one is asked for).
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        self.server.requests.append(self.path)
+
+        try:
+            service, coordinates = parts[0], parts[3]
+            # OSRM order: longitude, latitude
+            points = [tuple(float(value) for value in point.split(",")[::-1]) for point in coordinates.split(";")]
+        except (IndexError, ValueError):
+            return self.reply(400, {"code": "InvalidUrl"})
+
+        if service == "route":
+            route = {"distance": self.meters(points[0], points[1])}
+            if "geometries" in parse_qs(url.query):
+                # straight line with a few vertices, enough for corridor checks
+                route["geometry"] = encode_polyline([(points[0][0] + (points[1][0] - points[0][0]) * step / 4,
+                                                      points[0][1] + (points[1][1] - points[0][1]) * step / 4) for step in range(5)])
+            return self.reply(200, {"code": "Ok", "routes": [route]})
+
+        if service == "table":
+            query = parse_qs(url.query)
+            sources = [int(i) for i in query["sources"][0].split(";")] if "sources" in query else range(len(points))
+            destinations = [int(j) for j in query["destinations"][0].split(";")] if "destinations" in query else range(len(points))
+            return self.reply(200, {"code": "Ok", "distances": [[self.meters(points[i], points[j]) for j in destinations] for i in sources]})
+
+        return self.reply(400, {"code": "InvalidService"})
+
+    def meters(self, origin, destination):
+        return round(float(haversine_km(*origin, *destination)) * STUB_ROAD_FACTOR * 1000, 1)
+
+    def reply(self, status_code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class OSRMStubServer:
+    """
+    Local OSRM stand-in for tests and offline benchmarks:
+
+        with OSRMStubServer() as osrm:
+            with mock.patch("carpooling_app.utils.OSRM_BASE_URL", osrm.base_url): ...
+
+    osrm.requests lists the paths that were requested.
+    """
+    def __init__(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), OSRMStubHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    # python -m carpooling_app.osrm_stub [port]
+    with OSRMStubServer(int(sys.argv[1]) if len(sys.argv) > 1 else 5000) as osrm:
+        print("OSRM stub listening on", osrm.base_url)
+        osrm.thread.join()
@@ -0,0 +1,81 @@
+import base64
+import heapq
+import json
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.settings import api_settings
+
+# Rows per page when the request has no "limit" (REST_FRAMEWORK["PAGE_SIZE"]), and the largest "limit" accepted
+DEFAULT_RESULT_LIMIT = api_settings.PAGE_SIZE or 20
+MAX_RESULT_LIMIT = 100
+
+## Parse the "limit" request parameter
+def parse_limit(value):
+    """
+    Returns DEFAULT_RESULT_LIMIT for an empty value, else the integer capped at MAX_RESULT_LIMIT.
+    Raises ValueError if value is not a positive integer.
+    """
+    if value in (None, ""):
+        return DEFAULT_RESULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_RESULT_LIMIT)
+
+## Opaque cursor for a list of key values (numbers, strings, datetimes)
+def encode_cursor(values):
+    values = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+## Key values of a cursor made by encode_cursor, None for an empty cursor
+def decode_cursor(cursor, size):
+    """
+    size: number of key values the endpoint expects.
+    Raises ValueError if the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor) + "=" * (-len(str(cursor)) % 4)))
+        values = [datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in values]
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+## One page of carpools in (departure_time, createcarpool_id) order, seeking past the cursor
+def keyset_page(queryset, cursor, limit, descending=False):
+    """
+    The page is read with "WHERE (departure_time, id) > cursor ORDER BY departure_time, id LIMIT limit + 1",
+    so the cost of a page doesn't grow with how deep it is (unlike OFFSET).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError if the cursor is malformed.
+    """
+    after = decode_cursor(cursor, 2)
+    if after is not None:
+        departure_time, carpool_id = after
+        if descending:
+            queryset = queryset.filter(Q(departure_time__lt=departure_time) | Q(departure_time=departure_time, createcarpool_id__lt=carpool_id))
+        else:
+            queryset = queryset.filter(Q(departure_time__gt=departure_time) | Q(departure_time=departure_time, createcarpool_id__gt=carpool_id))
+
+    order = ("-departure_time", "-createcarpool_id") if descending else ("departure_time", "createcarpool_id")
+    rows = list(queryset.order_by(*order)[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1].departure_time, rows[-1].createcarpool_id])
+
+## One page of in-memory ranked results (smallest key first), after the key of the cursor
+def ranked_page(keys, after, limit):
+    """
+    keys: sort key tuple per result, unique (end them with the primary key)
+    after: key of the last result of the previous page, or None for the first page
+    Selects the page with a bounded heap (O(n log limit)).
+    Returns (indexes, last_key); last_key is None on the last page.
+    """
+    remaining = [i for i in range(len(keys)) if after is None or keys[i] > tuple(after)]
+    page = heapq.nsmallest(limit, remaining, key=keys.__getitem__)
+    has_more = len(remaining) > limit
+    return page, keys[page[-1]] if page and has_more else None
@@ -0,0 +1,75 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from .geocode_cache import normalize_place_key
+from .location_tokens import location_text_matches
+from .models import CreateCarpool, PlaceEdge
+
+## Count a carpool route in the graph (delta=1) or take it out (delta=-1)
+def add_route(start_location, end_location, delta=1):
+    from_place, to_place = normalize_place_key(start_location or ""), normalize_place_key(end_location or "")
+    if not from_place or not to_place or from_place == to_place:
+        return
+
+    edges = PlaceEdge.objects.filter(from_place=from_place, to_place=to_place)
+    if delta < 0:
+        edges.filter(carpool_count__gte=-delta).update(carpool_count=F("carpool_count") + delta)
+        return
+    if not edges.update(carpool_count=F("carpool_count") + delta):
+        try:
+            with transaction.atomic():
+                PlaceEdge.objects.create(from_place=from_place, to_place=to_place, carpool_count=delta)
+        except IntegrityError:
+            # created by a concurrent save in the meantime
+            edges.update(carpool_count=F("carpool_count") + delta)
+
+## Move a carpool from its previous (start, end) route to the current one (either may be None)
+def move_route(previous_locations, current_locations):
+    if previous_locations:
+        add_route(*previous_locations, delta=-1)
+    if current_locations:
+        add_route(*current_locations)
+
+## Places with a carpool route to or from any of the given places (one indexed query)
+def place_neighbors(places):
+    keys = [key for key in {normalize_place_key(place or "") for place in places} if key]
+    if not keys:
+        return set()
+
+    neighbors = set()
+    for from_place, to_place in PlaceEdge.objects.filter(Q(from_place__in=keys) | Q(to_place__in=keys), carpool_count__gt=0).values_list("from_place", "to_place"):
+        if from_place in keys:
+            neighbors.add(to_place)
+        if to_place in keys:
+            neighbors.add(from_place)
+    return neighbors
+
+## Is place a known stop on the way from start to end?
+def is_known_stop(place, start_location, end_location):
+    """
+    True if place matches (see location_text_matches) start / end themselves, or a place some carpool
+    travels to or from start or end.
+    """
+    key = normalize_place_key(place or "")
+    if not key:
+        return False
+    if any(location_text_matches(key, normalize_place_key(location or "")) for location in (start_location, end_location)):
+        return True
+    return any(location_text_matches(key, neighbor) for neighbor in place_neighbors([start_location, end_location]))
+
+## Recount the whole graph from the carpool table
+def rebuild_place_graph():
+    """
+    Returns:
+    int: number of edges.
+    """
+    counts = {}
+    for start_location, end_location in CreateCarpool.objects.values_list("start_location", "end_location").iterator():
+        from_place, to_place = normalize_place_key(start_location), normalize_place_key(end_location)
+        if from_place and to_place and from_place != to_place:
+            counts[(from_place, to_place)] = counts.get((from_place, to_place), 0) + 1
+
+    with transaction.atomic():
+        PlaceEdge.objects.all().delete()
+        PlaceEdge.objects.bulk_create([PlaceEdge(from_place=from_place, to_place=to_place, carpool_count=count)
+                                       for (from_place, to_place), count in counts.items()], batch_size=1000)
+    return len(counts)
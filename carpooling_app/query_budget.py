@@ -0,0 +1,124 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connection
+
+# A query shape seen this many times in one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = getattr(settings, "N_PLUS_ONE_THRESHOLD", 5)
+
+# Transaction bookkeeping, not counted against budgets
+IGNORED_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+## Declare the most SQL queries a view may run per request
+def query_budget(max_queries):
+    """
+    Put it above @api_view, so the budget sits on the view Django resolves:
+
+        @query_budget(5)
+        @api_view(["GET"])
+        def carpool_detail(request): ...
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+## Query with literals replaced by "?", so the same statement with other values has the same shape
+def query_shape(sql):
+    shape = sql.replace("%s", "?")
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", shape)  # IN lists of any length
+    return " ".join(shape.split())
+
+class QueryRecorder:
+    """
+    Records the SQL run on the default connection inside the block, with its time:
+
+        with QueryRecorder() as recorder:
+            ...
+        recorder.count, recorder.total_ms, recorder.duplicates()
+    """
+    def __init__(self):
+        self.queries = []  # (sql, elapsed_ms)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.lstrip().upper().startswith(IGNORED_STATEMENTS):
+                self.queries.append((sql, (time.monotonic() - started) * 1000))
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_ms(self):
+        return sum(elapsed_ms for _, elapsed_ms in self.queries)
+
+    def duplicates(self, threshold=2):
+        """
+        Returns {shape: times run} for shapes run at least threshold times.
+        """
+        counts = Counter(query_shape(sql) for sql, _ in self.queries)
+        return {shape: times for shape, times in counts.most_common() if times >= threshold}
+
+class EndpointQueryStats:
+    """
+    SQL count and DB time per endpoint in this worker.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}  # endpoint -> {"requests", "queries", "max_queries", "db_ms", "over_budget", "n_plus_one"}
+
+    def record(self, endpoint, recorder, over_budget, n_plus_one):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"requests": 0, "queries": 0, "max_queries": 0, "db_ms": 0.0, "over_budget": 0, "n_plus_one": 0})
+            stats["requests"] += 1
+            stats["queries"] += recorder.count
+            stats["max_queries"] = max(stats["max_queries"], recorder.count)
+            stats["db_ms"] += recorder.total_ms
+            stats["over_budget"] += int(over_budget)
+            stats["n_plus_one"] += int(n_plus_one)
+
+    def as_dict(self):
+        with self.lock:
+            return {endpoint: dict(stats, avg_queries=round(stats["queries"] / stats["requests"], 2), avg_db_ms=round(stats["db_ms"] / stats["requests"], 2))
+                    for endpoint, stats in self.endpoints.items()}
+
+    def clear(self):
+        with self.lock:
+            self.endpoints.clear()
+
+endpoint_query_stats = EndpointQueryStats()
+
+_strict = ContextVar("query_budget_strict", default=False)
+
+## Raise QueryBudgetExceeded for over-budget requests inside the block (QUERY_BUDGET_STRICT does it everywhere)
+@contextmanager
+def enforce_query_budgets():
+    token = _strict.set(True)
+    try:
+        yield
+    finally:
+        _strict.reset(token)
+
+def budgets_enforced():
+    return _strict.get() or getattr(settings, "QUERY_BUDGET_STRICT", False)
@@ -0,0 +1,60 @@
+import numpy as np
+from .distance_kernel import haversine_km, to_array
+from .models import DriverRatingStats
+
+# Weight of each ranking signal (every signal is scored 0..1, higher is better)
+RANKING_WEIGHTS = {
+    "pickup": 0.35,       # searched start -> carpool start
+    "destination": 0.25,  # searched end -> carpool end, or the detour to drop there on the way
+    "departure": 0.2,     # departure close to the wanted time
+    "seats": 0.1,         # enough free seats for the passengers
+    "rating": 0.1,        # driver's average rating
+}
+
+# Hours after the wanted time at which the departure signal has dropped to one half
+DEPARTURE_HALF_SCORE_HOURS = 24
+
+## Average rating of each driver of the given carpools, from the rating stats table in one query
+def driver_ratings(carpools):
+    driver_ids = {carpool.carpool_creator_driver_id for carpool in carpools}
+    return {stats.driver_id: stats.average_rating for stats in DriverRatingStats.objects.filter(driver_id__in=driver_ids)}
+
+## 1 at distance 0, falling linearly to 0 at radius_km; missing distances score 0
+def distance_score(distances, radius_km):
+    distances = np.asarray(distances, dtype=float)
+    return np.nan_to_num(1 - np.clip(distances, 0, radius_km) / radius_km, nan=0.0)
+
+## Relevance score of every carpool for a search
+def score_carpools(carpools, checks, end_lat, end_lon, radius_km, wanted_time, seats_needed=1):
+    """
+    carpools: list of CreateCarpool matches
+    checks: distance_kernel.carpool_distance_checks() result for the same list
+    wanted_time: departure the passenger is looking for (the searched day, or now)
+    Returns a list of scores (same order as carpools), 0..1, higher is better.
+    """
+    count = len(carpools)
+    if not count:
+        return []
+
+    pickup = distance_score(checks["start_distance"], radius_km) if checks["start_distance"] is not None else np.ones(count)
+
+    if checks["end_distance"] is not None:
+        # detour of a drop-off at the searched end on the way A -> P -> B
+        lats_a, lons_a = to_array([c.latitude_start for c in carpools]), to_array([c.longitude_start for c in carpools])
+        lats_b, lons_b = to_array([c.latitude_end for c in carpools]), to_array([c.longitude_end for c in carpools])
+        detour = np.abs(haversine_km(lats_a, lons_a, end_lat, end_lon) + haversine_km(end_lat, end_lon, lats_b, lons_b) - haversine_km(lats_a, lons_a, lats_b, lons_b))
+        destination = distance_score(np.fmin(checks["end_distance"], detour), radius_km)
+    else:
+        destination = np.ones(count)
+
+    hours_away = np.array([abs((c.departure_time - wanted_time).total_seconds()) / 3600 for c in carpools])
+    departure = DEPARTURE_HALF_SCORE_HOURS / (DEPARTURE_HALF_SCORE_HOURS + hours_away)
+
+    seats = np.array([min(c.available_seats, seats_needed) / seats_needed for c in carpools], dtype=float)
+
+    ratings = driver_ratings(carpools)
+    rating = np.array([ratings.get(c.carpool_creator_driver_id, 0) / 5 for c in carpools])
+
+    scores = (RANKING_WEIGHTS["pickup"] * pickup + RANKING_WEIGHTS["destination"] * destination + RANKING_WEIGHTS["departure"] * departure
+              + RANKING_WEIGHTS["seats"] * seats + RANKING_WEIGHTS["rating"] * rating)
+    return scores.tolist()
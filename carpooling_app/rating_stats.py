@@ -0,0 +1,54 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from .models import DriverRatingStats, ReviewRating
+
+# Ratings a review can have
+RATING_VALUES = range(1, 6)
+
+## Count a review of rating for driver_id in the stats (delta=1) or take it out (delta=-1)
+def add_rating(driver_id, rating, delta=1):
+    if driver_id is None or rating not in RATING_VALUES:
+        return
+
+    changes = {"review_count": F("review_count") + delta, "rating_sum": F("rating_sum") + delta * rating,
+               f"rating_{rating}": F(f"rating_{rating}") + delta}
+    stats = DriverRatingStats.objects.filter(driver_id=driver_id)
+    if delta < 0:
+        stats.filter(**{f"rating_{rating}__gte": -delta}).update(**changes)
+        return
+    if not stats.update(**changes):
+        try:
+            with transaction.atomic():
+                DriverRatingStats.objects.create(driver_id=driver_id, review_count=delta, rating_sum=delta * rating, **{f"rating_{rating}": delta})
+        except IntegrityError:
+            # created by a concurrent review in the meantime
+            stats.update(**changes)
+
+## Move a review from its previous (driver_id, rating) to the current one (either may be None)
+def move_rating(previous, current):
+    if previous:
+        add_rating(*previous, delta=-1)
+    if current:
+        add_rating(*current)
+
+## Average rating of a driver from the stats row (0 without reviews)
+def average_rating_of(driver):
+    """
+    Reads driver.rating_stats, so select_related("...rating_stats") makes it free of queries.
+    """
+    stats = getattr(driver, "rating_stats", None) if driver else None
+    return stats.average_rating if stats else 0
+
+## Recount the whole stats table from the reviews
+def rebuild_rating_stats():
+    """
+    Returns:
+    int: number of drivers with reviews.
+    """
+    per_rating = {f"rating_{value}": Count("review_id", filter=Q(rating=value)) for value in RATING_VALUES}
+    rows = ReviewRating.objects.values("review_for_id").annotate(review_count=Count("review_id"), rating_sum=Sum("rating"), **per_rating)
+
+    with transaction.atomic():
+        DriverRatingStats.objects.all().delete()
+        DriverRatingStats.objects.bulk_create([DriverRatingStats(driver_id=row.pop("review_for_id"), **row) for row in rows], batch_size=1000)
+    return DriverRatingStats.objects.count()
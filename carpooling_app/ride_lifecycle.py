@@ -0,0 +1,150 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, CharField, F, Q, Value, When
+from django.utils import timezone
+from .feed_cache import invalidate_carpool_feed
+from .models import NEXT_TRANSITION_FIELD, Booking, CreateCarpool
+
+# Carpool states the scheduler still has to move forward
+OPEN_RIDE_STATUSES = ["upcoming", "active", "not_started_yet"]
+
+# Carpool states a ride ends in once its arrival time has passed
+FINISHED_RIDE_STATUSES = ["completed", "auto_completed"]
+
+# Active rides are auto-completed this long after their arrival time
+AUTO_COMPLETE_AFTER = timedelta(hours=1)
+
+## Carpool transition rules: (new carpool_ride_status, condition at current_time)
+def carpool_transition_rules(current_time, prefix=""):
+    """
+    Each rule is applied to due open carpools as one UPDATE ... WHERE statement.
+    - upcoming before departure
+    - active between departure and arrival
+    - completed in the first hour after arrival
+    - auto_completed for rides still active one hour after arrival
+    prefix: lookup path to the carpool, e.g. "carpool_driver_name__" when filtering bookings.
+    """
+    auto_complete_time = current_time - AUTO_COMPLETE_AFTER
+    departure_time = prefix + "departure_time"
+    arrival_time = prefix + "arrival_time"
+    ride_status = prefix + "carpool_ride_status"
+    return [
+        ("upcoming", Q(**{departure_time + "__gt": current_time}) & ~Q(**{ride_status: "upcoming"})),
+        ("active", Q(**{departure_time + "__lte": current_time}) & (Q(**{arrival_time + "__gt": current_time}) | Q(**{arrival_time + "__isnull": True}))
+                   & ~Q(**{ride_status: "active"})),
+        ("completed", Q(**{arrival_time + "__lte": current_time, arrival_time + "__gte": auto_complete_time})),
+        ("auto_completed", Q(**{arrival_time + "__lt": auto_complete_time, ride_status: "active"})),
+    ]
+
+## Booking transition rules: (rule name, condition, new values)
+# Conditions are evaluated against the carpool status *after* the carpool rules ran.
+BOOKING_TRANSITION_RULES = [
+    # Passenger manually cancelled
+    ("cancelled_by_passenger",
+     Q(booking_status="cancelled") & ~Q(ride_status="cancelled"),
+     {"ride_status": "cancelled"}),
+
+    # Ride active
+    ("active",
+     Q(carpool_driver_name__carpool_ride_status="active", booking_status__in=["confirmed", "pending", "waitlisted"]) & ~Q(ride_status="active"),
+     {"ride_status": "active"}),
+
+    # Ride completed or auto-completed, passenger travelled
+    ("confirmed_to_completed",
+     Q(carpool_driver_name__carpool_ride_status__in=FINISHED_RIDE_STATUSES, booking_status="confirmed") & ~Q(ride_status="completed"),
+     {"ride_status": "completed"}),
+
+    # Ride completed or auto-completed, booking never confirmed
+    ("unconfirmed_to_did_not_travelled",
+     Q(carpool_driver_name__carpool_ride_status__in=FINISHED_RIDE_STATUSES, booking_status__in=["pending", "waitlisted", "rejected"]),
+     {"booking_status": "cancelled", "ride_status": "did_not_travelled"}),
+
+    # Upcoming ride
+    ("upcoming",
+     Q(carpool_driver_name__carpool_ride_status="upcoming") & ~Q(booking_status="cancelled") & ~Q(ride_status="upcoming"),
+     {"ride_status": "upcoming"}),
+]
+
+## next_transition_at value for a carpool moved to new_status
+def next_transition_value(new_status):
+    field = NEXT_TRANSITION_FIELD.get(new_status)
+    return F(field) if field else None
+
+## Move every due carpool (and its bookings) to the status it should have now
+def sweep_ride_statuses(current_time=None):
+    """
+    Single pass of the ride-lifecycle scheduler.
+    Only carpools with next_transition_at <= now are looked at, so the cost of a
+    sweep follows the number of due rides, not the number of open rides.
+    Every carpool and booking transition is one set-based UPDATE ... WHERE.
+
+    Returns:
+    dict: rows touched by each carpool rule and each booking rule, e.g.
+        {"carpools": {"active": 3, ..., "stalled": 0}, "bookings": {"confirmed_to_completed": 7, ...}}
+    """
+    current_time = current_time or timezone.now()
+    carpool_counts = {}
+    booking_counts = {}
+
+    with transaction.atomic():
+        due_carpools = CreateCarpool.objects.filter(carpool_ride_status__in=OPEN_RIDE_STATUSES, next_transition_at__lte=current_time)
+
+        transitioned_ids = []
+        for new_status, condition in carpool_transition_rules(current_time):
+            ids = list(due_carpools.filter(condition).values_list("createcarpool_id", flat=True))
+            transitioned_ids += ids
+            carpool_counts[new_status] = CreateCarpool.objects.filter(createcarpool_id__in=ids).update(
+                carpool_ride_status=new_status, next_transition_at=next_transition_value(new_status), updated_at=current_time)
+
+        # Still due after every rule ran: nothing can move these any more (e.g. never started, arrival long gone)
+        carpool_counts["stalled"] = due_carpools.update(next_transition_at=None)
+
+        swept_bookings = Booking.objects.filter(carpool_driver_name__in=transitioned_ids)
+        for rule_name, condition, values in BOOKING_TRANSITION_RULES:
+            booking_counts[rule_name] = swept_bookings.filter(condition).update(updated_at=current_time, **values)
+
+        # set-based updates send no post_save
+        if transitioned_ids:
+            invalidate_carpool_feed()
+
+    return {"carpools": carpool_counts, "bookings": booking_counts}
+
+## Recompute next_transition_at for every open carpool (after a migration or bulk import)
+def recompute_next_transitions():
+    """
+    Returns:
+    int: number of carpools updated.
+    """
+    updated = 0
+    for ride_status in OPEN_RIDE_STATUSES:
+        updated += CreateCarpool.objects.filter(carpool_ride_status=ride_status).update(next_transition_at=next_transition_value(ride_status))
+    return updated
+
+## Ride status a carpool has at current_time, computed in SQL (read-only, nothing is written)
+def effective_carpool_status(current_time, prefix=""):
+    """
+    Case/When expression applying the carpool transition rules at read time,
+    so list endpoints show the right status even before the scheduler has run.
+    """
+    open_status = Q(**{prefix + "carpool_ride_status__in": OPEN_RIDE_STATUSES})
+    return Case(
+        *[When(open_status & condition, then=Value(new_status)) for new_status, condition in carpool_transition_rules(current_time, prefix)],
+        default=F(prefix + "carpool_ride_status"),
+        output_field=CharField(),
+    )
+
+## Booking ride_status at current_time, given the annotated effective carpool status
+def effective_booking_status(carpool_status_field="effective_carpool_ride_status"):
+    """
+    Case/When expression mirroring BOOKING_TRANSITION_RULES for bookings of open carpools.
+    """
+    open_carpool = Q(carpool_driver_name__carpool_ride_status__in=OPEN_RIDE_STATUSES)
+    return Case(
+        When(open_carpool & Q(booking_status="cancelled"), then=Value("cancelled")),
+        When(open_carpool & Q(**{carpool_status_field: "active", "booking_status__in": ["confirmed", "pending", "waitlisted"]}), then=Value("active")),
+        When(open_carpool & Q(**{carpool_status_field + "__in": FINISHED_RIDE_STATUSES, "booking_status": "confirmed"}), then=Value("completed")),
+        When(open_carpool & Q(**{carpool_status_field + "__in": FINISHED_RIDE_STATUSES}), then=Value("did_not_travelled")),
+        When(open_carpool & Q(**{carpool_status_field: "upcoming"}), then=Value("upcoming")),
+        default=F("ride_status"),
+        output_field=CharField(),
+    )
@@ -0,0 +1,129 @@
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .memory_cache import BoundedLRU
+from .models import RouteDistanceCacheEntry
+
+# Decimal places coordinates are snapped to before lookup (3 = ~110 m)
+ROUTE_CACHE_PRECISION = getattr(settings, "ROUTE_CACHE_PRECISION", 3)
+
+# How long an OSRM road distance stays cached
+ROUTE_CACHE_TTL = getattr(settings, "ROUTE_CACHE_TTL", timedelta(days=1))
+
+# Entries kept in the in-process LRU of each worker
+ROUTE_CACHE_LRU_SIZE = getattr(settings, "ROUTE_CACHE_LRU_SIZE", 4096)
+
+# Rows kept in the cache table, the entries expiring first are purged beyond this
+ROUTE_CACHE_MAX_ROWS = getattr(settings, "ROUTE_CACHE_MAX_ROWS", 100000)
+
+# Route keys per "route_key IN (...)" lookup, stays below the bind parameter limit of every backend
+ROUTE_CACHE_LOOKUP_BATCH_SIZE = 500
+
+## Cache key for a directed route, coordinates snapped to ROUTE_CACHE_PRECISION
+def route_key(lat1, lon1, lat2, lon2, profile="driving"):
+    origin, destination = (",".join(f"{float(value):.{ROUTE_CACHE_PRECISION}f}" for value in point) for point in ((lat1, lon1), (lat2, lon2)))
+    return f"{profile}:{origin};{destination}"
+
+class RouteDistanceCache:
+    """
+    Two-level road distance cache: an in-process LRU in front of the RouteDistanceCacheEntry table.
+    Only successful OSRM distances are cached, failures are retried on the next call.
+    """
+    def __init__(self, max_size=ROUTE_CACHE_LRU_SIZE):
+        self.lock = threading.Lock()
+        self.memory = BoundedLRU(max_size)  # route key -> distance in KM
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def get(self, lat1, lon1, lat2, lon2, profile="driving"):
+        """
+        Returns the cached distance in KM, else None.
+        """
+        key = route_key(lat1, lon1, lat2, lon2, profile)
+        now = timezone.now()
+
+        found, distance_km = self.memory.get(key, now)
+        if found:
+            self._count("memory_hits")
+            return distance_km
+
+        entry = RouteDistanceCacheEntry.objects.filter(route_key=key, expires_at__gt=now).first()
+        if entry:
+            distance_km = float(entry.distance_km)
+            self._count("evictions", self.memory.set(key, distance_km, entry.expires_at))
+            self._count("db_hits")
+            return distance_km
+
+        self._count("misses")
+        return None
+
+    def get_many(self, pairs, profile="driving"):
+        """
+        pairs: list of ((lat1, lon1), (lat2, lon2)). Returns {route key: distance in KM} for the cached ones,
+        with one database query per ROUTE_CACHE_LOOKUP_BATCH_SIZE keys not in the LRU.
+        """
+        now = timezone.now()
+        found_distances = {}
+        missing_keys = []
+        for key in {route_key(*origin, *destination, profile) for origin, destination in pairs}:
+            found, distance_km = self.memory.get(key, now)
+            if found:
+                found_distances[key] = distance_km
+            else:
+                missing_keys.append(key)
+        self._count("memory_hits", len(found_distances))
+
+        db_hits = 0
+        for start in range(0, len(missing_keys), ROUTE_CACHE_LOOKUP_BATCH_SIZE):
+            for entry in RouteDistanceCacheEntry.objects.filter(route_key__in=missing_keys[start:start + ROUTE_CACHE_LOOKUP_BATCH_SIZE], expires_at__gt=now):
+                found_distances[entry.route_key] = float(entry.distance_km)
+                self._count("evictions", self.memory.set(entry.route_key, float(entry.distance_km), entry.expires_at))
+                db_hits += 1
+        self._count("db_hits", db_hits)
+        self._count("misses", len(missing_keys) - db_hits)
+        return found_distances
+
+    def set_many(self, distances, profile="driving"):
+        """
+        distances: {((lat1, lon1), (lat2, lon2)): distance in KM}, written with one bulk upsert.
+        """
+        expires_at = timezone.now() + ROUTE_CACHE_TTL
+        entries = {}
+        for (origin, destination), distance_km in distances.items():
+            key = route_key(*origin, *destination, profile)
+            entries[key] = RouteDistanceCacheEntry(route_key=key, distance_km=round(distance_km, 2), expires_at=expires_at)
+            self._count("evictions", self.memory.set(key, distance_km, expires_at))
+
+        # MySQL upserts with ON DUPLICATE KEY and rejects a conflict target, SQLite / PostgreSQL need one
+        conflict_target = {"unique_fields": ["route_key"]} if connections[RouteDistanceCacheEntry.objects.db].features.supports_update_conflicts_with_target else {}
+        RouteDistanceCacheEntry.objects.bulk_create(list(entries.values()), update_conflicts=True, update_fields=["distance_km", "expires_at"], **conflict_target)
+
+    def set(self, lat1, lon1, lat2, lon2, distance_km, profile="driving"):
+        key = route_key(lat1, lon1, lat2, lon2, profile)
+        expires_at = timezone.now() + ROUTE_CACHE_TTL
+        RouteDistanceCacheEntry.objects.update_or_create(route_key=key, defaults={"distance_km": round(distance_km, 2), "expires_at": expires_at})
+        self._count("evictions", self.memory.set(key, distance_km, expires_at))
+
+    def clear_memory(self):
+        self.memory.clear()
+
+## Delete expired rows, then the rows expiring first beyond ROUTE_CACHE_MAX_ROWS
+def purge_route_cache(max_rows=ROUTE_CACHE_MAX_ROWS):
+    """
+    Returns:
+    int: number of rows deleted.
+    """
+    deleted, _ = RouteDistanceCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    overflow_ids = list(RouteDistanceCacheEntry.objects.order_by("-expires_at").values_list("id", flat=True)[max_rows:])
+    for start in range(0, len(overflow_ids), 1000):
+        deleted += RouteDistanceCacheEntry.objects.filter(id__in=overflow_ids[start:start + 1000]).delete()[0]
+    return deleted
+
+# One LRU per worker process, the table is shared
+route_cache = RouteDistanceCache()
@@ -0,0 +1,137 @@
+from functools import lru_cache
+import numpy as np
+from .distance_kernel import EARTH_RADIUS_KM
+
+# Half-width (KM) of the corridor around a stored route inside which a point counts as "on the way"
+ROUTE_CORRIDOR_KM = 10
+
+# Largest offset (KM) of a dropped vertex from the simplified route (Douglas-Peucker tolerance)
+ROUTE_SIMPLIFY_TOLERANCE_KM = 0.1
+
+# Decoded routes kept in memory per worker (keyed by the encoded polyline)
+ROUTE_DECODE_CACHE_SIZE = 2048
+
+# Encoded polyline precision (5 decimals = ~1 m, same as OSRM/Google polylines)
+POLYLINE_PRECISION = 5
+
+## Encode [(lat, lon), ...] as a Google/OSRM polyline string
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lon = 0
+    for lat, lon in points:
+        lat, lon = int(round(lat * factor)), int(round(lon * factor))
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+    return "".join(chunks)
+
+## Decode a polyline string to [(lat, lon), ...]
+def decode_polyline(polyline, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(polyline):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(polyline[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+## Project (lat, lon) arrays to KM on a plane centred at (lat0, lon0) (equirectangular, fine at route scale)
+def project_km(lats, lons, lat0, lon0):
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    x = np.radians(lons - lon0) * np.cos(np.radians(lat0)) * EARTH_RADIUS_KM
+    y = np.radians(lats - lat0) * EARTH_RADIUS_KM
+    return x, y
+
+## Drop vertices closer than tolerance_km to the simplified line (Douglas-Peucker)
+def simplify_route(points, tolerance_km=ROUTE_SIMPLIFY_TOLERANCE_KM):
+    if len(points) < 3:
+        return list(points)
+
+    lats, lons = zip(*points)
+    x, y = project_km(lats, lons, float(np.mean(lats)), float(np.mean(lons)))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # iterative, long routes have thousands of vertices
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length = np.hypot(dx, dy)
+        inner_x, inner_y = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        if length == 0:
+            offsets = np.hypot(inner_x, inner_y)
+        else:
+            offsets = np.abs(dx * inner_y - dy * inner_x) / length
+        farthest = int(np.argmax(offsets))
+        if offsets[farthest] > tolerance_km:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.extend([(first, middle), (middle, last)])
+    return [point for point, kept in zip(points, keep) if kept]
+
+## Route fields of a carpool for a route geometry: simplified encoded polyline and bounding box
+def route_geometry_fields(points):
+    """
+    points: [(lat, lon), ...] along the road route (e.g. from OSRM).
+    Returns a dict of CreateCarpool field values.
+    """
+    simplified = simplify_route(points)
+    lats, lons = zip(*simplified)
+    return {"route_polyline": encode_polyline(simplified),
+            "route_min_lat": round(min(lats), 6), "route_max_lat": round(max(lats), 6),
+            "route_min_lon": round(min(lons), 6), "route_max_lon": round(max(lons), 6)}
+
+## Decoded route as (lats, lons) arrays, cached per polyline
+@lru_cache(maxsize=ROUTE_DECODE_CACHE_SIZE)
+def route_arrays(polyline):
+    lats, lons = zip(*decode_polyline(polyline))
+    return np.array(lats), np.array(lons)
+
+## Shortest distance (KM) from a point to a route polyline
+def distance_to_route_km(lat, lon, polyline):
+    lats, lons = route_arrays(polyline)
+    x, y = project_km(lats, lons, lat, lon)
+    if len(x) == 1:
+        return float(np.hypot(x[0], y[0]))
+
+    # the point is the origin: closest point of every segment at once
+    start_x, start_y, dx, dy = x[:-1], y[:-1], np.diff(x), np.diff(y)
+    lengths = dx * dx + dy * dy
+    t = np.clip(-(start_x * dx + start_y * dy) / np.where(lengths == 0, 1, lengths), 0, 1)
+    return float(np.min(np.hypot(start_x + t * dx, start_y + t * dy)))
+
+## Is (lat, lon) within corridor_km of the carpool's stored route? None if no route is stored
+def on_route_corridor(carpool, lat, lon, corridor_km=ROUTE_CORRIDOR_KM):
+    """
+    The stored bounding box (widened by the corridor) rejects far away points before the polyline is looked at.
+    """
+    if not carpool.route_polyline:
+        return None
+
+    lat, lon = float(lat), float(lon)
+    margin_lat = corridor_km / EARTH_RADIUS_KM * 180 / np.pi
+    margin_lon = margin_lat / max(np.cos(np.radians(lat)), 0.01)
+    if (lat < float(carpool.route_min_lat) - margin_lat or lat > float(carpool.route_max_lat) + margin_lat or
+            lon < float(carpool.route_min_lon) - margin_lon or lon > float(carpool.route_max_lon) + margin_lon):
+        return False
+    return distance_to_route_km(lat, lon, carpool.route_polyline) <= corridor_km
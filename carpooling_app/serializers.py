@@ -1,6 +1,44 @@
 from rest_framework import serializers
+from django.db.models import QuerySet
 from .models import *
 
+## Relations a serializer reads, loaded with the rows it lists instead of one query per row
+class EagerLoadingMixin:
+    """
+    select_related_fields / prefetch_related_fields: relations the serializer reads.
+    nested_serializers: {relation: serializer class} for nested serializers, their relations are loaded through relation.
+    A queryset listed with many=True gets them automatically; use setup_eager_loading() on querysets
+    that are evaluated before serializing (e.g. ranked or filtered in Python).
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    nested_serializers = {}
+
+    @classmethod
+    def eager_loading_fields(cls, prefix=""):
+        """
+        Returns (select_related paths, prefetch_related paths).
+        """
+        select = [prefix + field for field in cls.select_related_fields]
+        prefetch = [prefix + field for field in cls.prefetch_related_fields]
+        for relation, serializer in cls.nested_serializers.items():
+            nested_select, nested_prefetch = serializer.eager_loading_fields(f"{prefix}{relation}__")
+            select += [prefix + relation] + nested_select
+            prefetch += nested_prefetch
+        return select, prefetch
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        select, prefetch = cls.eager_loading_fields()
+        return queryset.select_related(*select).prefetch_related(*prefetch)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        # only querysets not read yet (re-reading an evaluated one would cost a query more)
+        if args and isinstance(args[0], QuerySet) and args[0]._result_cache is None:
+            args = (cls.setup_eager_loading(args[0]),) + args[1:]
+        return super().many_init(*args, **kwargs)
+
 ## User serializer
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,59 +59,89 @@ class UserDashboardInfoSerializer(serializers.ModelSerializer):
         fields = ['user','total_carpools', 'total_bookings', 'total_earning']
 
 ## Carpool Serializer
-class CreateCarpoolSerializer(serializers.ModelSerializer):
+class CreateCarpoolSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     driver = serializers.CharField(source="carpool_creator_driver.first_name", read_only=True)
     driver_average_rating = serializers.SerializerMethodField()
+    carpool_ride_status = serializers.SerializerMethodField()
     updated_by = serializers.CharField(source='updated_by.username', read_only=True)
+    select_related_fields = ("carpool_creator_driver__rating_stats", "updated_by")
 
     class Meta:
         model = CreateCarpool
         fields = ['createcarpool_id', 'driver', 'driver_average_rating','carpool_ride_status','start_location', 'end_location','departure_time', 'arrival_time','available_seats', 'total_passenger_allowed','contribution_per_km', 
-                  'distance_km','add_note', 'allow_luggage','gender_preference','contact_info','car_model', 'car_number', 'is_ev_vehicle','created_at','updated_at', 'updated_by']
+                  'distance_km','add_note', 'allow_luggage','gender_preference','contact_info','car_model', 'car_number', 'is_ev_vehicle','created_at','updated_at', 'updated_by',
+                  'enrichment_status']
 
     def get_driver_average_rating(self, obj):
-        from django.db.models import Avg
-        avg = ReviewRating.objects.filter(review_for=obj.carpool_creator_driver).aggregate(Avg("rating"))["rating__avg"] or 0
-        return round(float(avg), 2)
+        # from the driver's rating stats row (loaded with the carpool, see select_related_fields)
+        from .rating_stats import average_rating_of
+        return average_rating_of(obj.carpool_creator_driver)
+
+    def get_carpool_ride_status(self, obj):
+        # read-time status from CreateCarpool.objects.with_effective_status(), if annotated
+        return getattr(obj, "effective_ride_status", obj.carpool_ride_status)
 
 ## Carpool Detail Serializer
-class CarpoolDetailSerializer(serializers.ModelSerializer):
+class CarpoolDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     carpool_driver_name = serializers.SerializerMethodField()
+    carpool_ride_status = serializers.SerializerMethodField()
     updated_by = serializers.CharField(source='updated_by.username', read_only=True)
+    select_related_fields = ("carpool_creator_driver", "updated_by")
 
     class Meta:
         model = CreateCarpool
         fields = ['createcarpool_id', 'carpool_driver_name','carpool_ride_status','start_location', 'end_location','departure_time', 'arrival_time','available_seats', 'total_passenger_allowed',
-                  'contribution_per_km', 'distance_km','add_note', 'contact_info', 'allow_luggage','car_model', 'car_number','is_ev_vehicle','updated_by']
+                  'contribution_per_km', 'distance_km','add_note', 'contact_info', 'allow_luggage','car_model', 'car_number','is_ev_vehicle','updated_by','enrichment_status']
 
     def get_carpool_driver_name(self, obj):
         return obj.carpool_creator_driver.first_name if obj.carpool_creator_driver else None
 
+    def get_carpool_ride_status(self, obj):
+        return getattr(obj, "effective_ride_status", obj.carpool_ride_status)
+
+## Use the read-time ride status of Booking.objects.with_effective_status(), if annotated
+def apply_effective_booking_status(instance, data, carpool_key):
+    if hasattr(instance, "effective_ride_status"):
+        data["ride_status"] = instance.effective_ride_status
+    if hasattr(instance, "effective_carpool_ride_status") and data.get(carpool_key):
+        data[carpool_key]["carpool_ride_status"] = instance.effective_carpool_ride_status
+    return data
+
 ## Booking Serializers
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     passenger = UserSerializer(source="passenger_name", read_only=True)
     carpool = CreateCarpoolSerializer(source="carpool_driver_name", read_only=True)
     booked_by = serializers.CharField(source="booked_by.first_name", read_only=True)
     updated_by = serializers.CharField(source='updated_by.username', read_only=True)
+    select_related_fields = ("passenger_name", "booked_by", "updated_by")
+    nested_serializers = {"carpool_driver_name": CreateCarpoolSerializer}
     class Meta:
         model = Booking
         fields = ['booking_id', 'carpool', 'passenger','seat_book', 'distance_travelled','contribution_amount', 'payment_mode','booking_status', 'ride_status','booked_by',
-                   'booked_at','pickup_location', 'drop_location', 'contact_info','updated_at', 'updated_by']
+                   'booked_at','pickup_location', 'drop_location', 'contact_info','updated_at', 'updated_by','enrichment_status']
+
+    def to_representation(self, instance):
+        return apply_effective_booking_status(instance, super().to_representation(instance), "carpool")
 
 ## Booking Detail Serializer
-class BookingDetailSerializer(serializers.ModelSerializer):
+class BookingDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     passenger_name = serializers.SerializerMethodField()
     carpool_detail = CarpoolDetailSerializer(source="carpool_driver_name", read_only=True)
     updated_by = serializers.CharField(source='updated_by.username', read_only=True)
     booked_by = serializers.CharField(source="booked_by.first_name", read_only=True)
+    select_related_fields = ("passenger_name", "booked_by", "updated_by")
+    nested_serializers = {"carpool_driver_name": CarpoolDetailSerializer}
     class Meta:
         model = Booking
         fields = ['booking_id', 'passenger_name', 'seat_book', 'distance_travelled', 'contribution_amount', 'payment_mode', 'booking_status', 'ride_status', 'booked_by', 'booked_at',
-            'pickup_location', 'drop_location', 'contact_info','updated_at', 'updated_by','carpool_detail']
+            'pickup_location', 'drop_location', 'contact_info','updated_at', 'updated_by','enrichment_status','carpool_detail']
 
     def get_passenger_name(self, obj):
         return obj.passenger_name.first_name if obj.passenger_name else None
 
+    def to_representation(self, instance):
+        return apply_effective_booking_status(instance, super().to_representation(instance), "carpool_detail")
+
 ## Activity Serializer
 class ActivitySerializer(serializers.ModelSerializer):
     # user = UserSerializer(read_only=True)
@@ -88,12 +156,13 @@ class ContactSerializer(serializers.ModelSerializer):
         fields = ['contact_id', 'name', 'email', 'phone_number','your_message', 'created_at', "updated_at", "updated_by"]
 
 ## Review Rating Serializer
-class ReviewRatingSerializer(serializers.ModelSerializer):
+class ReviewRatingSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     review_given_by_name = serializers.CharField(source="review_given_by.username", read_only=True)
     review_given_to_name = serializers.CharField(source="review_for.username", read_only=True)
     carpool_id = serializers.IntegerField(source="carpool.createcarpool_id", read_only=True)
     booking_id = serializers.IntegerField(source="booking.booking_id", read_only=True)
     # updated_by = serializers.CharField(source='updated_by.username', read_only=True)
+    select_related_fields = ("review_given_by", "review_for")
     class Meta:
         model = ReviewRating
         fields = ["review_id", "review_given_by_name", "review_given_to_name","carpool_id","booking_id", "rating", "comment"]
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .distance_kernel import EARTH_RADIUS_KM, HAVERSINE_MAX_ERROR
+from .feed_cache import feed_version
+from .models import CreateCarpool
+
+logger = logging.getLogger(__name__)
+
+# Seconds between incremental refreshes of the in-memory index when no carpool write was signalled
+# (catches writes that bypass the signals, e.g. queryset.update())
+REFRESH_SECONDS = getattr(settings, "CARPOOL_INDEX_REFRESH_SECONDS", 5)
+
+# If the index could not be refreshed for this long, callers fall back to the database
+MAX_STALENESS_SECONDS = getattr(settings, "CARPOOL_INDEX_MAX_STALENESS_SECONDS", 60)
+
+# Re-read rows updated this long before the last refresh, for transactions committed late
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+# Rebuild the trees once this share of the entries changed since the last build
+REBUILD_RATIO = 0.2
+
+# Points per KD-tree leaf, leaves are scanned with one vectorized distance check
+LEAF_SIZE = 16
+
+## Latitude/longitude -> 3D unit vector on the sphere
+def unit_vector(lat, lon):
+    lat, lon = np.radians(float(lat)), np.radians(float(lon))
+    return np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+## Straight-line (chord) distance between unit vectors for a great-circle distance in KM
+def chord_for_km(radius_km):
+    # widened by the haversine/geodesic error so the exact geodesic check never loses a point
+    return 2 * np.sin(min(radius_km * (1 + HAVERSINE_MAX_ERROR) / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+class KDTree:
+    """
+    Static KD-tree over 3D unit vectors with bucketed leaves.
+    """
+    def __init__(self, ids, points):
+        self.ids = np.asarray(ids)
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+        self.root = self._build(np.arange(len(self.ids))) if len(self.ids) else None
+
+    def _build(self, indexes):
+        if len(indexes) <= LEAF_SIZE:
+            return (None, None, indexes, None)
+        points = self.points[indexes]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        ordered = indexes[np.argsort(points[:, axis], kind="stable")]
+        middle = len(ordered) // 2
+        split = self.points[ordered[middle], axis]
+        return (axis, split, self._build(ordered[:middle]), self._build(ordered[middle:]))
+
+    def query_ball(self, point, chord):
+        """
+        Returns ids of all points within chord of point.
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            axis, split, left, right = stack.pop()
+            if axis is None:
+                indexes = left
+                close = np.linalg.norm(self.points[indexes] - point, axis=1) <= chord
+                found.extend(self.ids[indexes[close]].tolist())
+                continue
+            if point[axis] - chord <= split:
+                stack.append(left)
+            if point[axis] + chord >= split:
+                stack.append(right)
+        return found
+
+class CarpoolSpatialIndex:
+    """
+    Per-worker in-memory index of bookable carpools (start and end points).
+    Trees are built from a full snapshot; afterwards rows changed since the last refresh
+    (by CreateCarpool.updated_at) are kept in a small "dirty" set that is scanned directly,
+    until enough rows changed to rebuild the trees.
+    Every carpool write moves the feed version (CreateCarpool post_save / post_delete, see feed_cache.py),
+    and a lookup after it refreshes first, so new and changed carpools are found right away.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.entries = {}      # carpool id -> (start vector, end vector, departure_time)
+        self.trees = None      # {"start": KDTree, "end": KDTree}
+        self.dirty = set()     # ids changed since the trees were built
+        self.last_seen = None  # updated_at watermark of the last refresh
+        self.last_refresh = None
+        self.seen_version = None  # feed version the last refresh started from
+
+    def _entry(self, row):
+        createcarpool_id, lat_start, lon_start, lat_end, lon_end, departure_time, available_seats = row
+        if available_seats <= 0 or departure_time < timezone.now() or None in (lat_start, lon_start):
+            return None
+        end_vector = unit_vector(lat_end, lon_end) if None not in (lat_end, lon_end) else None
+        return unit_vector(lat_start, lon_start), end_vector, departure_time
+
+    def _rows(self, queryset):
+        return queryset.values_list("createcarpool_id", "latitude_start", "longitude_start", "latitude_end", "longitude_end", "departure_time", "available_seats")
+
+    def rebuild(self):
+        """
+        Load every bookable carpool and build the trees.
+        """
+        snapshot_time = timezone.now()
+        entries = {}
+        for row in self._rows(CreateCarpool.objects.filter(departure_time__gte=snapshot_time, available_seats__gt=0)):
+            entry = self._entry(row)
+            if entry:
+                entries[row[0]] = entry
+
+        self.entries = entries
+        self.trees = {point: self._build_tree(point) for point in ("start", "end")}
+        self.dirty = set()
+        self.last_seen = snapshot_time - REFRESH_OVERLAP
+        self.last_refresh = time.monotonic()
+
+    def _build_tree(self, point):
+        vector_index = 0 if point == "start" else 1
+        items = [(carpool_id, entry[vector_index]) for carpool_id, entry in self.entries.items() if entry[vector_index] is not None]
+        return KDTree([carpool_id for carpool_id, _ in items], [vector for _, vector in items])
+
+    def refresh(self):
+        """
+        Apply rows updated since the last refresh; rebuild the trees if too many changed.
+        """
+        if self.trees is None:
+            return self.rebuild()
+
+        refresh_time = timezone.now()
+        for row in self._rows(CreateCarpool.objects.filter(updated_at__gte=self.last_seen)):
+            entry = self._entry(row)
+            if entry:
+                self.entries[row[0]] = entry
+            else:
+                self.entries.pop(row[0], None)
+            self.dirty.add(row[0])
+
+        self.last_seen = refresh_time - REFRESH_OVERLAP
+        self.last_refresh = time.monotonic()
+        if len(self.dirty) > max(LEAF_SIZE, REBUILD_RATIO * len(self.entries)):
+            self.rebuild()
+
+    def discard(self, carpool_id):
+        """
+        Drop a deleted carpool (refresh() only sees rows that still exist).
+        """
+        with self.lock:
+            if self.entries.pop(carpool_id, None) is not None:
+                self.dirty.add(carpool_id)
+
+    def ensure_fresh(self):
+        """
+        Refresh if a carpool was written since the last refresh, or REFRESH_SECONDS passed.
+        Returns False when the index is too stale to answer from.
+        """
+        version = feed_version()
+        with self.lock:
+            if self.last_refresh is None or version != self.seen_version or time.monotonic() - self.last_refresh >= REFRESH_SECONDS:
+                try:
+                    self.refresh()
+                    self.seen_version = version
+                except Exception as e:
+                    logger.warning("Carpool index refresh failed: %s", e)
+            return self.last_refresh is not None and time.monotonic() - self.last_refresh <= MAX_STALENESS_SECONDS
+
+    def nearby_ids(self, lat, lon, radius_km, point="start"):
+        """
+        Ids of bookable carpools whose start (or end) point may lie within radius_km of (lat, lon).
+        Candidates still need the exact distance check. Returns None if the index is stale,
+        callers then use the database path.
+        """
+        if not self.ensure_fresh():
+            return None
+
+        vector_index = 0 if point == "start" else 1
+        center = unit_vector(lat, lon)
+        chord = chord_for_km(radius_km)
+        now = timezone.now()
+
+        with self.lock:
+            candidate_ids = [carpool_id for carpool_id in self.trees[point].query_ball(center, chord) if carpool_id not in self.dirty]
+            for carpool_id in self.dirty:
+                entry = self.entries.get(carpool_id)
+                if entry and entry[vector_index] is not None and np.linalg.norm(entry[vector_index] - center) <= chord:
+                    candidate_ids.append(carpool_id)
+
+            return [carpool_id for carpool_id in candidate_ids if carpool_id in self.entries and self.entries[carpool_id][2] >= now]
+
+# One index per worker process
+carpool_index = CarpoolSpatialIndex()
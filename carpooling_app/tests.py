@@ -1,6 +1,73 @@
 from django.test import TestCase
 from django.conf import settings
-from .utils import get_road_distance_osrm
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from django.utils import timezone
+from datetime import timedelta
+from .models import User, CreateCarpool, Booking, GeocodeCacheEntry, RouteDistanceCacheEntry
+from .utils import (auto_calculate_distance, calculate_passenger_trip_details, calculate_realistic_distance, day_range, get_road_distance_osrm, is_point_on_route_dynamic, is_text_based_intermediate,
+                    location_match_q, matches_route, prime_road_distances, road_distance_matrix, road_distances)
+from .distance_kernel import carpool_distance_checks, distances_km, haversine_km, points_on_route
+from geopy.distance import geodesic
+from .ride_lifecycle import sweep_ride_statuses
+from .geo_index import bounding_box_q, covering_cells, grid_cell, prefilter_candidates
+from .spatial_index import KDTree, carpool_index, chord_for_km, unit_vector
+from .geocode_cache import GeocodeCache, normalize_place_key, purge_expired_geocodes
+from .geocoders import ChainGeocoder, GazetteerGeocoder, Geocoder
+from .route_cache import purge_route_cache, route_cache, route_key
+from .osrm_stub import STUB_ROAD_FACTOR, OSRMStubServer
+from .http_client import CircuitBreaker, ExternalCallSkipped, ExternalClient, external_call_budget, external_client
+from .enrichment import ENRICHMENT_MAX_ATTEMPTS, backfill_carpools, run_enrichment
+from .location_tokens import location_tokens, matching_carpool_ids
+from .models import DriverRatingStats, LocationToken, PlaceEdge, ReviewRating
+from .rating_stats import rebuild_rating_stats
+from .serializers import BookingDetailSerializer, BookingSerializer, CreateCarpoolSerializer
+from .query_budget import QueryBudgetExceeded, QueryRecorder, endpoint_query_stats, enforce_query_budgets, query_shape
+from .carpool_view import carpool_detail
+from .place_graph import is_known_stop, place_neighbors, rebuild_place_graph
+from .feed_cache import cached_feed, feed_cache_stats, invalidate_carpool_feed
+from .pagination import DEFAULT_RESULT_LIMIT, MAX_RESULT_LIMIT, decode_cursor, encode_cursor, parse_limit, ranked_page
+from .route_geometry import decode_polyline, encode_polyline, on_route_corridor, route_geometry_fields, simplify_route
+from unittest import mock
+import numpy as np
+import time
+
+VADODARA = (22.307159, 73.181219)
+
+class CarpoolTestCase(TestCase):
+    """
+    Shared fixtures for tests on carpools: a driver, a passenger, an API client and carpool / booking factories.
+    Every test starts with an empty carpool index, the rows an earlier test indexed were rolled back.
+    """
+    client_class = APIClient
+
+    def setUp(self):
+        carpool_index.reset()
+        self.driver = self.create_user("driver1", role="driver")
+        self.passenger = self.create_user("passenger1")
+
+    def create_user(self, username, **fields):
+        return User.objects.create(username=username, first_name=username.rstrip("0123456789").title(), email=f"{username}@test.com", password="x",
+                                   phone_number=f"9{User.objects.count() + 1:09d}", **fields)
+
+    def create_carpool(self, start=None, end=None, **fields):
+        """
+        start / end: optional (lat, lon). fields override the defaults: Surat -> Vadodara by self.driver, leaving in 3 hours, arriving 3 hours later, 3 seats.
+        """
+        departure_time = fields.pop("departure_time", timezone.now() + timedelta(hours=3))
+        defaults = {"carpool_creator_driver": self.driver, "start_location": "Surat", "end_location": "Vadodara", "departure_time": departure_time,
+                    "arrival_time": departure_time + timedelta(hours=3), "available_seats": 3, "total_passenger_allowed": 3}
+        if start:
+            defaults["latitude_start"], defaults["longitude_start"] = start
+        if end:
+            defaults["latitude_end"], defaults["longitude_end"] = end
+        defaults.update(fields)
+        return CreateCarpool.objects.create(**defaults)
+
+    def create_booking(self, carpool, **fields):
+        defaults = {"carpool_driver_name": carpool, "passenger_name": self.passenger, "booked_by": self.passenger}
+        defaults.update(fields)
+        return Booking.objects.create(**defaults)
 
 class OSRMUtilsTestCase(TestCase):
     def test_get_road_distance_osrm_valid_coordinates(self):
@@ -43,3 +110,1044 @@ class OSRMUtilsTestCase(TestCase):
 
         self.assertIsNotNone(distance)
         self.assertGreater(distance, 0)
+
+class RideLifecycleTestCase(CarpoolTestCase):
+    def test_sweep_moves_departed_carpool_to_active(self):
+        """
+        A carpool between departure and arrival becomes active along with its bookings.
+        """
+        now = timezone.now()
+        carpool = self.create_carpool(departure_time=now - timedelta(minutes=10), arrival_time=now + timedelta(hours=2))
+        booking = self.create_booking(carpool, booking_status="confirmed")
+
+        result = sweep_ride_statuses(now)
+        carpool.refresh_from_db()
+        booking.refresh_from_db()
+
+        self.assertEqual(carpool.carpool_ride_status, "active")
+        self.assertEqual(booking.ride_status, "active")
+        self.assertEqual(result["carpools"]["active"], 1)
+        self.assertEqual(result["bookings"]["active"], 1)
+
+    def test_sweep_completes_carpool_and_cancels_unconfirmed_bookings(self):
+        """
+        After arrival, confirmed bookings complete and pending ones did not travel.
+        """
+        now = timezone.now()
+        carpool = self.create_carpool(departure_time=now - timedelta(hours=3), arrival_time=now - timedelta(minutes=30), carpool_ride_status="active")
+        confirmed = self.create_booking(carpool, booking_status="confirmed")
+        pending = self.create_booking(carpool, booking_status="pending")
+
+        sweep_ride_statuses(now)
+        carpool.refresh_from_db()
+        confirmed.refresh_from_db()
+        pending.refresh_from_db()
+
+        self.assertEqual(carpool.carpool_ride_status, "completed")
+        self.assertEqual(confirmed.ride_status, "completed")
+        self.assertEqual((pending.booking_status, pending.ride_status), ("cancelled", "did_not_travelled"))
+
+    def test_sweep_skips_unchanged_rows(self):
+        """
+        A second sweep at the same time has nothing left to write.
+        """
+        now = timezone.now()
+        carpool = self.create_carpool(departure_time=now + timedelta(hours=1), arrival_time=now + timedelta(hours=3))
+        self.create_booking(carpool, booking_status="pending")
+
+        sweep_ride_statuses(now)
+        result = sweep_ride_statuses(now)
+        self.assertEqual(sum(result["carpools"].values()), 0)
+        self.assertEqual(sum(result["bookings"].values()), 0)
+
+    def test_sweep_query_count_does_not_grow_with_bookings(self):
+        """
+        Bookings are moved with set-based updates, not one save() per row.
+        """
+        now = timezone.now()
+        for i in range(3):
+            carpool = self.create_carpool(departure_time=now - timedelta(hours=3), arrival_time=now - timedelta(minutes=30), carpool_ride_status="active")
+            for j in range(5):
+                self.create_booking(carpool, booking_status="confirmed")
+
+        with self.assertNumQueries(13):
+            result = sweep_ride_statuses(now)
+        self.assertEqual(result["carpools"]["completed"], 3)
+        self.assertEqual(result["bookings"]["confirmed_to_completed"], 15)
+
+    def test_save_keeps_next_transition_at_current(self):
+        """
+        next_transition_at follows departure for upcoming rides, arrival for active ones, and is cleared when finished.
+        """
+        now = timezone.now()
+        carpool = self.create_carpool(departure_time=now + timedelta(hours=1), arrival_time=now + timedelta(hours=3))
+        self.assertEqual(carpool.next_transition_at, carpool.departure_time)
+
+        carpool.carpool_ride_status = "active"
+        carpool.save(update_fields=["carpool_ride_status"])
+        carpool.refresh_from_db()
+        self.assertEqual(carpool.next_transition_at, carpool.arrival_time)
+
+        carpool.carpool_ride_status = "completed"
+        carpool.save()
+        carpool.refresh_from_db()
+        self.assertIsNone(carpool.next_transition_at)
+
+    def test_sweep_only_touches_due_carpools(self):
+        """
+        A carpool whose next transition is in the future is not looked at.
+        """
+        now = timezone.now()
+        due = self.create_carpool(departure_time=now - timedelta(minutes=5), arrival_time=now + timedelta(hours=2))
+        not_due = self.create_carpool(departure_time=now + timedelta(hours=1), arrival_time=now + timedelta(hours=3))
+
+        sweep_ride_statuses(now)
+        due.refresh_from_db()
+        not_due.refresh_from_db()
+
+        self.assertEqual(due.carpool_ride_status, "active")
+        self.assertEqual(due.next_transition_at, due.arrival_time)
+        self.assertEqual(not_due.carpool_ride_status, "upcoming")
+
+    def test_effective_status_is_computed_without_writing(self):
+        """
+        with_effective_status() shows the current ride status while the stored status is still stale.
+        """
+        now = timezone.now()
+        carpool = self.create_carpool(departure_time=now - timedelta(hours=3), arrival_time=now - timedelta(minutes=30), carpool_ride_status="active")
+        confirmed = self.create_booking(carpool, booking_status="confirmed")
+        pending = self.create_booking(carpool, booking_status="pending")
+
+        annotated_carpool = CreateCarpool.objects.with_effective_status(now).get(pk=carpool.pk)
+        bookings = {b.pk: b for b in Booking.objects.with_effective_status(now).filter(carpool_driver_name=carpool)}
+
+        self.assertEqual(annotated_carpool.effective_ride_status, "completed")
+        self.assertEqual(annotated_carpool.carpool_ride_status, "active")
+        self.assertEqual(bookings[confirmed.pk].effective_carpool_ride_status, "completed")
+        self.assertEqual(bookings[confirmed.pk].effective_ride_status, "completed")
+        self.assertEqual(bookings[pending.pk].effective_ride_status, "did_not_travelled")
+
+class GeoIndexTestCase(CarpoolTestCase):
+    def test_save_fills_grid_cells(self):
+        carpool = self.create_carpool((21.170240, 72.831061), VADODARA)
+        self.assertEqual(carpool.start_grid_cell, grid_cell(21.170240, 72.831061))
+        self.assertEqual(carpool.end_grid_cell, grid_cell(22.307159, 73.181219))
+
+    def test_covering_cells_include_points_within_radius(self):
+        """
+        A point ~8 KM away in another cell must be inside the cells covering a 10 KM radius.
+        """
+        cells = covering_cells(21.196783, 72.817701, 10)
+        self.assertIn(grid_cell(21.196783, 72.817701), cells)
+        self.assertIn(grid_cell(21.153603, 72.783202), cells)
+        self.assertNotIn(grid_cell(22.307159, 73.181219), cells)
+
+    def test_find_nearby_carpools_uses_grid_cells(self):
+        near = self.create_carpool((21.170240, 72.831061), VADODARA)
+        self.create_carpool((23.022505, 72.571362), VADODARA)
+
+        response = self.client.post("/api/carpool/find-nearby-carpools/", {"location_latitude": 21.196783, "location_longitude": 72.817701}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["createcarpool_id"] for c in response.data["data"]], [near.createcarpool_id])
+
+    def test_bounding_box_prefilter_prunes_far_carpools(self):
+        near = self.create_carpool((21.170240, 72.831061), VADODARA)
+        self.create_carpool((23.022505, 72.571362), VADODARA)
+
+        with self.assertNumQueries(1):
+            candidates, stats = prefilter_candidates(CreateCarpool.objects.all(), bounding_box_q("start", 21.196783, 72.817701, 20))
+
+        self.assertEqual(candidates, [near])
+        self.assertEqual(stats, {"candidates_after": 1})
+
+        with self.settings(DEBUG=True):
+            _, stats = prefilter_candidates(CreateCarpool.objects.all(), bounding_box_q("start", 21.196783, 72.817701, 20))
+        self.assertEqual(stats, {"candidates_before": 2, "candidates_after": 1})
+
+    def test_location_match_q_keeps_text_matches_without_coordinates(self):
+        """
+        Text matches must survive the prefilter even when they are outside the radius.
+        """
+        text_match = self.create_carpool(end=VADODARA)
+        self.create_carpool((23.022505, 72.571362), VADODARA, start_location="Ahmedabad")
+
+        rows = CreateCarpool.objects.filter(location_match_q("Surat", "start", 21.196783, 72.817701))
+
+        self.assertEqual(list(rows), [text_match])
+
+class DistanceKernelTestCase(TestCase):
+    def test_distances_match_geodesic_within_tolerance(self):
+        lats, lons = [21.153603, 22.307159, 23.022505], [72.783202, 73.181219, 72.571362]
+        distances = distances_km(21.196783, 72.817701, lats, lons)
+
+        for lat, lon, distance in zip(lats, lons, distances):
+            expected = geodesic((21.196783, 72.817701), (lat, lon)).km
+            self.assertAlmostEqual(distance, expected, delta=expected * 0.006)
+
+    def test_refined_distances_agree_with_geodesic_at_threshold(self):
+        """
+        Around refine_near the kernel falls back to geodesic, so radius checks give the same answer.
+        """
+        lat, lon = 21.196783, 72.817701
+        radius = geodesic((lat, lon), (21.153603, 72.783202)).km
+        distances = distances_km(lat, lon, [21.153603], [72.783202], refine_near=radius)
+        self.assertAlmostEqual(distances[0], radius, places=9)
+
+    def test_points_on_route_matches_single_route_check(self):
+        lats_a, lons_a = [21.170240, 21.170240, None], [72.831061, 72.831061, 72.0]
+        lats_b, lons_b = [23.022505, 19.075984, 23.0], [72.571362, 72.877656, 72.5]
+        # Vadodara lies between Surat and Ahmedabad, not between Surat and Mumbai
+        result = points_on_route(lats_a, lons_a, lats_b, lons_b, 22.307159, 73.181219)
+        self.assertEqual(list(result), [True, False, False])
+        self.assertTrue(is_point_on_route_dynamic(21.170240, 72.831061, 23.022505, 72.571362, 22.307159, 73.181219))
+
+class SpatialIndexTestCase(CarpoolTestCase):
+    def test_kd_tree_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        lats, lons = rng.uniform(20, 24, 500), rng.uniform(70, 75, 500)
+        points = [unit_vector(lat, lon) for lat, lon in zip(lats, lons)]
+        tree = KDTree(list(range(500)), points)
+
+        center = unit_vector(21.196783, 72.817701)
+        chord = chord_for_km(50)
+        expected = [i for i, point in enumerate(points) if np.linalg.norm(point - center) <= chord]
+
+        self.assertEqual(sorted(tree.query_ball(center, chord)), expected)
+        self.assertTrue(expected)
+
+    def test_incremental_refresh_adds_and_removes_carpools(self):
+        near = self.create_carpool((21.170240, 72.831061), VADODARA)
+        self.assertEqual(carpool_index.nearby_ids(21.196783, 72.817701, 10), [near.createcarpool_id])
+
+        added = self.create_carpool((21.180000, 72.820000), VADODARA)
+        near.available_seats = 0
+        near.save()
+        carpool_index.refresh()
+
+        self.assertEqual(carpool_index.nearby_ids(21.196783, 72.817701, 10), [added.createcarpool_id])
+        self.assertEqual(carpool_index.nearby_ids(22.307159, 73.181219, 10, point="end"), [added.createcarpool_id])
+
+    def test_carpools_are_found_right_after_they_are_written(self):
+        near = self.create_carpool((21.170240, 72.831061), VADODARA)
+        self.assertEqual(carpool_index.nearby_ids(21.196783, 72.817701, 10), [near.createcarpool_id])
+
+        # within REFRESH_SECONDS of the last refresh, the writes themselves trigger the next one
+        added = self.create_carpool((21.180000, 72.820000), VADODARA)
+        self.assertEqual(sorted(carpool_index.nearby_ids(21.196783, 72.817701, 10)), [near.createcarpool_id, added.createcarpool_id])
+        near.delete()
+        self.assertEqual(carpool_index.nearby_ids(21.196783, 72.817701, 10), [added.createcarpool_id])
+
+    def test_stale_index_falls_back_to_database(self):
+        near = self.create_carpool((21.170240, 72.831061), VADODARA)
+        carpool_index.refresh()
+        carpool_index.last_refresh = time.monotonic() - 3600
+
+        with mock.patch.object(carpool_index, "refresh", side_effect=Exception("database unavailable")):
+            self.assertIsNone(carpool_index.nearby_ids(21.196783, 72.817701, 10))
+            response = self.client.post("/api/carpool/find-nearby-carpools/", {"location_latitude": 21.196783, "location_longitude": 72.817701}, format="json")
+
+        self.assertEqual([c["createcarpool_id"] for c in response.data["data"]], [near.createcarpool_id])
+
+class GeocodeCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = GeocodeCache(max_size=2)
+        self.calls = []
+
+    def geocode(self, place_name):
+        self.calls.append(place_name)
+        return {"surat": (21.170240, 72.831061), "vadodara": (22.307159, 73.181219)}.get(place_name.strip().lower(), (None, None))
+
+    def test_normalize_place_key(self):
+        self.assertEqual(normalize_place_key("  Surat,  Gujarat. "), "surat gujarat")
+
+    def test_cache_hits_memory_then_database(self):
+        self.assertEqual(self.cache.get_or_geocode("Surat", self.geocode), (21.170240, 72.831061))
+        self.assertEqual(self.cache.get_or_geocode(" surat ", self.geocode), (21.170240, 72.831061))
+
+        # a fresh worker (empty LRU) reads the shared table instead of geocoding again
+        self.cache.clear_memory()
+        self.assertEqual(self.cache.get_or_geocode("SURAT", self.geocode), (21.170240, 72.831061))
+
+        self.assertEqual(self.calls, ["Surat"])
+        self.assertEqual(self.cache.stats, {"memory_hits": 1, "db_hits": 1, "negative_hits": 0, "misses": 1, "evictions": 0})
+
+    def test_unknown_places_are_cached(self):
+        self.assertEqual(self.cache.get_or_geocode("Nowhere", self.geocode), (None, None))
+        self.assertEqual(self.cache.get_or_geocode("nowhere", self.geocode), (None, None))
+
+        self.assertEqual(self.calls, ["Nowhere"])
+        self.assertEqual(self.cache.stats["negative_hits"], 1)
+        self.assertIsNone(GeocodeCacheEntry.objects.get(place_key="nowhere").latitude)
+
+    def test_expired_entries_are_geocoded_again_and_purged(self):
+        self.cache.get_or_geocode("Surat", self.geocode)
+        GeocodeCacheEntry.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.cache.clear_memory()
+        self.assertEqual(purge_expired_geocodes(), 1)
+
+        self.cache.get_or_geocode("Surat", self.geocode)
+        self.assertEqual(self.calls, ["Surat", "Surat"])
+
+    def test_memory_is_bounded(self):
+        for place in ["Surat", "Vadodara", "Nowhere"]:
+            self.cache.get_or_geocode(place, self.geocode)
+
+        self.assertEqual(self.cache.memory.keys(), ["vadodara", "nowhere"])
+        self.assertEqual(self.cache.stats["evictions"], 1)
+
+class GazetteerGeocoderTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gazetteer = GazetteerGeocoder()
+
+    def test_exact_names_aliases_and_state(self):
+        self.assertEqual(self.gazetteer.geocode("Surat"), (21.1702, 72.8311))
+        self.assertEqual(self.gazetteer.geocode("baroda"), self.gazetteer.geocode("Vadodara"))
+        self.assertEqual(self.gazetteer.geocode("Surat, Gujarat, India"), (21.1702, 72.8311))
+
+    def test_partial_names_are_not_completed(self):
+        # "Sola" (Ahmedabad) must not become Solapur
+        for place_name in ("Ahmedab", "navs", "Sola"):
+            self.assertEqual(self.gazetteer.geocode(place_name), (None, None))
+
+    def test_unknown_place(self):
+        self.assertEqual(self.gazetteer.geocode("Surat Castle Road"), (None, None))
+
+    def test_chain_falls_back_only_for_unknown_places(self):
+        fallback = Geocoder()
+        fallback.geocode = mock.Mock(return_value=(21.196783, 72.817701))
+        chain = ChainGeocoder([self.gazetteer, fallback])
+
+        self.assertEqual(chain.geocode("Surat"), (21.1702, 72.8311))
+        fallback.geocode.assert_not_called()
+        self.assertEqual(chain.geocode("Surat Castle Road"), (21.196783, 72.817701))
+        self.assertEqual(chain.geocode("Sola"), (21.196783, 72.817701))
+
+class RouteDistanceCacheTestCase(TestCase):
+    def setUp(self):
+        route_cache.clear_memory()
+        self.addCleanup(route_cache.clear_memory)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"routes": [{"distance": 6543.0}]}
+        patcher = mock.patch.object(external_client.session, "get", return_value=response)
+        self.osrm_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_route_key_snaps_coordinates(self):
+        self.assertEqual(route_key(21.1967834, 72.8177013, 21.1536031, 72.7832024), "driving:21.197,72.818;21.154,72.783")
+
+    def test_repeated_and_nearby_routes_hit_the_cache(self):
+        self.assertEqual(get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202), 6.54)
+        self.assertEqual(get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202), 6.54)
+        # ~20 m away, same snapped key
+        self.assertEqual(get_road_distance_osrm(21.196900, 72.817800, 21.153700, 72.783300), 6.54)
+
+        # another worker (empty LRU) reads the shared table
+        route_cache.clear_memory()
+        self.assertEqual(auto_calculate_distance("", "", 21.196783, 72.817701, 21.153603, 72.783202), 6.54)
+
+        self.assertEqual(self.osrm_get.call_count, 1)
+
+    def test_expired_routes_are_fetched_again(self):
+        get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202)
+        RouteDistanceCacheEntry.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        route_cache.clear_memory()
+
+        get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202)
+        self.assertEqual(self.osrm_get.call_count, 2)
+
+    def test_purge_keeps_table_within_max_rows(self):
+        for i in range(3):
+            get_road_distance_osrm(21.196783, 72.817701, 21.1 + i, 72.783202)
+        RouteDistanceCacheEntry.objects.filter(route_key=route_key(21.196783, 72.817701, 21.1, 72.783202)).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(purge_route_cache(max_rows=1), 2)
+        self.assertEqual(list(RouteDistanceCacheEntry.objects.values_list("route_key", flat=True)), [route_key(21.196783, 72.817701, 23.1, 72.783202)])
+
+class OSRMMatrixTestCase(CarpoolTestCase):
+    SURAT, VNSGU, AIRPORT, VADODARA = (21.196783, 72.817701), (21.153603, 72.783202), (21.114700, 72.741900), (22.307159, 73.181219)
+
+    def setUp(self):
+        super().setUp()
+        route_cache.clear_memory()
+        self.addCleanup(route_cache.clear_memory)
+        self.osrm = OSRMStubServer().__enter__()
+        self.addCleanup(self.osrm.__exit__)
+        patcher = mock.patch("carpooling_app.utils.OSRM_BASE_URL", self.osrm.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def osrm_km(self, origin, destination):
+        return round(round(float(haversine_km(*origin, *destination)) * STUB_ROAD_FACTOR * 1000, 1) / 1000.0, 2)
+
+    def test_one_table_request_fills_the_cache(self):
+        matrix = road_distance_matrix([self.SURAT, self.VNSGU], [self.AIRPORT, self.VADODARA])
+
+        self.assertEqual(matrix, [[self.osrm_km(a, b) for b in (self.AIRPORT, self.VADODARA)] for a in (self.SURAT, self.VNSGU)])
+        self.assertEqual(len(self.osrm.requests), 1)
+        self.assertTrue(self.osrm.requests[0].startswith("/table/v1/driving/"))
+
+        # single pairs are now cache hits
+        self.assertEqual(get_road_distance_osrm(*self.VNSGU, *self.VADODARA), self.osrm_km(self.VNSGU, self.VADODARA))
+        self.assertEqual(len(self.osrm.requests), 1)
+
+    def test_matrix_results_are_stored_in_the_cache_table(self):
+        first = road_distance_matrix([self.SURAT, self.VNSGU], [self.AIRPORT, self.VADODARA])
+        route_cache.clear_memory()  # answered from RouteDistanceCacheEntry rows only
+
+        self.assertEqual(road_distance_matrix([self.SURAT, self.VNSGU], [self.AIRPORT, self.VADODARA]), first)
+        self.assertEqual(len(self.osrm.requests), 1)
+        self.assertEqual(RouteDistanceCacheEntry.objects.count(), 4)
+
+    def test_only_missing_pairs_are_requested(self):
+        get_road_distance_osrm(*self.SURAT, *self.AIRPORT)
+        road_distance_matrix([self.SURAT], [self.AIRPORT, self.VADODARA])
+
+        self.assertEqual(len(self.osrm.requests), 2)
+        self.assertIn("sources=0&destinations=1&", self.osrm.requests[1])
+
+    def test_large_matrices_are_split_into_blocks(self):
+        points = [self.SURAT, self.VNSGU, self.AIRPORT]
+        with mock.patch("carpooling_app.utils.OSRM_TABLE_BLOCK_SIZE", 2):
+            matrix = road_distance_matrix(points, points)
+
+        self.assertEqual(len(self.osrm.requests), 4)
+        self.assertEqual(matrix[2][0], self.osrm_km(self.AIRPORT, self.SURAT))
+
+    def test_trip_details_use_road_distances(self):
+        now = timezone.now()
+        carpool = CreateCarpool(latitude_start=self.SURAT[0], longitude_start=self.SURAT[1], latitude_end=self.VADODARA[0], longitude_end=self.VADODARA[1],
+                                departure_time=now, arrival_time=now + timedelta(hours=3), contribution_per_km=2)
+
+        details = calculate_passenger_trip_details(carpool, *self.VNSGU, *self.AIRPORT)
+
+        self.assertEqual(details["distance_travelled_km"], self.osrm_km(self.VNSGU, self.AIRPORT))
+        # start -> pickup / end share one request, pickup -> drop is the other
+        self.assertEqual(len(self.osrm.requests), 2)
+        self.assertEqual(sorted(RouteDistanceCacheEntry.objects.values_list("route_key", flat=True)),
+                         sorted(route_key(*a, *b) for a, b in ((self.SURAT, self.VNSGU), (self.VNSGU, self.AIRPORT), (self.SURAT, self.VADODARA))))
+
+    def test_only_the_given_pairs_are_fetched(self):
+        pairs = [(self.SURAT, self.AIRPORT), (self.VNSGU, self.AIRPORT), (self.VNSGU, self.VADODARA)]
+
+        self.assertEqual(road_distances(pairs), [self.osrm_km(a, b) for a, b in pairs])
+        self.assertEqual(RouteDistanceCacheEntry.objects.count(), 3)
+        self.assertEqual(road_distances(pairs, fetch=False), [self.osrm_km(a, b) for a, b in pairs])
+        self.assertEqual(len(self.osrm.requests), 2)
+
+    def test_cache_lookups_are_chunked(self):
+        pairs = [(self.SURAT, (21.0 + i / 100, 72.8)) for i in range(5)]
+        road_distances(pairs)
+        route_cache.clear_memory()
+
+        with mock.patch("carpooling_app.route_cache.ROUTE_CACHE_LOOKUP_BATCH_SIZE", 2), self.assertNumQueries(3):
+            self.assertEqual(len(route_cache.get_many(pairs)), 5)
+
+    def test_booking_list_reads_road_distances_without_fetching(self):
+        carpool = self.create_carpool(self.SURAT, self.VADODARA, contribution_per_km=2)
+        self.create_booking(carpool, pickup_latitude=self.VNSGU[0], pickup_longitude=self.VNSGU[1], drop_latitude=self.AIRPORT[0], drop_longitude=self.AIRPORT[1])
+        self.client.force_authenticate(self.passenger, token="tok")
+
+        response = self.client.get("/api/booking/my-bookings/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.osrm.requests, [])
+        self.assertEqual(response.data["data"]["Bookings"]["upcoming_bookings"][0]["distance_travelled_km"],
+                         round(geodesic(self.VNSGU, self.AIRPORT).km, 2))
+
+        # primed by the enrichment worker
+        prime_road_distances([(self.VNSGU, self.AIRPORT)])
+        response = self.client.get("/api/booking/my-bookings/")
+        self.assertEqual(response.data["data"]["Bookings"]["upcoming_bookings"][0]["distance_travelled_km"], self.osrm_km(self.VNSGU, self.AIRPORT))
+
+class ExternalClientTestCase(TestCase):
+    def setUp(self):
+        route_cache.clear_memory()
+        self.addCleanup(route_cache.clear_memory)
+        self.client = ExternalClient(host_concurrency=2)
+        patcher = mock.patch("carpooling_app.utils.external_client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_breaker_opens_after_repeated_failures_and_retries_later(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # only one trial call while half open
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_busy_host_does_not_leave_the_breaker_half_open(self):
+        _, breaker, _ = self.client._host("router.project-osrm.org")
+        breaker.state, breaker.opened_at = "open", time.monotonic() - 31
+        semaphore = self.client.hosts["router.project-osrm.org"][0]
+        semaphore.acquire()
+        semaphore.acquire()
+
+        with self.assertRaises(ExternalCallSkipped):
+            self.client.call("router.project-osrm.org", lambda timeout: mock.Mock(status_code=200), timeout=0.01)
+        self.assertEqual(breaker.state, "open")
+
+        semaphore.release()
+        self.client.call("router.project-osrm.org", lambda timeout: mock.Mock(status_code=200), timeout=0.01)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_open_breaker_falls_back_to_realistic_distance(self):
+        with mock.patch.object(self.client.session, "get", side_effect=ConnectionError("refused")) as osrm_get:
+            for _ in range(5):
+                get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202)
+            distance = get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202)
+
+        self.assertEqual(osrm_get.call_count, 5)
+        self.assertEqual(distance, calculate_realistic_distance(21.196783, 72.817701, 21.153603, 72.783202))
+        stats = self.client.stats()["router.project-osrm.org"]
+        self.assertEqual((stats["calls"], stats["failures"], stats["skipped"], stats["breaker"]), (5, 5, 1, "open"))
+
+    def test_request_budget_limits_external_calls(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"routes": [{"distance": 6543.0}]}
+        with mock.patch.object(self.client.session, "get", return_value=response) as osrm_get:
+            with external_call_budget(5):
+                self.assertEqual(get_road_distance_osrm(21.196783, 72.817701, 21.153603, 72.783202), 6.54)
+                self.assertLessEqual(osrm_get.call_args.kwargs["timeout"], 5)
+            with external_call_budget(0):
+                with self.assertRaises(ExternalCallSkipped):
+                    self.client.get("http://router.project-osrm.org/route/v1/driving/0,0;1,1")
+
+        self.assertEqual(osrm_get.call_count, 1)
+        self.assertEqual(sum(self.client.stats()["router.project-osrm.org"]["latency_histogram"].values()), 1)
+
+class EnrichmentTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        route_cache.clear_memory()
+        self.addCleanup(route_cache.clear_memory)
+        self.osrm = OSRMStubServer().__enter__()
+        self.addCleanup(self.osrm.__exit__)
+        patcher = mock.patch("carpooling_app.utils.OSRM_BASE_URL", self.osrm.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_carpool_via_api(self):
+        departure = timezone.now() + timedelta(hours=3)
+        self.client.force_authenticate(self.driver, token="tok")
+        return self.client.post("/api/carpool/create/", {"start_location": "Surat", "end_location": "Vadodara", "departure_time": departure.strftime("%Y-%m-%d %H:%M:%S"),
+                                                         "arrival_time": (departure + timedelta(hours=3)).strftime("%Y-%m-%d %H:%M:%S"), "available_seats": 3,
+                                                         "total_passenger_allowed": 3, "contribution_per_km": 2, "allow_luggage": True, "gender_preference": "any",
+                                                         "is_ev_vehicle": False}, format="json")
+
+    def test_create_carpool_returns_before_distance_is_known(self):
+        with mock.patch("carpooling_app.utils.get_lat_lng") as geocode:
+            response = self.create_carpool_via_api()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["data"]["Carpool data"]["enrichment_status"], "pending")
+        geocode.assert_not_called()
+        self.assertEqual(self.osrm.requests, [])
+
+        self.assertEqual(run_enrichment()["carpools"], {"done": 1, "retry": 0, "failed": 0})
+        carpool = CreateCarpool.objects.get()
+        self.assertEqual(carpool.enrichment_status, "done")
+        self.assertEqual((float(carpool.latitude_start), float(carpool.longitude_start)), (21.1702, 72.8311))
+        self.assertGreater(carpool.distance_km, 0)
+        self.assertEqual(carpool.start_grid_cell, grid_cell(21.1702, 72.8311))
+        self.assertTrue(carpool.route_polyline)
+        self.assertEqual((float(carpool.route_min_lat), float(carpool.route_max_lat)), (21.1702, 22.3072))
+        self.assertTrue(on_route_corridor(carpool, 21.7051, 72.9959))  # Bharuch
+
+    def test_booking_enrichment_fills_distance_and_contribution(self):
+        self.create_carpool_via_api()
+        run_enrichment()
+        carpool = CreateCarpool.objects.get()
+
+        self.client.force_authenticate(self.passenger, token="tok")
+        response = self.client.post("/api/booking/create/", {"createcarpool_id": carpool.createcarpool_id, "pickup_location": "Surat", "drop_location": "Bharuch",
+                                                             "contact_info": "9000000002"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["data"]["Booking Details"]["enrichment_status"], "pending")
+        self.assertIsNone(response.data["data"]["Booking Details"]["distance_travelled_km"])
+
+        # confirmed while the distance was still pending
+        Booking.objects.update(booking_status="confirmed")
+        self.assertEqual(run_enrichment()["bookings"], {"done": 1, "retry": 0, "failed": 0})
+
+        booking = Booking.objects.get()
+        self.assertEqual(booking.enrichment_status, "done")
+        self.assertGreater(booking.distance_travelled, 0)
+        self.assertEqual(booking.contribution_amount, carpool.contribution_per_km * booking.distance_travelled)
+
+    def book_pending(self):
+        self.create_carpool_via_api()
+        run_enrichment()
+        self.client.force_authenticate(self.passenger, token="tok")
+        self.client.post("/api/booking/create/", {"createcarpool_id": CreateCarpool.objects.get().createcarpool_id, "pickup_location": "Surat",
+                                                  "drop_location": "Bharuch", "contact_info": "9000000002"}, format="json")
+        return Booking.objects.get()
+
+    def test_booking_confirmed_during_enrichment_gets_its_contribution(self):
+        booking = self.book_pending()
+
+        def confirm_meanwhile(origin, destination):
+            Booking.objects.filter(pk=booking.pk).update(booking_status="confirmed")
+            return 100.0
+
+        with mock.patch("carpooling_app.enrichment.road_distance", side_effect=confirm_meanwhile):
+            self.assertEqual(run_enrichment()["bookings"]["done"], 1)
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.booking_status, "confirmed")
+        self.assertEqual(booking.distance_travelled, 100)
+        self.assertEqual(booking.contribution_amount, booking.carpool_driver_name.contribution_per_km * 100)
+
+    def test_booking_edited_during_enrichment_is_not_overwritten(self):
+        booking = self.book_pending()
+
+        def edit_meanwhile(origin, destination):
+            Booking.objects.filter(pk=booking.pk).update(drop_location="Vadodara")
+            return 100.0
+
+        with mock.patch("carpooling_app.enrichment.road_distance", side_effect=edit_meanwhile):
+            self.assertEqual(run_enrichment()["bookings"]["retry"], 1)
+
+        booking.refresh_from_db()
+        self.assertEqual((booking.drop_location, booking.drop_latitude, booking.distance_travelled), ("Vadodara", None, 0))
+        self.assertEqual(booking.enrichment_status, "pending")
+
+        # the next pass enriches the stored drop location
+        self.assertEqual(run_enrichment(current_time=timezone.now() + timedelta(hours=1))["bookings"]["done"], 1)
+        booking.refresh_from_db()
+        self.assertEqual((float(booking.drop_latitude), float(booking.drop_longitude)), (22.3072, 73.1812))
+
+    def test_failed_enrichment_is_retried_with_backoff_then_estimated(self):
+        now = timezone.now()
+        carpool = self.create_carpool(start_location="Unknown Village", enrichment_status="pending", enrichment_retry_at=now)
+
+        with mock.patch("carpooling_app.geocoders.NominatimGeocoder.geocode", return_value=(None, None)):
+            self.assertEqual(run_enrichment(current_time=now)["carpools"]["retry"], 1)
+            carpool.refresh_from_db()
+            self.assertEqual((carpool.enrichment_attempts, carpool.enrichment_retry_at), (1, now + timedelta(minutes=1)))
+
+            # not due yet
+            self.assertEqual(run_enrichment(current_time=now)["carpools"]["retry"], 0)
+
+            for attempt in range(2, ENRICHMENT_MAX_ATTEMPTS + 1):
+                run_enrichment(current_time=now + timedelta(days=attempt))
+
+        carpool.refresh_from_db()
+        self.assertEqual(carpool.enrichment_status, "failed")
+        self.assertEqual(carpool.enrichment_attempts, ENRICHMENT_MAX_ATTEMPTS)
+        self.assertGreater(carpool.distance_km, 0)
+
+class RouteGeometryTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        # Surat -> Ahmedabad as a straight stored route
+        self.carpool = self.create_carpool((21.170240, 72.831061), (23.022505, 72.571362), end_location="Ahmedabad",
+                                           **route_geometry_fields([(21.170240, 72.831061), (23.022505, 72.571362)]))
+
+    def test_polyline_round_trip(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(points), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode_polyline(encode_polyline(points)), points)
+
+    def test_simplify_keeps_corners_only(self):
+        straight = [(21.0 + step / 100, 72.0) for step in range(101)]
+        self.assertEqual(simplify_route(straight), [straight[0], straight[-1]])
+
+        corner = straight + [(22.0, 72.0 + step / 100) for step in range(1, 101)]
+        self.assertEqual(simplify_route(corner), [corner[0], (22.0, 72.0), corner[-1]])
+
+    def test_corridor_match(self):
+        self.assertTrue(on_route_corridor(self.carpool, 22.1, 72.75))  # a few KM off the middle
+        self.assertFalse(on_route_corridor(self.carpool, 22.1, 73.2))  # ~50 KM off, the deviation rule accepts it
+        self.assertTrue(is_point_on_route_dynamic(21.170240, 72.831061, 23.022505, 72.571362, 22.1, 73.2))
+        self.assertFalse(on_route_corridor(self.carpool, 19.0760, 72.8777))  # Mumbai, outside the bounding box
+
+        self.carpool.route_polyline = None
+        self.assertIsNone(on_route_corridor(self.carpool, 22.1, 72.75))
+
+    def test_matches_route_uses_stored_route(self):
+        self.assertFalse(matches_route("Somewhere", self.carpool, 22.1, 73.2))
+        self.assertTrue(matches_route("Somewhere", self.carpool, 22.1, 72.75))
+
+        checks = carpool_distance_checks([self.carpool], None, None, 22.1, 73.2, 20)
+        self.assertFalse(checks["end_on_route"][0])
+
+class LocationTokenTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.carpool = self.create_carpool(start_location="Surat,  Gujarat")
+
+    def test_tokens_are_normalized(self):
+        tokens = location_tokens("Surat,  Gujarat")
+        self.assertIn(("term", "surat"), tokens)
+        self.assertIn(("trigram", "t g"), tokens)
+        self.assertNotIn(("term", "surat,"), tokens)
+        self.assertEqual(LocationToken.objects.filter(carpool=self.carpool, point="start", kind="term").count(), 2)
+
+    def matching_ids(self, search, point):
+        return list(matching_carpool_ids(search, point).values_list("createcarpool_id", flat=True))
+
+    def test_matching_carpool_ids(self):
+        carpool_id = self.carpool.createcarpool_id
+        self.assertEqual(self.matching_ids("SURAT gujarat", "start"), [carpool_id])
+        self.assertEqual(self.matching_ids("rat, guj", "start"), [carpool_id])
+        self.assertEqual(self.matching_ids("gu", "start"), [carpool_id])  # short text: word prefix
+        self.assertEqual(self.matching_ids("at", "start"), [])
+        self.assertEqual(self.matching_ids("surat", "end"), [])
+        self.assertEqual(self.matching_ids("gujarat surat", "start"), [])
+        self.assertIsNone(matching_carpool_ids(" , ", "start"))
+
+    def test_text_filters_stay_one_query(self):
+        with self.assertNumQueries(0):
+            query = location_match_q("Surat Gujarat Highway", "start", None, None)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(CreateCarpool.objects.filter(query)), [self.carpool])
+
+    def test_tokens_follow_location_changes(self):
+        carpool = CreateCarpool.objects.get(pk=self.carpool.pk)
+        carpool.available_seats = 2
+        with self.assertNumQueries(1):
+            carpool.save()
+
+        carpool.start_location = "Navsari"
+        carpool.save()
+        self.assertEqual(self.matching_ids("surat", "start"), [])
+        self.assertEqual(self.matching_ids("navsari", "start"), [carpool.createcarpool_id])
+
+    def test_sort_carpools_by_location(self):
+        self.client.force_authenticate(self.driver, token="tok")
+        response = self.client.post("/api/carpool/sort-carpools/", {"start_location": "surat", "end_location": "vadodara"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["data"]["Carpools"]), 1)
+
+        response = self.client.post("/api/carpool/sort-carpools/", {"start_location": "mumbai"}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+class PlaceGraphTestCase(CarpoolTestCase):
+    def test_graph_follows_carpools(self):
+        first = self.create_carpool(start_location="Surat", end_location="Ahmedabad")
+        self.create_carpool(start_location="surat,", end_location="Ahmedabad")
+        self.create_carpool(start_location="Ahmedabad", end_location="Vadodara")
+        self.assertEqual(PlaceEdge.objects.get(from_place="surat", to_place="ahmedabad").carpool_count, 2)
+        self.assertEqual(place_neighbors(["Ahmedabad"]), {"surat", "vadodara"})
+
+        first.end_location = "Navsari"
+        first.save()
+        self.assertEqual(PlaceEdge.objects.get(from_place="surat", to_place="ahmedabad").carpool_count, 1)
+        self.assertEqual(place_neighbors(["Navsari"]), {"surat"})
+
+        # cascaded deletes leave the graph too
+        self.driver.delete()
+        self.assertEqual(place_neighbors(["Surat", "Ahmedabad"]), set())
+
+    def test_known_stop(self):
+        carpool = self.create_carpool(start_location="Surat", end_location="Ahmedabad")
+        self.create_carpool(start_location="Vadodara Railway Station", end_location="Ahmedabad")
+
+        with self.assertNumQueries(1):
+            self.assertTrue(is_text_based_intermediate("Vadodara", carpool))
+        self.assertTrue(is_known_stop("surat", "Surat", "Ahmedabad"))
+        self.assertFalse(is_known_stop("Mumbai", "Surat", "Ahmedabad"))
+
+        # a failed lookup is no match
+        with mock.patch("carpooling_app.utils.is_known_stop", side_effect=Exception("database unavailable")):
+            self.assertIs(is_text_based_intermediate("Vadodara", carpool), False)
+
+    def test_rebuild(self):
+        self.create_carpool(start_location="Surat", end_location="Ahmedabad")
+        PlaceEdge.objects.all().delete()
+        self.assertEqual(rebuild_place_graph(), 1)
+        self.assertEqual(place_neighbors(["Surat"]), {"ahmedabad"})
+
+class BackfillTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        route_cache.clear_memory()
+        self.addCleanup(route_cache.clear_memory)
+        self.osrm = OSRMStubServer().__enter__()
+        self.addCleanup(self.osrm.__exit__)
+        patcher = mock.patch("carpooling_app.utils.OSRM_BASE_URL", self.osrm.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_backfill_fills_coordinates_and_distances_in_bulk(self):
+        first = self.create_carpool()
+        second = self.create_carpool((21.1702, 72.8311), end_location="Ahmedabad")
+        current_time = timezone.now() + timedelta(minutes=1)
+
+        self.assertEqual(backfill_carpools(current_time=current_time), {"done": 2, "retry": 0, "failed": 0})
+        self.assertEqual(len(self.osrm.requests), 1)  # one /table request for both
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((float(first.latitude_end), float(first.longitude_end)), (22.3072, 73.1812))
+        self.assertGreater(first.distance_km, second.distance_km / 2)
+        self.assertEqual(first.start_grid_cell, grid_cell(21.1702, 72.8311))
+        self.assertEqual(second.end_grid_cell, grid_cell(second.latitude_end, second.longitude_end))
+        self.assertEqual(first.updated_at, current_time)
+
+        self.assertEqual(backfill_carpools(), {"done": 0, "retry": 0, "failed": 0})
+
+    def test_unresolved_rows_back_off_then_get_an_estimate(self):
+        carpool = self.create_carpool(start_location="Unknown Village")
+        now = timezone.now()
+        with mock.patch("carpooling_app.geocoders.NominatimGeocoder.geocode", return_value=(None, None)):
+            self.assertEqual(backfill_carpools(current_time=now)["retry"], 1)
+            self.assertEqual(backfill_carpools(current_time=now)["retry"], 0)  # not due yet
+            for attempt in range(2, ENRICHMENT_MAX_ATTEMPTS + 1):
+                backfill_carpools(current_time=now + timedelta(days=attempt))
+
+        carpool.refresh_from_db()
+        self.assertEqual(carpool.enrichment_status, "failed")
+        self.assertGreater(carpool.distance_km, 0)
+        self.assertIsNone(carpool.latitude_start)
+
+    def test_search_does_not_write_or_call_osrm(self):
+        carpool = self.create_carpool((21.1702, 72.8311), (22.3072, 73.1812))
+        response = self.client.post("/api/carpool/search-carpools/", {"start_location": "Surat", "end_location": "Vadodara"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        carpool.refresh_from_db()
+        self.assertEqual(carpool.distance_km, 0)
+        self.assertEqual(self.osrm.requests, [])
+
+class DateRangeFilterTestCase(CarpoolTestCase):
+    def create_carpool(self, departure_time):
+        return super().create_carpool((21.1702, 72.8311), (22.3072, 73.1812), departure_time=departure_time)
+
+    def test_day_range(self):
+        day_start, day_end = day_range("2026-03-05")
+        self.assertEqual((day_start.day, day_end.day, day_start.hour), (5, 6, 0))
+        with self.assertRaises(ValueError):
+            day_range("05/03/2026")
+
+    def test_search_filters_on_departure_day(self):
+        tomorrow = (timezone.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+        on_day = self.create_carpool(tomorrow)
+        self.create_carpool(tomorrow + timedelta(days=1))
+
+        response = self.client.post("/api/carpool/search-carpools/", {"start_location": "Surat", "end_location": "Vadodara", "date": tomorrow.strftime("%Y-%m-%d")}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["createcarpool_id"] for c in response.data["data"]["Carpools"]], [on_day.createcarpool_id])
+
+        response = self.client.post("/api/carpool/search-carpools/", {"start_location": "Surat", "date": "tomorrow"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+class RankingTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_driver = self.create_user("driver2", role="driver")
+
+    def create_carpool(self, lat, lon, **fields):
+        return super().create_carpool((lat, lon), (22.3072, 73.1812), **fields)
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit(None), DEFAULT_RESULT_LIMIT)
+        self.assertEqual(parse_limit("5"), 5)
+        self.assertEqual(parse_limit(10 ** 6), MAX_RESULT_LIMIT)
+        for value in ("0", "-3", "many"):
+            with self.assertRaises(ValueError):
+                parse_limit(value)
+
+    def test_ranked_page_keeps_best_in_order(self):
+        keys = [(-0.2, 1), (-0.9, 2), (-0.5, 3), (-0.9, 4), (-0.1, 5)]
+        self.assertEqual(ranked_page(keys, None, 3), ([1, 3, 2], (-0.5, 3)))
+        self.assertEqual(ranked_page(keys, [-0.5, 3], 3), ([0, 4], None))
+        self.assertEqual(ranked_page([], None, 3), ([], None))
+
+    def test_search_ranks_closest_pickup_first_and_applies_limit(self):
+        far = self.create_carpool(21.25, 72.90)
+        near = self.create_carpool(21.1702, 72.8311)
+        self.create_carpool(21.30, 72.95, carpool_creator_driver=self.other_driver, departure_time=timezone.now() + timedelta(hours=48))
+
+        response = self.client.post("/api/carpool/search-carpools/", {"start_location": "Surat", "end_location": "Vadodara", "start_latitude": 21.1702,
+                                                                      "start_longitude": 72.8311, "limit": 2}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"]["total_matches"], 3)
+        self.assertEqual([c["createcarpool_id"] for c in response.data["data"]["Carpools"]], [near.createcarpool_id, far.createcarpool_id])
+
+    def test_nearby_sorted_by_distance_with_limit(self):
+        far = self.create_carpool(21.20, 72.86)  # ~4.5 KM away, inside NEARBY_RADIUS_KM; created first so row order is not distance order
+        near = self.create_carpool(21.1702, 72.8311)
+
+        response = self.client.post("/api/carpool/find-nearby-carpools/", {"location_latitude": 21.17, "location_longitude": 72.83}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["createcarpool_id"] for c in response.data["data"]], [near.createcarpool_id, far.createcarpool_id])
+
+        response = self.client.post("/api/carpool/find-nearby-carpools/", {"location_latitude": 21.17, "location_longitude": 72.83, "limit": 1}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["total_results"], response.data["total_matches"]), (1, 2))
+        self.assertEqual(response.data["data"][0]["createcarpool_id"], near.createcarpool_id)
+
+class KeysetPaginationTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        departure = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        # two carpools share a departure time, so the id breaks the tie
+        self.carpools = [self.create_carpool(departure_time=departure + timedelta(hours=hours)) for hours in (0, 1, 1, 2, 3)]
+
+    def test_cursor_round_trip(self):
+        values = [timezone.now(), -0.5, 7]
+        self.assertEqual(decode_cursor(encode_cursor(values), 3), values)
+        self.assertIsNone(decode_cursor("", 2))
+        for cursor in ("not-a-cursor", encode_cursor([1, 2, 3])):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, 2)
+
+    def test_carpool_detail_pages_cover_all_rows_once(self):
+        seen, cursor = [], None
+        for _ in range(5):
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            response = self.client.get("/api/carpool/detail/", params)
+            self.assertEqual(response.status_code, 200)
+            seen += [c["createcarpool_id"] for c in response.data["data"]["Carpools details"]]
+            cursor = response.data["data"]["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = sorted(self.carpools, key=lambda c: (c.departure_time, c.createcarpool_id), reverse=True)
+        self.assertEqual(seen, [c.createcarpool_id for c in expected])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.post("/api/carpool/sort-carpools/", {"cursor": "garbage"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+class FeedCacheTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.carpool = self.create_carpool(departure_time=timezone.now() + timedelta(days=1))
+
+    def feed(self):
+        response = self.client.get("/api/carpool/detail/")
+        return response.data["data"]["Carpools details"] if response.status_code == 200 else []
+
+    def test_cached_feed_counts_hits_and_rebuilds(self):
+        builds = []
+        build = lambda: builds.append(1) or {"page": len(builds)}
+        hits_before = feed_cache_stats.as_dict()["hits"]
+
+        self.assertEqual(cached_feed({"limit": 10}, build), ({"page": 1}, False))
+        self.assertEqual(cached_feed({"limit": 10}, build), ({"page": 1}, True))
+        self.assertEqual(cached_feed({"limit": 5}, build), ({"page": 2}, False))
+        invalidate_carpool_feed()
+        self.assertEqual(cached_feed({"limit": 10}, build), ({"page": 3}, False))
+        self.assertEqual(feed_cache_stats.as_dict()["hits"], hits_before + 1)
+
+    def test_feed_is_served_from_cache_until_a_carpool_changes(self):
+        self.assertEqual(self.feed()[0]["available_seats"], 3)
+
+        # a write that skips the signals is not seen until the cache is invalidated
+        CreateCarpool.objects.filter(pk=self.carpool.pk).update(add_note="changed quietly")
+        self.assertNotEqual(self.feed()[0]["add_note"], "changed quietly")
+
+        self.carpool.available_seats = 2  # e.g. a booking approved
+        self.carpool.save()
+        self.assertEqual(self.feed()[0]["available_seats"], 2)
+
+        self.carpool.delete()
+        self.assertEqual(self.feed(), [])
+
+class DriverRatingStatsTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.carpool = self.create_carpool(departure_time=timezone.now() + timedelta(days=1))
+        self.booking = self.create_booking(self.carpool)
+
+    def review(self, rating):
+        return ReviewRating.objects.create(review_given_by=self.passenger, review_for=self.driver, carpool_driver=self.carpool,
+                                           booking_person_name=self.booking, rating=rating)
+
+    def stats(self):
+        return DriverRatingStats.objects.get(driver=self.driver)
+
+    def test_reviews_update_stats_incrementally(self):
+        first = self.review(5)
+        self.review(4)
+        self.review(4)
+        self.assertEqual((self.stats().review_count, self.stats().rating_sum, self.stats().average_rating), (3, 13, 4.33))
+        self.assertEqual(self.stats().histogram, {1: 0, 2: 0, 3: 0, 4: 2, 5: 1})
+
+        first.rating = 1
+        first.save()
+        self.assertEqual(self.stats().histogram, {1: 1, 2: 0, 3: 0, 4: 2, 5: 0})
+
+        first.delete()
+        self.assertEqual((self.stats().review_count, self.stats().rating_sum), (2, 8))
+
+    def test_rebuild_matches_incremental_stats(self):
+        for rating in (3, 5, 5):
+            self.review(rating)
+        expected = self.stats().histogram
+        DriverRatingStats.objects.all().delete()
+
+        self.assertEqual(rebuild_rating_stats(), 1)
+        self.assertEqual((self.stats().histogram, self.stats().average_rating), (expected, 4.33))
+
+    def test_serializer_reads_stats_without_aggregate_queries(self):
+        self.review(4)
+        carpools = list(CreateCarpool.objects.select_related("carpool_creator_driver__rating_stats", "updated_by"))
+        with self.assertNumQueries(0):
+            data = CreateCarpoolSerializer(carpools, many=True).data
+        self.assertEqual(data[0]["driver_average_rating"], 4)
+
+class QueryBudgetTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        now = timezone.now()
+        for hours in (24, 25, 26):
+            self.create_carpool(departure_time=now + timedelta(hours=hours))
+
+    def test_query_shape_ignores_values(self):
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x'"), query_shape("SELECT * FROM t WHERE id IN (%s) AND name = 'y'"))
+
+    def test_recorder_finds_repeated_queries(self):
+        with QueryRecorder() as recorder:
+            for carpool in CreateCarpool.objects.all():
+                carpool.carpool_creator_driver.first_name  # one driver query per carpool
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(list(recorder.duplicates().values()), [3])
+
+    def test_middleware_reports_and_enforces_budget(self):
+        response = self.client.get("/api/carpool/detail/")
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(int(response["X-DB-Queries"]), carpool_detail.query_budget)
+        self.assertIn("GET /api/carpool/detail/", endpoint_query_stats.as_dict())
+
+        cache.clear()
+        with mock.patch.object(carpool_detail, "query_budget", 0), enforce_query_budgets():
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/api/carpool/detail/")
+
+class EagerLoadingTestCase(CarpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        for n in range(2, 5):
+            driver, passenger = self.create_user(f"driver{n}", role="driver"), self.create_user(f"passenger{n}")
+            carpool = self.create_carpool(carpool_creator_driver=driver, updated_by=driver)
+            self.create_booking(carpool, passenger_name=passenger, booked_by=passenger, updated_by=passenger)
+
+    def test_nested_serializers_declare_their_relations(self):
+        select, prefetch = BookingSerializer.eager_loading_fields()
+        self.assertIn("carpool_driver_name__carpool_creator_driver__rating_stats", select)
+        self.assertIn("passenger_name", select)
+        self.assertEqual(prefetch, [])
+
+    def test_listing_a_queryset_costs_one_query(self):
+        for serializer in (BookingSerializer, BookingDetailSerializer):
+            with self.assertNumQueries(1):
+                data = serializer(Booking.objects.with_effective_status().order_by("booking_id"), many=True).data
+            self.assertEqual(len(data), 3)
+
+        with self.assertNumQueries(1):
+            CreateCarpoolSerializer(CreateCarpool.objects.all(), many=True).data
@@ -1,5 +1,5 @@
 from tokenize import TokenError
-from django.db.models import Q
+from django.db.models import Count, Q
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -195,7 +195,6 @@ def view_profile(request):
     If any error occurs, it will return a 400 status code with an error message.
     """
     user = request.user
-    ride_status_function(request)
 
     try:
         if not user:
@@ -218,7 +217,6 @@ def user_dashboard(request):
     user's carpools with extra details, and bookings with extra info.
     """
     user = request.user
-    ride_status_function(request)
 
     if not user :
         return Response({"status": "fail", "message": "User not found/exist"},status=status.HTTP_404_NOT_FOUND)
@@ -245,9 +243,8 @@ def user_dashboard(request):
         user_serialized = UserSerializer(user, context={'request': request})
 
         # Carpool Details
-        carpools_queryset = CreateCarpool.objects.filter(carpool_creator_driver=user)
+        carpools_queryset = CreateCarpool.objects.with_effective_status().filter(carpool_creator_driver=user).annotate(bookings_count=Count("bookings"))
         carpools_list = []
-        print("=======>>>>>>>>> LENGTH OF CARPOOL", len(carpools_queryset))
         if len(carpools_queryset) == 0:
                 carpools_list = "You didn't created any carpool ride yet."
         else:
@@ -259,8 +256,8 @@ def user_dashboard(request):
                     "departure_time": carpool.departure_time,
                     "arrival_time": carpool.arrival_time,
                     "available_seats": carpool.available_seats,
-                    "carpool_ride_status": carpool.carpool_ride_status,
-                    "bookings_count": Booking.objects.filter(carpool_driver_name=carpool).count()
+                    "carpool_ride_status": carpool.effective_ride_status,
+                    "bookings_count": carpool.bookings_count
                 })
 
         # Bookings Details
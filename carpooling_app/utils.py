@@ -1,23 +1,33 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.forms import ValidationError
 from django.utils import timezone
+import logging
 import random
 from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework.response import Response
-import requests
-from .models import Activity, Booking, CreateCarpool, User
+from .models import Activity, Booking, User
 from django.core.mail import EmailMultiAlternatives
 from django.utils.html import strip_tags
 from django.conf import settings
-from geopy.geocoders import Nominatim
+from functools import reduce
 from math import atan2, radians, cos, sin, sqrt
+from operator import or_
 from geopy.distance import geodesic
 from django.db.models import Q
 from rest_framework import status
-from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Sum
+from .geo_index import bounding_box_q
+from .geocode_cache import geocode_cache, normalize_place_key
+from .geocoders import get_geocoder
+from .route_cache import route_cache, route_key
+from .route_geometry import decode_polyline, on_route_corridor
+from .http_client import ExternalCallSkipped, external_client
+from .location_tokens import location_text_matches, text_match_q
+from .place_graph import is_known_stop
+
+logger = logging.getLogger(__name__)
 
 def user_is_admin(user):
     """
@@ -64,6 +74,14 @@ def send_otp_email(email, otp):
         print("Email send failed:", str(e))
         return False
 
+## Day range [start, end) of a "YYYY-MM-DD" date, for index-friendly departure_time filters
+def day_range(date_text):
+    """
+    Raises ValueError if date_text is not a YYYY-MM-DD date.
+    """
+    day = datetime.strptime(str(date_text).strip(), "%Y-%m-%d")
+    return day, day + timedelta(days=1)
+
 ## Add INR and KM units to contribution_per_km and distance_km.
 def km_inr_format(data):
     """
@@ -259,68 +277,12 @@ def ride_status_function(request=None):
     """
     Auto-update ride + booking status for all carpools and bookings
     based on current time, driver action, and passenger action.
-    """
-    current_time = timezone.now()
-
-    # Consider only relevant carpools
-    carpools = CreateCarpool.objects.filter(carpool_ride_status__in=["upcoming", "active", "not_started_yet"])
-
-    for carpool in carpools:
-        start = carpool.departure_time
-        end = carpool.arrival_time
-        original_status = carpool.carpool_ride_status
-
-        # Update carpool ride status
-        if current_time < start:
-            carpool.carpool_ride_status = "upcoming"
-
-        elif start <= current_time < end:
-            carpool.carpool_ride_status = "active"
 
-        elif end <= current_time <= end + timedelta(hours=1):
-            if carpool.carpool_ride_status != "cancelled":
-                carpool.carpool_ride_status = "completed"
-
-        elif current_time > end + timedelta(hours=1):
-            if carpool.carpool_ride_status == "active":
-                carpool.carpool_ride_status = "auto_completed"
-
-        # Save only if status changed
-        if carpool.carpool_ride_status != original_status:
-            carpool.save()
-
-        # Update related bookings
-        bookings = Booking.objects.filter(carpool_driver_name=carpool)
-        for booking in bookings:
-
-            # Passenger manually cancelled
-            if booking.booking_status == "cancelled":
-                booking.ride_status = "cancelled"
-
-            # Driver/system cancelled
-            elif carpool.carpool_ride_status == "cancelled":
-                if booking.booking_status in ["pending", "waitlisted", "confirmed"]:
-                    booking.booking_status = "cancelled"
-                    booking.ride_status = "did_not_travelled"
-
-            # Ride active
-            elif carpool.carpool_ride_status == "active":
-                if booking.booking_status in ["confirmed", "pending", "waitlisted"]:
-                    booking.ride_status = "active"
-
-            # Ride completed or auto-completed
-            elif carpool.carpool_ride_status in ["completed", "auto_completed"]:
-                if booking.booking_status == "confirmed":
-                    booking.ride_status = "completed"
-                else:
-                    booking.booking_status = "cancelled"
-                    booking.ride_status = "did_not_travelled"
-
-            # Upcoming ride
-            elif carpool.carpool_ride_status == "upcoming":
-                booking.ride_status = "upcoming"
-
-            booking.save()
+    Kept for manual/admin use only; read endpoints no longer call this,
+    the `run_ride_scheduler` management command runs it in the background.
+    """
+    from .ride_lifecycle import sweep_ride_statuses
+    return sweep_ride_statuses()
 
 ## send/receive contacts form from user to admin.
 def send_contact_email(name, email, phone_number, your_message):
@@ -364,25 +326,30 @@ def count_earning(user_id):
         print("failed:", str(e))
         return 0
 
-def calculate_passenger_trip_details(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon):
+def calculate_passenger_trip_details(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon, road_km=None):
     """
     Calculates passenger-specific trip details:
     - waiting time (minutes)
     - expected pickup/drop times
     - distance travelled
     - estimated fare
+    road_km: trip_road_distances() result when already known (e.g. read from the route cache), else it is fetched.
     """
     try:
         start_lat, start_lon = carpool.latitude_start, carpool.longitude_start
         end_lat, end_lon = carpool.latitude_end, carpool.longitude_end
 
+        # Road distances from OSRM (or the route cache), straight line where unknown
+        if road_km is None:
+            road_km = trip_road_distances(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon)
+
         # Total distance and duration of carpool
-        total_distance_km = geodesic((start_lat, start_lon), (end_lat, end_lon)).km
+        total_distance_km = road_km["start_to_end"] or geodesic((start_lat, start_lon), (end_lat, end_lon)).km
         total_duration_min = (carpool.arrival_time - carpool.departure_time).total_seconds() / 60
 
         # Distances for passenger
-        dist_start_to_pickup = geodesic((start_lat, start_lon), (pickup_lat, pickup_lon)).km
-        dist_pickup_to_drop = geodesic((pickup_lat, pickup_lon), (drop_lat, drop_lon)).km
+        dist_start_to_pickup = road_km["start_to_pickup"] if road_km["start_to_pickup"] is not None else geodesic((start_lat, start_lon), (pickup_lat, pickup_lon)).km
+        dist_pickup_to_drop = road_km["pickup_to_drop"] if road_km["pickup_to_drop"] is not None else geodesic((pickup_lat, pickup_lon), (drop_lat, drop_lon)).km
 
         # Time proportional to distance
         time_start_to_pickup = (dist_start_to_pickup / total_distance_km) * total_duration_min
@@ -403,13 +370,17 @@ def calculate_passenger_trip_details(carpool, pickup_lat, pickup_lon, drop_lat,
             "estimated_fare": estimated_fare
         }
     except Exception:
-        return {
-            "waiting_time_min": None,
-            "expected_pickup_time": None,
-            "expected_drop_time": None,
-            "distance_travelled_km": None,
-            "estimated_fare": None
-        }
+        return empty_trip_details()
+
+## Trip details with unknown values (calculation failed or distances not enriched yet)
+def empty_trip_details():
+    return {
+        "waiting_time_min": None,
+        "expected_pickup_time": None,
+        "expected_drop_time": None,
+        "distance_travelled_km": None,
+        "estimated_fare": None
+    }
     
 OSRM_BASE_URL = "http://router.project-osrm.org"  # public demo server; for production consider self-hosting
 
@@ -417,45 +388,40 @@ OSRM_BASE_URL = "http://router.project-osrm.org"  # public demo server; for prod
 def get_lat_lng(place_name):
     """
     Returns latitude/longitude cordinates for place name, else (None, None)
-    param query: The address, query or a structured query
-            you wish to geocode.
-            For a structured query, provide a dictionary whose keys
-            are one of: `street`, `city`, `county`, `state`, `country`, or
-            `postalcode`.
+    Uses the configured geocoder backends (see geocoders.py): the offline gazetteer first,
+    Nominatim only as a fallback for places it doesn't know.
     """
-    geolocator = Nominatim(user_agent="carpool_app")
-    try:
-        loc = geolocator.geocode(place_name)
-        if loc:
-            return loc.latitude, loc.longitude
-    except Exception as e:
-        return Response({"status":"error", "message": f"Geocoding failed for {place_name}: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    return None, None
+    return get_geocoder().geocode(place_name)
 
-location_cache = {}
 def get_lat_lng_cached(location_name):
     """
     Return cached lat/lng if exists, else geocode and cache it.
+    Uses the shared geocode cache (geocode_cache.py), unknown places are cached too.
     """
-    if location_name in location_cache:
-        return location_cache[location_name]
-
-    lat, lon = get_lat_lng(location_name)
-    location_cache[location_name] = (lat, lon)
-    return lat, lon
+    return geocode_cache.get_or_geocode(location_name, get_lat_lng)
 
 def get_road_distance_osrm(lat1, lon1, lat2, lon2, profile="driving"):
     """
     Use OSRM public API to fetch by-road distance (in KM).
     Returns float km or None on failure.
+    Distances are cached by snapped coordinates (see route_cache.py), so a route is fetched at most once per ROUTE_CACHE_TTL.
+    While OSRM's circuit breaker is open or the request's time budget is used up, the straight-line estimate is returned instead.
     """
+    cached_km = route_cache.get(lat1, lon1, lat2, lon2, profile)
+    if cached_km is not None:
+        return cached_km
+
     try:
         # OSRM order: longitude, latitude
         coordinates = f"{lon1},{lat1};{lon2},{lat2}"
         url = f"{OSRM_BASE_URL}/route/v1/{profile}/{coordinates}?overview=false&annotations=distance"
-        resp = requests.get(url, timeout=6)
+        try:
+            resp = external_client.get(url, timeout=6)
+        except ExternalCallSkipped as e:
+            logger.warning("OSRM skipped: %s", e)
+            return calculate_realistic_distance(lat1, lon1, lat2, lon2)
         if resp.status_code != 200:
-            print("OSRM request failed:", resp.status_code)
+            logger.warning("OSRM request failed: %s", resp.status_code)
             return None
         data = resp.json()
         # print("=========>>>>>>> OSRM response <<<<<<<=========:", data)
@@ -464,11 +430,188 @@ def get_road_distance_osrm(lat1, lon1, lat2, lon2, profile="driving"):
             distance_m = data["routes"][0].get("distance")
             if distance_m is None:
                 return None
-            return round(distance_m / 1000.0, 2)
+            distance_km = round(distance_m / 1000.0, 2)
+            try:
+                route_cache.set(lat1, lon1, lat2, lon2, distance_km, profile)
+            except Exception as e:
+                logger.warning("Route cache write failed: %s", e)
+            return distance_km
     except Exception as e:
         return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     return None
 
+## OSRM road route: distance (KM) and the full route geometry
+def get_road_route_osrm(lat1, lon1, lat2, lon2, profile="driving"):
+    """
+    Returns (distance_km, [(lat, lon), ...]) or None on failure (also when the call is skipped, no estimate is made up).
+    The distance is stored in the route cache like get_road_distance_osrm does.
+    """
+    try:
+        coordinates = f"{lon1},{lat1};{lon2},{lat2}"
+        url = f"{OSRM_BASE_URL}/route/v1/{profile}/{coordinates}?overview=full&geometries=polyline"
+        resp = external_client.get(url, timeout=6)
+        if resp.status_code != 200:
+            logger.warning("OSRM route request failed: %s", resp.status_code)
+            return None
+        routes = resp.json().get("routes")
+        if not routes or routes[0].get("distance") is None or not routes[0].get("geometry"):
+            return None
+
+        distance_km = round(routes[0]["distance"] / 1000.0, 2)
+        try:
+            route_cache.set(lat1, lon1, lat2, lon2, distance_km, profile)
+        except Exception as e:
+            logger.warning("Route cache write failed: %s", e)
+        return distance_km, decode_polyline(routes[0]["geometry"])
+    except Exception as e:
+        logger.warning("OSRM route request failed: %s", e)
+        return None
+
+# Most sources (and destinations) sent in one OSRM /table request, the public server allows 100 coordinates
+OSRM_TABLE_BLOCK_SIZE = 50
+
+## One OSRM /table request: road distances (KM) from every source to every destination
+def fetch_osrm_table(sources, destinations, profile="driving"):
+    """
+    sources / destinations: lists of (lat, lon).
+    Returns a list of rows (None where OSRM found no route), or None if the request failed or was skipped
+    (open circuit breaker / no time budget left), callers then use straight-line distances.
+    """
+    try:
+        # OSRM order: longitude, latitude
+        coordinates = ";".join(f"{lon},{lat}" for lat, lon in sources + destinations)
+        source_indexes = ";".join(str(i) for i in range(len(sources)))
+        destination_indexes = ";".join(str(len(sources) + j) for j in range(len(destinations)))
+        url = f"{OSRM_BASE_URL}/table/v1/{profile}/{coordinates}?sources={source_indexes}&destinations={destination_indexes}&annotations=distance"
+        resp = external_client.get(url, timeout=6)
+        if resp.status_code != 200:
+            logger.warning("OSRM table request failed: %s", resp.status_code)
+            return None
+        distances = resp.json().get("distances")
+        if not distances:
+            return None
+        return [[None if meters is None else round(meters / 1000.0, 2) for meters in row] for row in distances]
+    except Exception as e:
+        logger.warning("OSRM table request failed: %s", e)
+        return None
+
+## Road distance matrix (KM) for many sources x destinations with as few OSRM calls as possible
+def road_distance_matrix(sources, destinations, profile="driving"):
+    """
+    Returns one row per source with the road distance to every destination (None where unknown).
+    Pairs already in the route cache are not requested again; the others are fetched with one
+    /table request per OSRM_TABLE_BLOCK_SIZE x OSRM_TABLE_BLOCK_SIZE block and stored in the cache.
+    """
+    sources = [(float(lat), float(lon)) for lat, lon in sources]
+    destinations = [(float(lat), float(lon)) for lat, lon in destinations]
+    cached = route_cache.get_many([(origin, destination) for origin in sources for destination in destinations], profile)
+    matrix = [[cached.get(route_key(*origin, *destination, profile)) for destination in destinations] for origin in sources]
+
+    missing_sources = sorted({i for i, row in enumerate(matrix) for distance_km in row if distance_km is None})
+    missing_destinations = sorted({j for row in matrix for j, distance_km in enumerate(row) if distance_km is None})
+
+    fetched = {}
+    for source_start in range(0, len(missing_sources), OSRM_TABLE_BLOCK_SIZE):
+        source_block = missing_sources[source_start:source_start + OSRM_TABLE_BLOCK_SIZE]
+        for destination_start in range(0, len(missing_destinations), OSRM_TABLE_BLOCK_SIZE):
+            destination_block = missing_destinations[destination_start:destination_start + OSRM_TABLE_BLOCK_SIZE]
+            table = fetch_osrm_table([sources[i] for i in source_block], [destinations[j] for j in destination_block], profile)
+            if table is None:
+                continue
+            for i, row in zip(source_block, table):
+                for j, distance_km in zip(destination_block, row):
+                    if distance_km is not None:
+                        matrix[i][j] = distance_km
+                        fetched[(sources[i], destinations[j])] = distance_km
+
+    if fetched:
+        try:
+            route_cache.set_many(fetched, profile)
+        except Exception as e:
+            logger.warning("Route cache write failed: %s", e)
+    return matrix
+
+## Road distances (KM) for a list of (origin, destination) pairs, only those pairs are looked up or requested
+def road_distances(pairs, profile="driving", fetch=True):
+    """
+    pairs: list of ((lat1, lon1), (lat2, lon2)).
+    Returns the distance of each pair (None where unknown), in the same order.
+    With fetch, pairs missing from the route cache are requested with one /table request per origin
+    (origins missing the same destinations share it) and stored in the cache; without it only the cache is read.
+    """
+    pairs = [((float(lat1), float(lon1)), (float(lat2), float(lon2))) for (lat1, lon1), (lat2, lon2) in pairs]
+    cached = route_cache.get_many(pairs, profile) if pairs else {}
+    distances = [cached.get(route_key(*origin, *destination, profile)) for origin, destination in pairs]
+    if not fetch:
+        return distances
+
+    missing = {}  # origin -> destinations not cached
+    for (origin, destination), distance_km in zip(pairs, distances):
+        if distance_km is None:
+            missing.setdefault(origin, set()).add(destination)
+    origins_by_destinations = {}
+    for origin, destinations in missing.items():
+        origins_by_destinations.setdefault(tuple(sorted(destinations)), []).append(origin)
+
+    fetched = {}
+    for destinations, origins in origins_by_destinations.items():
+        for source_start in range(0, len(origins), OSRM_TABLE_BLOCK_SIZE):
+            source_block = origins[source_start:source_start + OSRM_TABLE_BLOCK_SIZE]
+            for destination_start in range(0, len(destinations), OSRM_TABLE_BLOCK_SIZE):
+                destination_block = list(destinations[destination_start:destination_start + OSRM_TABLE_BLOCK_SIZE])
+                table = fetch_osrm_table(source_block, destination_block, profile)
+                if table is None:
+                    continue
+                for origin, row in zip(source_block, table):
+                    for destination, distance_km in zip(destination_block, row):
+                        if distance_km is not None:
+                            fetched[(origin, destination)] = distance_km
+
+    if fetched:
+        try:
+            route_cache.set_many(fetched, profile)
+        except Exception as e:
+            logger.warning("Route cache write failed: %s", e)
+    return [fetched.get(pair) if distance_km is None else distance_km for pair, distance_km in zip(pairs, distances)]
+
+## Fetch road distances for many (origin, destination) pairs into the route cache in one batch
+def prime_road_distances(pairs, profile="driving"):
+    """
+    pairs: list of ((lat1, lon1), (lat2, lon2)); pairs with missing coordinates are skipped.
+    Later get_road_distance_osrm calls for these pairs are cache hits.
+    """
+    road_distances([(origin, destination) for origin, destination in pairs if None not in origin + destination], profile)
+
+# Road distances a passenger's trip needs
+TRIP_ROAD_DISTANCES = ("start_to_pickup", "pickup_to_drop", "start_to_end")
+
+## (origin, destination) pair of each TRIP_ROAD_DISTANCES distance, without pairs missing a coordinate
+def trip_road_pairs(carpool, pickup, drop):
+    start = (carpool.latitude_start, carpool.longitude_start)
+    end = (carpool.latitude_end, carpool.longitude_end)
+    pairs = {"start_to_pickup": (start, pickup), "pickup_to_drop": (pickup, drop), "start_to_end": (start, end)}
+    return {name: (origin, destination) for name, (origin, destination) in pairs.items() if None not in origin + destination}
+
+## Road distances a passenger's trip needs, fetched for exactly its three pairs
+def trip_road_distances(carpool, pickup_lat, pickup_lon, drop_lat, drop_lon):
+    """
+    Returns {"start_to_pickup", "pickup_to_drop", "start_to_end"} in KM, None where unknown.
+    """
+    pairs = trip_road_pairs(carpool, (pickup_lat, pickup_lon), (drop_lat, drop_lon))
+    distances = dict(zip(pairs, road_distances(list(pairs.values()))))
+    return {name: distances.get(name) for name in TRIP_ROAD_DISTANCES}
+
+## Road distances of many passenger trips from the route cache only (one lookup, no OSRM calls)
+def cached_trip_road_distances(trips):
+    """
+    trips: list of (carpool, (pickup_lat, pickup_lon), (drop_lat, drop_lon)).
+    Returns a trip_road_distances() dict per trip; distances not cached yet (the enrichment worker primes them) are None.
+    """
+    trip_pairs = [trip_road_pairs(*trip) for trip in trips]
+    distances = iter(road_distances([pair for pairs in trip_pairs for pair in pairs.values()], fetch=False))
+    # pairs are in TRIP_ROAD_DISTANCES order, so the distances are consumed in the order they were asked for
+    return [{name: next(distances) if name in pairs else None for name in TRIP_ROAD_DISTANCES} for pairs in trip_pairs]
+
 ## Calculate realistic distance between two points in km.
 def calculate_realistic_distance(lat1, lon1, lat2, lon2):
     """
@@ -566,31 +709,60 @@ def is_point_on_route(latA, lonA, latB, lonB, latP, lonP, threshold_km=25):
     except Exception as e:
         return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Radius (KM) within which a carpool point matches a searched location
+LOCATION_MATCH_RADIUS_KM = 20
+
+# SQL prefilter for matches_location: rows it can't reject (text match OR inside the radius bounding box)
+def location_match_q(search_loc, point, user_lat, user_lon, nearby_ids=None):
+    """
+    Returns a Q object for the "start" or "end" point keeping every carpool matches_location() could accept,
+    so only those rows are loaded before the exact checks.
+    Text matches come from the location token index (location_tokens.py).
+    nearby_ids: optional carpool ids near the user from the in-memory index, used instead of the bounding box.
+    """
+    if not search_loc or not normalize_place_key(search_loc):
+        return Q()
+
+    # a location containing the whole text contains each of its words too, so the longer words alone cover both rules
+    text = normalize_place_key(search_loc)
+    query = reduce(or_, (text_match_q(term, point) for term in [term for term in text.split() if len(term) > 3] or [text]))
+
+    if nearby_ids is not None:
+        query |= Q(createcarpool_id__in=nearby_ids)
+    elif user_lat and user_lon:
+        query |= bounding_box_q(point, user_lat, user_lon, LOCATION_MATCH_RADIUS_KM)
+    return query
+
 # Flexible location matching using multiple strategies 
-def matches_location(search_loc, carpool_loc, user_lat, user_lon, carpool_lat, carpool_lon):
+def matches_location(search_loc, carpool_loc, user_lat, user_lon, carpool_lat, carpool_lon, distance_km=None):
     """
     Flexible location matching using multiple strategies
+    distance_km: optional precomputed user->carpool distance (see distance_kernel.carpool_distance_checks)
     """
     if not search_loc:
         return True
     
-    # Text-based matching (fuzzy)
+    # Text-based matching (fuzzy), on normalized text like the location token index
     try:
-        if search_loc.lower() in carpool_loc.lower():
+        search_text = normalize_place_key(search_loc)
+        carpool_text = normalize_place_key(carpool_loc or "")
+        if location_text_matches(search_text, carpool_text):
             return True
     except Exception:
         return False
     
     # Coordinate-based matching (20km radius)
     if user_lat and user_lon and carpool_lat and carpool_lon:
-        distance = calculate_distance(user_lat, user_lon, float(carpool_lat), float(carpool_lon))
-        if distance <= 20:
+        if distance_km is not None:
+            distance = round(float(distance_km), 2)
+        else:
+            distance = calculate_distance(user_lat, user_lon, float(carpool_lat), float(carpool_lon))
+        if distance <= LOCATION_MATCH_RADIUS_KM:
             return True
 
     #check if search terms appear in carpool location
-    search_terms = search_loc.lower().split()
-    carpool_text = carpool_loc.lower() if carpool_loc else ""
-    
+    search_terms = search_text.split()
+
     # If any search term matches significantly
     for term in search_terms:
         if len(term) > 3 and term in carpool_text:
@@ -599,22 +771,30 @@ def matches_location(search_loc, carpool_loc, user_lat, user_lon, carpool_lat, c
     return False
 
 # Advanced route matching without static data 
-def matches_route(search_end, carpool, user_end_lat, user_end_lon):
+def matches_route(search_end, carpool, user_end_lat, user_end_lon, end_distance_km=None, on_route=None):
     """
     Advanced route matching without static data
+    end_distance_km / on_route: optional precomputed results from distance_kernel.carpool_distance_checks
+    Carpools with a stored route are matched against a corridor around it, others by the A->P->B deviation rule.
     """
     if not search_end:
         return True
     
     # Direct destination match
-    if matches_location(search_end, carpool.end_location, user_end_lat, user_end_lon, carpool.latitude_end, carpool.longitude_end):
+    if matches_location(search_end, carpool.end_location, user_end_lat, user_end_lon, carpool.latitude_end, carpool.longitude_end, distance_km=end_distance_km):
         return True
     
     # Check if search_end is an intermediate point on the route
     if (user_end_lat and user_end_lon and 
         carpool.latitude_start and carpool.longitude_start and
         carpool.latitude_end and carpool.longitude_end):
-        
+
+        if on_route is not None:
+            return bool(on_route)
+        # stored route geometry: point-to-route distance against the corridor width
+        in_corridor = on_route_corridor(carpool, user_end_lat, user_end_lon)
+        if in_corridor is not None:
+            return in_corridor
         return is_point_on_route_dynamic(
             float(carpool.latitude_start), float(carpool.longitude_start),
             float(carpool.latitude_end), float(carpool.longitude_end),
@@ -648,38 +828,11 @@ def is_point_on_route_dynamic(latA, lonA, latB, lonB, latP, lonP, max_deviation_
 # Text-based intermediate matching using static data only
 def is_text_based_intermediate(search_city, carpool):
     """
-    Text-based intermediate matching using static data only (less accurate), but faster to compute than dynamic route matching (geometric), and less resource-intensive than dynamic
+    Text-based intermediate matching using static data only (less accurate), but faster to compute than dynamic route matching (geometric).
+    search_city matches if it is the carpool's start / end or a place other carpools travel to or from them,
+    answered by the place graph (place_graph.py) with one indexed query.
     """
     try:
-
-        # Add locations from current carpool route context
-        route_locations = CreateCarpool.objects.filter(
-            Q(start_location__icontains=carpool.start_location) | Q(end_location__icontains=carpool.end_location)
-            ).values_list('start_location', 'end_location')
-    
-        for start, end in route_locations:
-            if search_city.lower() in start.lower():
-                return True
-            if search_city.lower() in end.lower():
-                return True
-            pass
-    
-        # Check if search city appears in similar routes
-        similar_routes = CreateCarpool.objects.filter(
-            Q(start_location__icontains=carpool.start_location) |
-            Q(end_location__icontains=carpool.end_location) |
-            Q(start_location__icontains=search_city) |
-            Q(end_location__icontains=search_city)
-        )
-
-        for route in similar_routes:
-            route_locations = [route.start_location.lower(), route.end_location.lower()]
-            if (search_city.lower() in route_locations and (carpool.start_location.lower() in route_locations or carpool.end_location.lower() in route_locations)):
-                return True
-
-    except CreateCarpool.DoesNotExist:
-        return Response({"status":"error", "message": "Carpool does not exist"}, status=status.HTTP_404_NOT_FOUND)
-
-    except Exception as e:
-        return Response({"status":"error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    return False
\ No newline at end of file
+        return is_known_stop(search_city, carpool.start_location, carpool.end_location)
+    except Exception:
+        return False
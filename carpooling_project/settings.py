@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -99,8 +100,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'carpooling_app.middleware.ExternalCallBudgetMiddleware',
+    'carpooling_app.middleware.QueryInstrumentationMiddleware',
 ]
 
+# SQL count / N+1 / DB time per endpoint (carpooling_app/query_budget.py); over-budget views fail the tests
+TESTING = sys.argv[1:2] == ['test']
+QUERY_INSTRUMENTATION = DEBUG or TESTING
+QUERY_BUDGET_STRICT = TESTING
+
 ROOT_URLCONF = 'carpooling_project.urls'
 
 TEMPLATES = [
@@ -142,6 +150,18 @@ DATABASES = {
     }
 }
 
+# Cache (public carpool feed, see carpooling_app/feed_cache.py)
+# Local memory is per worker process; use a shared backend (e.g. Redis / Memcached) with several workers,
+# so a write in one worker also drops the feed the others serve.
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carpooling-cache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 